@@ -1,10 +1,20 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
+import altair as alt
 
 from shared.financial import (
-    buy_forecasts,
-    rent_forecasts
+    amortization_schedule,
+    BuyVsRentModel,
+    HISTORICAL_SERIES,
+    backtest_buy_vs_rent,
+    load_historical_series,
+    simulate_buy_vs_rent,
+    sensitivity_analysis,
+    break_even_year,
+    solve_break_even
 )
+from shared.profiling import stage, streamlit_profile
 
 TITLE = "🏡 Buy vs Rent"
 
@@ -13,214 +23,387 @@ st.set_page_config(
    page_icon="📊",
    initial_sidebar_state="expanded",
 )
+with streamlit_profile("buy-vs-rent"):
+    st.title(TITLE)
+
+    with st.sidebar:
+        TIME_PERIOD = st.number_input("Time period (years)", value=30)
+        INFLATION_RATE = st.number_input("Inflation (rate)", value=0.04)
+        BUDGET = st.number_input("Budget (€)", value=350000, step=10000)
+        NET_ANNUAL_INCOME = st.number_input("Monthly net income (€)", value=0, step=200) * 12
+        RENT_INITIAL_AMOUNT = st.number_input(
+            "Initial rent amount (€)", value=1200, step=200
+        ) * 12
+        MARKET_RETURN = st.number_input("Market return (rate)", value=0.05)
+        HOUSE_APPRECIATION_RATE = st.number_input(
+            "House appreciation (rate)", value=0.02
+        )
+        HOUSE_MAINTENANCE_COST_RATE = st.number_input(
+            "House maintenance cost (rate)",
+            value=0.005,
+            min_value=0.000,
+            step=0.005,
+            format="%.3f"
+        )
+        DOWN_PAYMENT_RATE = st.number_input(
+            "Down payment (rate)",
+            help="The percentage of the house price that is paid initially a down payment.",
+            value=0.2,
+            min_value=0.0,
+            max_value=1.0,
+            step=0.05
+        )
+        CAPIAL_GAINS_TAX_RATE = st.number_input(
+            "Capital gains tax (rate)", value=0.20
+        )
+        MORTGAGE_INTEREST_RATE = st.number_input(
+            "Mortgage interest (rate)", value=0.03, min_value=0.0, max_value=1.0
+        )
+        TRANSACTION_COST_RATE = st.number_input(
+            "Transaction cost (rate)", value=0.15,
+            help="The cost of buying / selling a house as a percentage of the price.",
+        )
+
+        st.header("Simulation")
+        MONTE_CARLO = st.toggle(
+            "Monte Carlo mode",
+            help="Simulate random market return, inflation and house appreciation paths around the rates above.",
+        )
+        if MONTE_CARLO:
+            SIMULATION_PATHS = st.number_input(
+                "Simulated paths", value=20000, min_value=1000, step=5000
+            )
+            SIMULATION_SEED = st.number_input("Random seed", value=42, min_value=0)
+            MARKET_RETURN_VOLATILITY = st.number_input(
+                "Market return volatility", value=0.15, min_value=0.0
+            )
+            INFLATION_VOLATILITY = st.number_input(
+                "Inflation volatility", value=0.01, min_value=0.0
+            )
+            HOUSE_APPRECIATION_VOLATILITY = st.number_input(
+                "House appreciation volatility", value=0.05, min_value=0.0
+            )
+
+    HOUSE_PRICE = BUDGET / (1 + TRANSACTION_COST_RATE)
+    TRANSACTION_COST = HOUSE_PRICE * TRANSACTION_COST_RATE
+    assert round(HOUSE_PRICE + TRANSACTION_COST) == BUDGET
+    LOAN_AMOUNT = HOUSE_PRICE * (1 - DOWN_PAYMENT_RATE)
+    EXCEEDING_BUDGET = LOAN_AMOUNT
+    MORGATGE_TERM = TIME_PERIOD
+
+    MODEL_PARAMETERS = dict(
+        time_period=TIME_PERIOD,
+        budget=BUDGET,
+        net_annual_income=NET_ANNUAL_INCOME,
+        rent_initial_amount=RENT_INITIAL_AMOUNT,
+        inflation_rate=INFLATION_RATE,
+        market_return=MARKET_RETURN,
+        house_appreciation_rate=HOUSE_APPRECIATION_RATE,
+        house_maintenance_cost_rate=HOUSE_MAINTENANCE_COST_RATE,
+        down_payment_rate=DOWN_PAYMENT_RATE,
+        capital_gains_tax_rate=CAPIAL_GAINS_TAX_RATE,
+        mortgage_interest_rate=MORTGAGE_INTEREST_RATE,
+        transaction_cost_rate=TRANSACTION_COST_RATE
+    )
 
-st.title(TITLE)
-
-with st.sidebar:
-    TIME_PERIOD = st.number_input("Time period (years)", value=30)
-    INFLATION_RATE = st.number_input("Inflation (rate)", value=0.04)
-    BUDGET = st.number_input("Budget (€)", value=350000, step=10000)
-    NET_ANNUAL_INCOME = st.number_input("Monthly net income (€)", value=0, step=200) * 12
-    RENT_INITIAL_AMOUNT = st.number_input(
-        "Initial rent amount (€)", value=1200, step=200
-    ) * 12
-    MARKET_RETURN = st.number_input("Market return (rate)", value=0.05)
-    HOUSE_APPRECIATION_RATE = st.number_input(
-        "House appreciation (rate)", value=0.02
-    )
-    HOUSE_MAINTENANCE_COST_RATE = st.number_input(
-        "House maintenance cost (rate)",
-        value=0.005,
-        min_value=0.000,
-        step=0.005,
-        format="%.3f"
-    )
-    DOWN_PAYMENT_RATE = st.number_input(
-        "Down payment (rate)",
-        help="The percentage of the house price that is paid initially a down payment.",
-        value=0.2,
-        min_value=0.0,
-        max_value=1.0,
-        step=0.05
-    )
-    CAPIAL_GAINS_TAX_RATE = st.number_input(
-        "Capital gains tax (rate)", value=0.20
-    )
-    MORTGAGE_INTEREST_RATE = st.number_input(
-        "Mortgage interest (rate)", value=0.03, min_value=0.0, max_value=1.0
-    )
-    TRANSACTION_COST_RATE = st.number_input(
-        "Transaction cost (rate)", value=0.15,
-        help="The cost of buying / selling a house as a percentage of the price.",
-    )
-
-HOUSE_PRICE = BUDGET / (1 + TRANSACTION_COST_RATE)
-TRANSACTION_COST = HOUSE_PRICE * TRANSACTION_COST_RATE
-assert round(HOUSE_PRICE + TRANSACTION_COST) == BUDGET
-LOAN_AMOUNT = HOUSE_PRICE * (1 - DOWN_PAYMENT_RATE)
-EXCEEDING_BUDGET = LOAN_AMOUNT
-MORGATGE_TERM = TIME_PERIOD
-
-# calculate worth contributions for the rent scenario, including
-
-# contributions from budget investment on the markets
-
-rent_forcasts_df = rent_forecasts(
-    time_period=TIME_PERIOD,
-    rent_initial_amount=RENT_INITIAL_AMOUNT,
-    inflation_rate=INFLATION_RATE,
-    market_return=MARKET_RETURN,
-    budget=BUDGET,
-    net_annual_income=NET_ANNUAL_INCOME,
-    capital_gains_tax_rate=CAPIAL_GAINS_TAX_RATE
-)
-
-# final net worth of the renter scenario
-
-rent_forcasts_df["renter_net_worth"] = (
-    rent_forcasts_df["portfolio_value_after_tax"] + 
-    rent_forcasts_df["cumulative_savings"]
-)
-
-# calculate worth contributions for the buy scenario, including
-
-# contributions from house property
+    # one model per session, a rerun only recomputes what depends on the changed inputs
+    if "buy_vs_rent_model" not in st.session_state:
+        st.session_state["buy_vs_rent_model"] = BuyVsRentModel(**MODEL_PARAMETERS)
+    analysis = st.session_state["buy_vs_rent_model"].update(**MODEL_PARAMETERS).analysis
 
-buy_forecasts_house_df = buy_forecasts(
-    time_period=TIME_PERIOD,
-    net_annual_income=NET_ANNUAL_INCOME,
-    house_price=HOUSE_PRICE,
-    house_appreciation_rate=HOUSE_APPRECIATION_RATE,
-    house_maintenance_cost_rate=HOUSE_MAINTENANCE_COST_RATE,
-    buying_transaction_cost_rate=TRANSACTION_COST_RATE,
-    loan_amount=LOAN_AMOUNT,
-    mortgage_interest_rate=MORTGAGE_INTEREST_RATE
-)
+    st.header(f"Net worth of Rent vs Buy over the next {TIME_PERIOD} years")
 
-# contributions from exceeding budget investment on the markets
+    with st.expander("Problem statement", expanded=False):
 
-buy_forecasts_markets_df = rent_forecasts(
-    time_period=TIME_PERIOD,
-    rent_initial_amount=0,
-    inflation_rate=INFLATION_RATE,
-    market_return=MARKET_RETURN,
-    budget=EXCEEDING_BUDGET,
-    net_annual_income=NET_ANNUAL_INCOME,
-    capital_gains_tax_rate=CAPIAL_GAINS_TAX_RATE
-)
+        st.markdown("""
+        This is an attempt to model the financial decision of renting vs buying a house according to a set of configurable parameters. The goal is to produce two plots
 
-buy_forecasts_df = pd.merge(
-    buy_forecasts_house_df,
-    buy_forecasts_markets_df,
-    left_index=True,
-    right_index=True,
-    suffixes=("_house", "_markets")
-)
+        * Net worth of an individual that decided to rent over the next X years
+        * Net worth of an individual that decided to buy over the next X years
 
-# final net worth of the buyer scenario
 
-buy_forecasts_df["buyer_net_worth"] = (
-    buy_forecasts_df["house_value_after_tax"] +
-    buy_forecasts_df["buying_transaction_cost"] +
-    buy_forecasts_df["mortgage_principal_pending_amount"] +
-    buy_forecasts_df["cumulative_buyer_savings"] +
-    buy_forecasts_df["portfolio_value_after_tax"]
-)
+        The net worth of an individual who rents is calculated as
+        ```
+        (the net amount they can sell their investments for at a point in time)
+            - (the accumulated expenses on the renting scenario)
+        ```
 
-# diplaying the results
-
-analysis = pd.merge(
-    rent_forcasts_df,
-    buy_forecasts_df,
-    left_index=True,
-    right_index=True,
-    suffixes=("_rent", "_buy")
-)
-
-st.header(f"Net worth of Rent vs Buy over the next {TIME_PERIOD} years")
-
-with st.expander("Problem statement", expanded=False):
+        The net worth of an individual who buys a house is calculated as
+        ```
+        (the net amount they can sell the house for at a point in time) 
+            - (the amount that is remaining on the mortgage) 
+            - (the accumulated expenses on the renting scenario)
+            + (the capital gains on the exceeding budget)
+        ```
+        """
+        )
 
     st.markdown("""
-    This is an attempt to model the financial decision of renting vs buying a house according to a set of configurable parameters. The goal is to produce two plots
-
-    * Net worth of an individual that decided to rent over the next X years
-    * Net worth of an individual that decided to buy over the next X years
-
-
-    The net worth of an individual who rents is calculated as
-    ```
-    (the net amount they can sell their investments for at a point in time)
-        - (the accumulated expenses on the renting scenario)
-    ```
-
-    The net worth of an individual who buys a house is calculated as
-    ```
-    (the net amount they can sell the house for at a point in time) 
-        - (the amount that is remaining on the mortgage) 
-        - (the accumulated expenses on the renting scenario)
-        + (the capital gains on the exceeding budget)
-    ```
-    """
-    )
-
-st.markdown("""
-The code for the app and the forecasted rent and buy cases is available in Github
-* [App](https://github.com/dcaribou/streamlit-apps/blob/main/apps/buy-vs-rent/streamlit.py)
-* [Calculations](https://github.com/dcaribou/streamlit-apps/blob/main/apps/buy-vs-rent/utils.py)
-""")
-
-st.success("""
-Play with the inputs in the left pane to see how they affect the forecasted net worth of the renter vs the buyer.
-""",
-icon="🧮"
-)
-
-st.line_chart(
-    data=analysis[["renter_net_worth", "buyer_net_worth"]],
-    # green and red colors in hex format
-    color=["#00ff00", "#ff0000"]
-)
-
-st.info(f"""
-Some additional variables that derive from the inputs are
-* the **maximum house price** affordable → {round(HOUSE_PRICE, 2)}€
-* the **transaction cost** → {round(TRANSACTION_COST, 2)}€
-* the **required loan amount** → {round(LOAN_AMOUNT, 2)}€
-* the **exceeding budget** → {round(EXCEEDING_BUDGET, 2)}€
-* the **mortgage repayments** (monthly) → {round(buy_forecasts_df["mortgage_payment"].values[0] / 12, 2)}€
-""",
- icon="ℹ️"
-)
-
+    The code for the app and the forecasted rent and buy cases is available in Github
+    * [App](https://github.com/dcaribou/streamlit-apps/blob/main/apps/buy-vs-rent/streamlit.py)
+    * [Calculations](https://github.com/dcaribou/streamlit-apps/blob/main/apps/buy-vs-rent/utils.py)
+    """)
+
+    st.success("""
+    Play with the inputs in the left pane to see how they affect the forecasted net worth of the renter vs the buyer.
+    """,
+    icon="🧮"
+    )
 
-st.header(f"Buy net worth contributions")
-st.bar_chart(
-    data=buy_forecasts_df[
-        [
-            "house_value_after_tax",
-            "buying_transaction_cost",
-            "mortgage_principal_pending_amount",
-            "cumulative_buyer_savings",
-            "portfolio_value_after_tax"
-        ]
-    ]
-)
+    with stage("net worth chart"):
+        st.line_chart(
+            data=analysis.to_frame(["renter_net_worth", "buyer_net_worth"]),
+            # green and red colors in hex format
+            color=["#00ff00", "#ff0000"]
+        )
+
+    if MONTE_CARLO:
+        simulation = simulate_buy_vs_rent(
+            paths=SIMULATION_PATHS,
+            seed=SIMULATION_SEED,
+            volatility=(
+                MARKET_RETURN_VOLATILITY,
+                INFLATION_VOLATILITY,
+                HOUSE_APPRECIATION_VOLATILITY
+            ),
+            **MODEL_PARAMETERS
+        )
+
+        st.header(f"Simulated net worth over {SIMULATION_PATHS} paths")
+        st.metric(
+            label=f"Probability that buying wins after {TIME_PERIOD} years",
+            value=f"{simulation['buy_wins_probability'][-1]:.0%}"
+        )
+        simulation_bands = pd.DataFrame(index=analysis.index)
+        for scenario in ("renter_net_worth", "buyer_net_worth"):
+            for percentile, values in zip(simulation["percentiles"], simulation[scenario]):
+                simulation_bands[f"{scenario}_p{percentile}"] = values
+        st.line_chart(data=simulation_bands)
+        st.line_chart(
+            data=pd.DataFrame(
+                {"buy_wins_probability": simulation["buy_wins_probability"]},
+                index=analysis.index
+            )
+        )
+
+    st.info(f"""
+    Some additional variables that derive from the inputs are
+    * the **maximum house price** affordable → {round(HOUSE_PRICE, 2)}€
+    * the **transaction cost** → {round(TRANSACTION_COST, 2)}€
+    * the **required loan amount** → {round(LOAN_AMOUNT, 2)}€
+    * the **exceeding budget** → {round(EXCEEDING_BUDGET, 2)}€
+    * the **mortgage repayments** (monthly) → {round(analysis["mortgage_payment"][0] / 12, 2)}€
+    """,
+     icon="ℹ️"
+    )
 
-st.header(f"Raw calculations")
-st.dataframe(analysis)
-# https://docs.streamlit.io/library/api-reference/widgets/st.download_button
 
-@st.cache_resource
-def convert_df(df):
-    # IMPORTANT: Cache the conversion to prevent computation on every rerun
-    return df.to_csv().encode('utf-8')
+    st.header(f"Buy net worth contributions")
+    st.bar_chart(
+        data=analysis.to_frame(
+            [
+                "house_value_after_tax",
+                "buying_transaction_cost",
+                "mortgage_principal_pending_amount",
+                "cumulative_buyer_savings",
+                "portfolio_value_after_tax_buy"
+            ]
+        ).rename(columns={"portfolio_value_after_tax_buy": "portfolio_value_after_tax"})
+    )
 
-csv = convert_df(analysis)
+    st.header(f"Sensitivity of buyer vs renter net worth")
+    SENSITIVITY_STEP = st.slider(
+        "Input change (%)", min_value=1, max_value=50, value=10,
+        help="Every input is moved down and up by this percentage of its value."
+    ) / 100
+    sensitivity = sensitivity_analysis(relative_step=SENSITIVITY_STEP, **MODEL_PARAMETERS)
+    tornado = pd.DataFrame({
+        "input": sensitivity["parameters"],
+        "low": sensitivity["low"][:, -1],
+        "high": sensitivity["high"][:, -1],
+    })
+    tornado["swing"] = (tornado["high"] - tornado["low"]).abs()
+    tornado = tornado.sort_values("swing", ascending=False)
+    st.altair_chart(
+        altair_chart=alt.Chart(tornado).mark_bar().encode(
+            x=alt.X("low", title=f"buyer - renter net worth after {TIME_PERIOD} years (€)"),
+            x2="high",
+            y=alt.Y("input", sort=list(tornado["input"]), title=None),
+            color=alt.condition("datum.high > datum.low", alt.value("#00ff00"), alt.value("#ff0000")),
+            tooltip=["input", "low", "high", "swing"]
+        ) + alt.Chart(pd.DataFrame({"baseline": [sensitivity["baseline"][-1]]})).mark_rule().encode(
+            x="baseline"
+        ),
+        use_container_width=True
+    )
+    st.caption(
+        "Green bars mean that raising the input favours buying, red bars that it favours renting."
+    )
+    if sensitivity["excluded"]:
+        st.caption(
+            f"Not shown, as a percentage of zero is no change: {', '.join(sensitivity['excluded'])}."
+        )
+
+    st.header(f"Mortgage prepayment")
+    prepayment_columns = st.columns(3)
+    MONTHLY_PREPAYMENT = prepayment_columns[0].number_input(
+        "Monthly prepayment (€)", value=0, min_value=0, step=100
+    )
+    LUMP_SUM_PREPAYMENT = prepayment_columns[1].number_input(
+        "Lump sum prepayment (€)", value=20000, min_value=0, step=5000
+    )
+    LUMP_SUM_YEAR = prepayment_columns[2].number_input(
+        "Lump sum in year", value=min(5, MORGATGE_TERM), min_value=1, max_value=MORGATGE_TERM
+    )
+    PREPAYMENT_EFFECT = st.radio(
+        "Prepayments reduce the",
+        options=["term", "payment"],
+        horizontal=True,
+        help="Keep the monthly payment and repay the mortgage earlier, or keep the term and pay less every month."
+    )
+    # the mortgage without and with prepayments, as two loans of one schedule
+    prepayment = np.zeros((2, MORGATGE_TERM * 12))
+    prepayment[1] = MONTHLY_PREPAYMENT
+    prepayment[1, (LUMP_SUM_YEAR - 1) * 12] += LUMP_SUM_PREPAYMENT
+    schedule = amortization_schedule(
+        LOAN_AMOUNT,
+        MORTGAGE_INTEREST_RATE,
+        MORGATGE_TERM,
+        prepayment=prepayment,
+        prepayment_effect=PREPAYMENT_EFFECT
+    )
+    paid_months = (schedule["balance"] > 0.005).sum(axis=1) + 1
+    prepayment_metrics = st.columns(2)
+    prepayment_metrics[0].metric(
+        label="Interest saved",
+        value=f"{schedule['interest'][0].sum() - schedule['interest'][1].sum():,.0f}€"
+    )
+    prepayment_metrics[1].metric(
+        label="Mortgage repaid after",
+        value=f"{min(paid_months[1], MORGATGE_TERM * 12) / 12:.1f} years",
+        delta=f"{(min(paid_months[1], MORGATGE_TERM * 12) - MORGATGE_TERM * 12) / 12:.1f} years",
+        delta_color="inverse"
+    )
+    st.line_chart(
+        data=pd.DataFrame(
+            {
+                "without prepayments": schedule["balance"][0, 11::12],
+                "with prepayments": schedule["balance"][1, 11::12],
+            },
+            index=analysis.index[:MORGATGE_TERM]
+        )
+    )
+    st.caption("Mortgage principal pending at the end of every year.")
 
-st.download_button(
-    label="Download as CSV",
-    data=csv,
-    file_name='analysis.csv',
-    mime='text/csv',
-)
+    st.header(f"Break-even")
+    BREAK_EVEN_YEAR = break_even_year(**MODEL_PARAMETERS)[0]
+    st.metric(
+        label="Year in which buying overtakes renting",
+        value="never" if pd.isna(BREAK_EVEN_YEAR) else int(analysis.index[int(BREAK_EVEN_YEAR) - 1].year)
+    )
+    BREAK_EVEN_BRACKETS = {
+        "mortgage_interest_rate": (0.0, 0.25),
+        "house_appreciation_rate": (-0.2, 0.25),
+        "rent_initial_amount": (0.0, BUDGET),
+    }
+    BREAK_EVEN_PARAMETER = st.selectbox(
+        "Input to solve for",
+        options=list(BREAK_EVEN_BRACKETS),
+        help="The value of this input that makes buying and renting equal at the end of every time period."
+    )
+    break_even_horizons = list(range(1, TIME_PERIOD + 1))
+    break_even_curve = pd.DataFrame(
+        {
+            BREAK_EVEN_PARAMETER: solve_break_even(
+                BREAK_EVEN_PARAMETER,
+                *BREAK_EVEN_BRACKETS[BREAK_EVEN_PARAMETER],
+                horizons=break_even_horizons,
+                **MODEL_PARAMETERS
+            )
+        },
+        index=pd.Index(break_even_horizons, name="time period (years)")
+    )
+    if BREAK_EVEN_PARAMETER == "rent_initial_amount":
+        # the rent input in the sidebar is monthly
+        break_even_curve[BREAK_EVEN_PARAMETER] /= 12
+    st.line_chart(data=break_even_curve)
+
+    st.header(f"Historical backtest")
+    HISTORY_FILE = st.file_uploader(
+        "Historical series (CSV)",
+        type="csv",
+        help=(
+            "Annual series with a `year` column and some of "
+            f"{', '.join(HISTORICAL_SERIES)} as rates, or `house_price` as an index. "
+            "Every start year is simulated with the actual rates of the following years."
+        )
+    )
+    history = None
+    if HISTORY_FILE is not None:
+        try:
+            history = load_historical_series(HISTORY_FILE)
+        except ValueError as error:
+            st.error(f"The historical series could not be read: {error}")
+
+    if history is not None:
+        # the horizon is capped to the years the series cover, leaving a single start year
+        BACKTEST_PERIOD = min(TIME_PERIOD, len(history["year"]))
+        if BACKTEST_PERIOD < TIME_PERIOD:
+            st.warning(
+                f"The historical series cover {BACKTEST_PERIOD} years only, "
+                f"the backtest is limited to {BACKTEST_PERIOD} years."
+            )
+        try:
+            backtest = backtest_buy_vs_rent(
+                history,
+                **{
+                    name: value for name, value in MODEL_PARAMETERS.items()
+                    if name not in history and name != "time_period"
+                },
+                time_period=BACKTEST_PERIOD
+            )
+        except ValueError as error:
+            st.error(f"The backtest could not be run: {error}")
+            backtest = None
+
+        if backtest is not None:
+            st.metric(
+                label=f"Start years in which buying wins after {BACKTEST_PERIOD} years",
+                value=f"{backtest['buy_wins_share'][-1]:.0%} of {len(backtest['start_year'])}"
+            )
+            st.bar_chart(
+                data=pd.DataFrame(
+                    {"buyer - renter net worth": backtest["difference"][:, -1]},
+                    index=pd.Index(backtest["start_year"], name="start year")
+                )
+            )
+            st.line_chart(
+                data=pd.DataFrame(
+                    {
+                        f"p{percentile}": values
+                        for percentile, values in zip(backtest["percentiles"], backtest["difference percentiles"])
+                    },
+                    index=pd.Index(range(1, BACKTEST_PERIOD + 1), name="year")
+                )
+            )
+            st.caption("Percentiles across start years of the buyer minus renter net worth.")
+
+    st.header(f"Raw calculations")
+    analysis_df = analysis.to_frame()
+    st.dataframe(analysis_df)
+    # https://docs.streamlit.io/library/api-reference/widgets/st.download_button
+
+    @st.cache_resource
+    def convert_df(df):
+        # IMPORTANT: Cache the conversion to prevent computation on every rerun
+        return df.to_csv().encode('utf-8')
+
+    with stage("csv encoding"):
+        csv = convert_df(analysis_df)
+
+    st.download_button(
+        label="Download as CSV",
+        data=csv,
+        file_name='analysis.csv',
+        mime='text/csv',
+    )
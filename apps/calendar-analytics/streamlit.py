@@ -1,97 +1,125 @@
 import streamlit as st
 from shared.googlelib import (
         authenticate,
-        fetch_calendars,
-        fetch_calendar_events
+        calendar_cache,
+        CalendarClient,
+        EventStore
     )
+from shared.eventcube import EventCube, downsample_weeks, top_summaries
+from shared.profiling import stage, streamlit_profile
 import pandas as pd
 import altair as alt
 
 CREDENTIALS_FILE_PATH = "client_secret_153639038451-8r2mq88ll6utdkb5fe2aacelccpl10mp.apps.googleusercontent.com.json"
+EVENTS_STORE_PATH = "events.sqlite"
+MAX_TIME_OFFSET = 120
+# bounds of the data sent to the charts, the rest of the summaries are charted as "Other"
+CHART_SUMMARIES = 12
+CHART_WEEKS = 52
+
+@st.cache_resource
+def load_client(credentials_file_path: str):
+    # authenticate and build the API client once per server, not on every rerun
+    return CalendarClient(authenticate(credentials_file_path))
+
+def load_events(client: CalendarClient, calendars: list[str], time_min: pd.Timestamp):
+    # cached per account for a while, a selection of fewer calendars reuses the events
+    # already loaded; only the changes since the last visit are downloaded into the
+    # local store, and recurring events are stored once and expanded locally
+    return calendar_cache.event_frame(
+        client,
+        calendars,
+        store=EventStore(EVENTS_STORE_PATH, single_events=False),
+        time_min=time_min.to_pydatetime()
+    )
 
-@st.cache_data
-def load_events(_credentials, calendars: list[str]):
-    return fetch_calendar_events(_credentials, calendars)
-
-@st.cache_data
-def load_calendars(_credentials):
-    return fetch_calendars(_credentials)
-
-st.title("Calendar Analytics")
+@st.cache_resource(max_entries=32)
+def load_cube(_events: pd.DataFrame, account: str, calendars: list[str], time_min: pd.Timestamp, fetched_at: float):
+    # built once per fetch of the events, so that edited and deleted events are taken into
+    # account when they are fetched again; reruns in between only add the events started since
+    return EventCube(_events, as_of=int(pd.Timestamp.now().timestamp()), tz="Europe/Madrid")
+
+with streamlit_profile("calendar-analytics"):
+    st.title("Calendar Analytics")
+
+    client = load_client(CREDENTIALS_FILE_PATH)
+
+    calendars = calendar_cache.calendars(client)
+
+    calendar_selection = {}
+    with st.sidebar:
+        st.header("Calendars")
+        for calendar in calendars:
+            calendar_name = calendar["summary"]
+            calendar_selection[calendar_name] = st.checkbox(
+                label=calendar_name,
+                value=True
+            )
+
+    with st.sidebar:
+        st.header("Filters")
+        timeoffset = st.slider(
+            label="Time offset in days",
+            min_value=0,
+            max_value=MAX_TIME_OFFSET,
+            value=30
+        )
 
-creds = authenticate(CREDENTIALS_FILE_PATH)
+    focused_calendars = [calendar for calendar, selected in calendar_selection.items() if selected]
+    # the events of the widest window are loaded once, from the start of its first day,
+    # and aggregated by summary and day; the filters below only slice the aggregate
+    now = pd.Timestamp.now(tz="Europe/Madrid")
+    window_start = now.normalize() - pd.Timedelta(days=MAX_TIME_OFFSET)
+    events = load_events(client, focused_calendars, window_start)
+    with stage("event cube"):
+        cube = load_cube(events, client.account, focused_calendars, window_start, events.attrs["fetched_at"])
+        cube.update(events, as_of=int(now.timestamp()))
+
+    with st.sidebar:
+        exclude_events = st.multiselect(
+            label="Exclude events",
+            options=cube.summaries,
+        )
 
-calendars = load_calendars(creds)
+    with stage("weekly aggregation"):
+        events_df = cube.weekly(
+            first_day=(now - pd.Timedelta(days=timeoffset)).date(),
+            exclude=exclude_events
+        )
 
-calendar_selection = {}
-with st.sidebar:
-    st.header("Calendars")
-    for calendar in calendars:
-        calendar_name = calendar["summary"]
-        calendar_selection[calendar_name] = st.checkbox(
-            label=calendar_name,
-            value=True
+    # filter out events whose average duration is less than 1 hour
+    totals = events_df.groupby("summary")[["hours", "events"]].transform("sum")
+    events_df = events_df[totals["hours"] / totals["events"] > 1]
+
+    # charts get pre-aggregated rows only, bounded in summaries and weeks
+    top_df = top_summaries(events_df, CHART_SUMMARIES)
+    weekly_df = downsample_weeks(top_df, CHART_WEEKS)
+    summary_df = top_df.groupby("summary", as_index=False)["hours"].sum()
+
+    with stage("charts"):
+        # bar chart of events and their duration over time grouped by week
+        st.altair_chart(
+            altair_chart=alt.Chart(weekly_df).mark_line().encode(
+                x="week:O",  # ISO year-week, e.g. 2024-W05
+                y=alt.Y("hours:Q", title="duration_in_hours"),
+                color="summary"
+            ),
+            use_container_width=True
         )
 
-focused_calendars = [calendar for calendar, selected in calendar_selection.items() if selected]
-events = load_events(creds, focused_calendars)
+        # pie chart of events and their duration
+        st.altair_chart(
+            altair_chart=alt.Chart(summary_df).mark_arc().encode(
+                color="summary",
+                theta="hours:Q",
+                tooltip=["summary", "hours"]
+            ),
+            use_container_width=True
+        )
 
-events_df = pd.json_normalize(events)
-events_df["summary"] = events_df["summary"].str.strip()
 
-with st.sidebar:
-    st.header("Filters")
-    timeoffset = st.slider(
-        label="Time offset in days",
-        min_value=0,
-        max_value=120,
-        value=30
-    )
-    exclude_events = st.multiselect(
-        label="Exclude events",
-        options=events_df["summary"].unique(),
-    )
+    with st.expander("Show raw data"):
+        st.dataframe(events_df)
 
-# curate events_df
-
-events_df["start.dateTime"] = pd.to_datetime(events_df["start.dateTime"], utc=True).dt.tz_convert("Europe/Madrid")
-events_df["end.dateTime"] = pd.to_datetime(events_df["end.dateTime"], utc=True).dt.tz_convert("Europe/Madrid")
-events_df["duration"] = pd.to_timedelta(events_df["end.dateTime"] - events_df["start.dateTime"])
-events_df["duration_in_minutes"] = events_df["duration"].dt.total_seconds() / 60
-events_df = events_df[
-    (events_df["start.dateTime"] > pd.Timestamp.now(tz="Europe/Madrid") - pd.Timedelta(days=timeoffset)) &
-    (events_df["start.dateTime"] < pd.Timestamp.now(tz="Europe/Madrid"))
-]
-events_df = events_df[~events_df["summary"].isin(exclude_events)]
-events_df["duration_in_hours"] = events_df["duration_in_minutes"] / 60
-events_df["week"] = events_df["start.dateTime"].dt.isocalendar().week
-
-
-# filter out events whose average weekly duration is less than 1 hour
-events_df = events_df[
-    events_df.groupby("summary")["duration_in_hours"].transform("mean") > 1
-]
-
-# bar chart of events and their duration over time grouped by week
-st.altair_chart(
-    altair_chart=alt.Chart(events_df).mark_line().encode(
-        x="week:O",
-        y="sum(duration_in_hours)",
-        color="summary"
-    ),
-    use_container_width=True
-)
-
-# pie chart of events and their duration
-st.altair_chart(
-    altair_chart=alt.Chart(events_df).mark_arc().encode(
-        color="summary",
-        theta="sum(duration_in_hours)",
-        tooltip=["summary", "sum(duration_in_hours)"]
-    ),
-    use_container_width=True
-)
-
-
-with st.expander("Show raw data"):
-    st.dataframe(events_df)
+    with st.sidebar.expander("Calendar cache"):
+        st.json(calendar_cache.stats())
@@ -0,0 +1,143 @@
+"""Headless batch runner of buy-vs-rent scenarios.
+
+Reads a CSV or Parquet file with one scenario per row, a column per
+parameter of `shared.financial.buy_vs_rent_analysis`, and writes the same
+analysis as Parquet, one row per scenario and year:
+
+    python -m shared.batch scenarios.csv results.parquet --chunk-size 10000
+
+Scenarios are read, analysed and written chunk by chunk, so the input and
+output files never have to fit in memory at once.
+"""
+
+import argparse
+import datetime
+import inspect
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from shared import financial
+
+CHUNK_SIZE = 10000
+NET_WORTH_COLUMNS = ("renter_net_worth", "buyer_net_worth")
+
+SCENARIO_COLUMNS = tuple(
+    name for name in inspect.signature(financial.buy_vs_rent_analysis_batch).parameters
+    if name != "year_start"
+)
+
+def read_scenarios(path: str, chunk_size: int = CHUNK_SIZE):
+    """Yield the scenarios of a CSV or Parquet file as DataFrames of up to `chunk_size` rows."""
+    if path.endswith(".parquet"):
+        file = pq.ParquetFile(path)
+        missing = set(SCENARIO_COLUMNS) - set(file.schema_arrow.names)
+        if missing:
+            raise ValueError(f"Missing scenario columns: {', '.join(sorted(missing))}")
+        for batch in file.iter_batches(batch_size=chunk_size, columns=list(SCENARIO_COLUMNS)):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(path, chunksize=chunk_size):
+            missing = set(SCENARIO_COLUMNS) - set(chunk.columns)
+            if missing:
+                raise ValueError(f"Missing scenario columns: {', '.join(sorted(missing))}")
+            yield chunk[list(SCENARIO_COLUMNS)]
+
+def analyse_scenarios(
+    scenarios: pd.DataFrame,
+    first_scenario: int = 0,
+    columns=None,
+    year_start: int | None = None
+) -> pa.Table:
+    """Buy-vs-rent analysis of a chunk of scenarios, one row per scenario and year.
+
+    :param scenarios: One scenario per row, see `SCENARIO_COLUMNS`.
+    :param first_scenario: Number of the first scenario of the chunk in the input.
+    :param columns: The analysis columns to keep, all of them by default.
+    :param year_start: The first year of the analysis, the current year by default.
+    :return: A table with the scenario number, the year and the analysis columns.
+    :rtype: pa.Table
+    """
+    params = {name: scenarios[name].to_numpy() for name in SCENARIO_COLUMNS}
+    year_start = datetime.date.today().year if year_start is None else year_start
+    if columns is not None and set(columns) <= set(NET_WORTH_COLUMNS):
+        # the net worths alone are much cheaper than the full analysis
+        analysis = financial.buy_vs_rent_batch(**params)
+    else:
+        analysis = financial.buy_vs_rent_analysis_batch(**params, year_start=year_start)
+        columns = analysis.columns if columns is None else list(columns)
+    years = analysis[columns[0]].shape[1]
+    active = np.arange(1, years + 1) <= params["time_period"][:, None]
+    scenario, year = np.nonzero(active)
+    table = {
+        "scenario": scenario + first_scenario,
+        "year": year + year_start,
+    }
+    for column in columns:
+        table[column] = analysis[column][active]
+    return pa.table(table)
+
+def run_batch(
+    input_path: str,
+    output_path: str,
+    chunk_size: int = CHUNK_SIZE,
+    columns=None,
+    year_start: int | None = None,
+    progress=None
+) -> dict:
+    """Analyse every scenario of `input_path` into the Parquet file `output_path`.
+
+    `progress`, if given, is called with the number of scenarios done and the
+    elapsed seconds after every chunk. Returns the number of scenarios and
+    output rows, the elapsed seconds and the scenarios per second.
+    """
+    started = time.perf_counter()
+    scenarios = rows = 0
+    writer = None
+    try:
+        for chunk in read_scenarios(input_path, chunk_size):
+            table = analyse_scenarios(chunk, scenarios, columns, year_start)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema)
+            writer.write_table(table)
+            scenarios += len(chunk)
+            rows += table.num_rows
+            if progress is not None:
+                progress(scenarios, time.perf_counter() - started)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    seconds = time.perf_counter() - started
+    return {
+        "scenarios": scenarios,
+        "rows": rows,
+        "seconds": seconds,
+        "scenarios_per_second": scenarios / seconds if seconds else float("inf"),
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="CSV or Parquet file with one scenario per row")
+    parser.add_argument("output", help="Parquet file to write the analysis to")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="Scenarios analysed at once (default %(default)s)")
+    parser.add_argument("--column", action="append",
+                        help="Analysis column to write (can be repeated), all of them by default")
+    parser.add_argument("--year-start", type=int, help="First year of the analysis, the current year by default")
+    args = parser.parse_args(argv)
+
+    def progress(scenarios, seconds):
+        print(f"{scenarios:>12,} scenarios {scenarios / seconds:>12,.0f} scenarios/s", file=sys.stderr)
+
+    stats = run_batch(args.input, args.output, args.chunk_size, args.column, args.year_start, progress)
+    print(f"{stats['scenarios']:,} scenarios, {stats['rows']:,} rows written to {args.output} "
+          f"in {stats['seconds']:.1f} s ({stats['scenarios_per_second']:,.0f} scenarios/s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
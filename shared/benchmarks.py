@@ -0,0 +1,205 @@
+"""Benchmarks for the hot paths of shared.financial.
+
+Runs headless, without Streamlit:
+
+    python -m shared.benchmarks --output benchmark.json \
+        --baseline shared/tests/benchmark_baseline.json
+
+Every benchmark is timed over a matrix of horizons (years) and batch sizes
+(scenarios per call, or calls for the scalar mortgage functions), as the
+median of several repeats so that a single noisy measurement does not decide
+the result. Results are written as JSON and compared against a stored
+baseline; the command exits with a non-zero status when any case is slower
+than the baseline by more than the threshold, which is wide for the same
+reason. Use `--update-baseline` to store the current timings as the new
+baseline.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import timeit
+
+import numpy as np
+
+from shared import financial
+
+HORIZONS = (1, 10, 30, 50)
+BATCH_SIZES = (1, 100, 10000)
+THRESHOLD = 1.0
+
+BUY_VS_RENT_PARAMS = dict(
+    budget=350000,
+    net_annual_income=12000,
+    rent_initial_amount=14400,
+    inflation_rate=0.04,
+    market_return=0.05,
+    house_appreciation_rate=0.02,
+    house_maintenance_cost_rate=0.005,
+    down_payment_rate=0.2,
+    capital_gains_tax_rate=0.2,
+    mortgage_interest_rate=0.03,
+    transaction_cost_rate=0.15
+)
+
+def _mortgage_monthly_payment(horizon: int, batch: int):
+    rates = np.linspace(0.01, 0.08, batch).tolist()
+
+    def run():
+        for rate in rates:
+            financial.mortgage_monthly_payment(rate, 250000, horizon)
+    return run
+
+def _mortgage_principal_contribution(horizon: int, batch: int):
+    rates = np.linspace(0.01, 0.08, batch).tolist()
+
+    def run():
+        for rate in rates:
+            financial.mortgage_principal_contribution(rate, 1000, horizon * 12, horizon)
+    return run
+
+def _rent_forecasts(horizon: int, batch: int):
+    budget = np.linspace(1e5, 5e5, batch)
+    if batch == 1:
+        return lambda: financial.rent_forecasts(horizon, 14400, 30000, 0.04, 350000, 0.05, 0.2)
+    return lambda: financial.rent_forecasts_batch(horizon, 14400, 30000, 0.04, budget, 0.05, 0.2)
+
+def _buy_forecasts(horizon: int, batch: int):
+    rates = np.linspace(0.01, 0.08, batch)
+    if batch == 1:
+        return lambda: financial.buy_forecasts(horizon, 0, 300000, 0.02, 0.005, 0.15, 250000, 0.03)
+    return lambda: financial.buy_forecasts_batch(horizon, 0, 300000, 0.02, 0.005, 0.15, 250000, rates)
+
+def _buy_vs_rent_analysis(horizon: int, batch: int):
+    if batch == 1:
+        return lambda: financial.buy_vs_rent_analysis(time_period=horizon, **BUY_VS_RENT_PARAMS)
+    params = dict(BUY_VS_RENT_PARAMS, budget=np.linspace(1e5, 5e5, batch))
+    return lambda: financial.buy_vs_rent_analysis_batch(time_period=horizon, **params)
+
+BENCHMARKS = {
+    "mortgage_monthly_payment": _mortgage_monthly_payment,
+    "mortgage_principal_contribution": _mortgage_principal_contribution,
+    "rent_forecasts": _rent_forecasts,
+    "buy_forecasts": _buy_forecasts,
+    "buy_vs_rent_analysis": _buy_vs_rent_analysis,
+}
+
+def run_benchmarks(
+    names=None,
+    horizons=HORIZONS,
+    batch_sizes=BATCH_SIZES,
+    repeat: int = 7,
+    number: int | None = None
+) -> list[dict]:
+    """Time every benchmark over the horizons x batch sizes matrix.
+
+    The forecast cache is disabled while timing so that every call does the
+    actual work. Each record holds the median time per call out of `repeat`
+    measurements, and the best one as `min_seconds`. Each measurement runs
+    the case `number` times, by default as many as fit in 0.2 seconds.
+    """
+    names = list(BENCHMARKS) if names is None else list(names)
+    default_cache = financial.forecast_cache
+    financial.forecast_cache = financial.ForecastCache(max_entries=0)
+    try:
+        records = []
+        for name in names:
+            for horizon in horizons:
+                for batch in batch_sizes:
+                    timer = timeit.Timer(BENCHMARKS[name](horizon, batch))
+                    calls = number or timer.autorange()[0]
+                    timings = [seconds / calls for seconds in timer.repeat(repeat=repeat, number=calls)]
+                    records.append({
+                        "name": name,
+                        "horizon": horizon,
+                        "batch": batch,
+                        "seconds": statistics.median(timings),
+                        "min_seconds": min(timings),
+                    })
+        return records
+    finally:
+        financial.forecast_cache = default_cache
+
+def compare(results: list[dict], baseline: list[dict], threshold: float = THRESHOLD) -> list[dict]:
+    """Cases of `results` slower than the same case of `baseline` by more than `threshold`.
+
+    Cases missing from the baseline are ignored.
+    """
+    reference = {(r["name"], r["horizon"], r["batch"]): r["seconds"] for r in baseline}
+    regressions = []
+    for record in results:
+        baseline_seconds = reference.get((record["name"], record["horizon"], record["batch"]))
+        if baseline_seconds is not None and record["seconds"] > baseline_seconds * (1 + threshold):
+            regressions.append({
+                **record,
+                "baseline_seconds": baseline_seconds,
+                "slowdown": record["seconds"] / baseline_seconds,
+            })
+    return regressions
+
+def load_results(path: str) -> list[dict]:
+    with open(path) as file:
+        return json.load(file)["results"]
+
+def save_results(path: str, results: list[dict]):
+    with open(path, "w") as file:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "results": results,
+            },
+            file,
+            indent=2
+        )
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results against this JSON file")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="Allowed relative slowdown against the baseline (default %(default)s)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Store the results as the new baseline instead of comparing")
+    parser.add_argument("--benchmark", action="append", choices=list(BENCHMARKS),
+                        help="Run only this benchmark (can be repeated)")
+    parser.add_argument("--horizon", type=int, action="append", help="Horizons to run (years)")
+    parser.add_argument("--batch", type=int, action="append", help="Batch sizes to run")
+    parser.add_argument("--repeat", type=int, default=7,
+                        help="Measurements per case, of which the median is kept (default %(default)s)")
+    parser.add_argument("--number", type=int,
+                        help="Calls per measurement, as many as fit in 0.2 seconds by default")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        names=args.benchmark,
+        horizons=args.horizon or HORIZONS,
+        batch_sizes=args.batch or BATCH_SIZES,
+        repeat=args.repeat,
+        number=args.number
+    )
+    for record in results:
+        print(f"{record['name']:<32} horizon={record['horizon']:<3} "
+              f"batch={record['batch']:<6} {record['seconds'] * 1e3:10.3f} ms")
+
+    if args.output:
+        save_results(args.output, results)
+
+    if args.baseline and args.update_baseline:
+        save_results(args.baseline, results)
+    elif args.baseline:
+        regressions = compare(results, load_results(args.baseline), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['name']} horizon={regression['horizon']} "
+                  f"batch={regression['batch']}: {regression['slowdown']:.2f}x slower than baseline",
+                  file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""Pre-aggregated calendar event durations, by summary and day.
+
+Filters of the calendar analytics (time window, excluded summaries) are
+answered by slicing the cube and re-summing it by ISO year-week, instead of
+rescanning the events. `top_summaries` and `downsample_weeks` bound the
+size of the aggregates sent to charts.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+SECONDS_PER_HOUR = 3600
+
+def _iso_weeks(days: np.ndarray) -> np.ndarray:
+    """ISO year-week labels of days, like "2024-W01"."""
+    calendar = pd.DatetimeIndex(days).isocalendar()
+    return np.array([f"{year}-W{week:02d}" for year, week in zip(calendar["year"], calendar["week"])])
+
+class EventCube:
+    """Hours and number of events of every summary per local day.
+
+    Events are binned by the local day of their start, and only events that
+    started before `as_of` are counted, so that the cube can be brought up
+    to date with `update` as time goes by. All-day events and events without
+    summary are left out.
+
+    :param events: Decoded events, see `shared.googlelib.EventDecoder`.
+    :type events: pd.DataFrame
+    :param as_of: Unix time up to which events are counted.
+    :type as_of: int
+    :param tz: Time zone of the days.
+    :type tz: str
+    """
+
+    def __init__(self, events: pd.DataFrame, as_of: int, tz: str = "Europe/Madrid"):
+        self.tz = tz
+        self.as_of = None
+        self.summaries = []
+        self._rows = {}
+        self.first_day = None
+        self.hours = np.zeros((0, 0))
+        self.counts = np.zeros((0, 0), dtype=np.int64)
+        self._lock = threading.Lock()
+        self.update(events, as_of)
+
+    @property
+    def days(self) -> np.ndarray:
+        if self.first_day is None:
+            return np.array([], dtype="datetime64[D]")
+        return self.first_day + np.arange(self.hours.shape[1])
+
+    def _local_days(self, start: np.ndarray) -> np.ndarray:
+        local = pd.DatetimeIndex(pd.to_datetime(start, unit="s", utc=True)).tz_convert(self.tz)
+        return local.tz_localize(None).values.astype("datetime64[D]")
+
+    def _grow(self, summaries, first_day, last_day):
+        for summary in summaries:
+            if summary not in self._rows:
+                self._rows[summary] = len(self.summaries)
+                self.summaries.append(summary)
+        if self.first_day is None:
+            self.first_day = first_day
+        last = self.first_day + self.hours.shape[1] - 1
+        before = max(int((self.first_day - first_day).astype(np.int64)), 0)
+        after = max(int((last_day - last).astype(np.int64)), 0)
+        rows = len(self.summaries) - self.hours.shape[0]
+        if rows or before or after:
+            padding = ((0, rows), (before, after))
+            self.hours = np.pad(self.hours, padding)
+            self.counts = np.pad(self.counts, padding)
+            self.first_day = self.first_day - before
+
+    def update(self, events: pd.DataFrame, as_of: int):
+        """Add the events that started since the last update and before `as_of`."""
+        start = events["start"].to_numpy()
+        selected = (start < as_of) & ~events["all_day"].to_numpy() & events["summary"].notna().to_numpy()
+        if self.as_of is not None:
+            selected &= start >= self.as_of
+        with self._lock:
+            self.as_of = as_of if self.as_of is None else max(self.as_of, as_of)
+            if not selected.any():
+                return
+            new = events[selected]
+            days = self._local_days(new["start"].to_numpy())
+            summaries = new["summary"].to_numpy()
+            self._grow(pd.unique(summaries), days.min(), days.max())
+            rows = np.fromiter((self._rows[summary] for summary in summaries), dtype=np.int64, count=len(summaries))
+            columns = (days - self.first_day).astype(np.int64)
+            hours = (new["end"].to_numpy() - new["start"].to_numpy()) / SECONDS_PER_HOUR
+            np.add.at(self.hours, (rows, columns), hours)
+            np.add.at(self.counts, (rows, columns), 1)
+
+    def weekly(self, first_day=None, last_day=None, exclude=()) -> pd.DataFrame:
+        """Hours and events per summary and ISO year-week, between two days included.
+
+        :param first_day: First local day of the window, from the first event by default.
+        :param last_day: Last local day of the window, up to the last event by default.
+        :param exclude: Summaries to leave out.
+        :return: A frame with a row per summary and week with events, with
+            columns summary, week, hours and events, sorted by summary and week.
+        :rtype: pd.DataFrame
+        """
+        with self._lock:
+            days = self.days
+            begin = 0 if first_day is None else int(np.searchsorted(days, np.datetime64(first_day, "D")))
+            end = len(days) if last_day is None else int(np.searchsorted(days, np.datetime64(last_day, "D"), "right"))
+            keep = np.array([summary not in exclude for summary in self.summaries], dtype=bool)
+            summaries = np.array(self.summaries, dtype=object)[keep]
+            hours = self.hours[keep, begin:end]
+            counts = self.counts[keep, begin:end]
+        if hours.size == 0:
+            return pd.DataFrame({"summary": [], "week": [], "hours": [], "events": []})
+
+        labels = _iso_weeks(days[begin:end])
+        week_starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+        weeks = labels[week_starts]
+        hours = np.add.reduceat(hours, week_starts, axis=1)
+        counts = np.add.reduceat(counts, week_starts, axis=1)
+        rows, columns = np.nonzero(counts)
+        return pd.DataFrame({
+            "summary": summaries[rows],
+            "week": weeks[columns],
+            "hours": hours[rows, columns],
+            "events": counts[rows, columns],
+        }).sort_values(["summary", "week"], ignore_index=True)
+
+def top_summaries(weekly: pd.DataFrame, n: int = 10, other: str = "Other") -> pd.DataFrame:
+    """Keep the `n` summaries with the most hours and add up the rest as `other`.
+
+    :param weekly: Rows per summary and week, see `EventCube.weekly`.
+    :type weekly: pd.DataFrame
+    :param n: The number of summaries kept.
+    :type n: int
+    :param other: The summary of the rest of the events, suffixed with the
+        number of summaries it adds up when an event already has it.
+    :type other: str
+    :return: The rows of at most `n + 1` summaries, with the same columns.
+    :rtype: pd.DataFrame
+    """
+    totals = weekly.groupby("summary")["hours"].sum()
+    if len(totals) <= n:
+        return weekly
+    top = totals.nlargest(n).index
+    label, suffix = other, f"{len(totals) - n} summaries"
+    while label in totals.index:
+        label = f"{other} ({suffix})"
+        suffix = f"{suffix}, rest"
+    summary = weekly["summary"].where(weekly["summary"].isin(top), label)
+    return (
+        weekly.assign(summary=summary)
+        .groupby(["summary", "week"], as_index=False)[["hours", "events"]].sum()
+    )
+
+def downsample_weeks(weekly: pd.DataFrame, max_weeks: int = 52) -> pd.DataFrame:
+    """Merge consecutive weeks into periods so that there are at most `max_weeks` of them.
+
+    A period is labelled by its first week and holds the average hours per
+    week with events over the period, so that its values stay comparable to
+    weekly ones.
+
+    :param weekly: Rows per summary and week, see `EventCube.weekly`.
+    :type weekly: pd.DataFrame
+    :param max_weeks: The maximum number of periods.
+    :type max_weeks: int
+    :rtype: pd.DataFrame
+    """
+    weeks = np.sort(weekly["week"].unique())
+    if len(weeks) <= max_weeks:
+        return weekly
+    size = -(-len(weeks) // max_weeks)
+    period = weeks[np.arange(len(weeks)) // size * size]
+    periods = weekly.assign(week=weekly["week"].map(dict(zip(weeks, period))))
+    periods = periods.groupby(["summary", "week"], as_index=False)[["hours", "events"]].sum()
+    periods["hours"] /= periods["week"].map(pd.Series(period).value_counts())
+    return periods
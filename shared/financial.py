@@ -1,6 +1,26 @@
-import pandas as pd
-import numpy_financial as npf
+"""Buy vs rent and rental ROI models.
+
+The core only needs NumPy: pandas is imported when a result is turned into a
+DataFrame, and numpy_financial by the scalar mortgage helpers.
+"""
+
+import numpy as np
+import contextlib
 import datetime
+import functools
+import hashlib
+import inspect
+import json
+import os
+import threading
+from collections import OrderedDict
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import TYPE_CHECKING
+
+from shared.profiling import timed
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 def mortgage_monthly_payment(
     annual_interest_rate: float,
@@ -11,6 +31,8 @@ def mortgage_monthly_payment(
 
     Based on reference https://onladder.co.uk/blog/how-to-calculate-mortgage-repayments/
     """
+    import numpy_financial as npf
+
     return float(-npf.pmt(
         rate=annual_interest_rate / 12,
         nper=total_time_period_in_years * 12,
@@ -25,6 +47,8 @@ def mortgage_principal_contribution(
 ):
     """For a given mortgage payment and time period, calculate the payment proportion that goes towards the principal.
     """
+    import numpy_financial as npf
+
     pv = npf.pv(
         rate=annual_interest_rate / 12,
         nper=total_time_period_in_years*12,
@@ -40,50 +64,608 @@ def mortgage_principal_contribution(
         when="end"
     )
 
-def rent_forecasts(
-    time_period: int,
-    rent_initial_amount: int,
-    net_annual_income: int,
-    inflation_rate: float,
-    budget: int,
-    market_return: float,
-    capital_gains_tax_rate: float
-):
+RENT_FORECAST_COLUMNS = (
+    "inflation_rate",
+    "market_return",
+    "budget",
+    "cumulative_inflation_rate",
+    "cumulative_market_return",
+    "net_annual_income",
+    "rent_amount",
+    "savings",
+    "cumulative_savings",
+    "portfolio_value",
+    "portfolio_value_after_tax",
+)
+
+BUY_FORECAST_COLUMNS = (
+    "mortgage_payment",
+    "mortgage_principal",
+    "mortgage_interest",
+    "house_appreciation_rate",
+    "net_annual_income",
+    "exceeding_budget",
+    "cumulative_house_appreciation",
+    "house_value",
+    "buying_transaction_cost",
+    "house_value_after_tax",
+    "cumulative_mortgage_principal",
+    "buyer_savings",
+    "cumulative_buyer_savings",
+    "mortgage_principal_pending_amount",
+)
+
+def _scenario_params(time_period, **params):
+    """Broadcast scenario parameters to a common (scenarios, years) layout.
+
+    Every parameter can be a scalar, a 1-D array with one value per scenario or
+    a 2-D (scenarios, years) array with one value per scenario and year. The
+    horizon is the longest `time_period`; years past a scenario's own
+    `time_period` are flagged as inactive in the returned mask.
+    """
+    time_period = np.atleast_1d(np.asarray(time_period)).astype(int)
+    arrays = {}
+    for name, value in params.items():
+        value = np.asarray(value, dtype=float)
+        if value.ndim < 2:
+            value = value.reshape(-1, 1)
+        arrays[name] = value
+
+    scenarios = np.broadcast_shapes(
+        time_period.shape, *(value.shape[:1] for value in arrays.values())
+    )[0]
+    years = int(time_period.max())
+    time_period = np.broadcast_to(time_period, (scenarios,))
+    arrays = {
+        name: np.broadcast_to(value, (scenarios, value.shape[1]))
+        for name, value in arrays.items()
+    }
+
+    active = np.arange(1, years + 1) <= time_period[:, None]
+
+    return time_period, arrays, active
+
+def _mask_inactive(forecasts: dict, active: np.ndarray) -> dict:
+    if active.all():
+        return forecasts
+    return {
+        name: np.where(active, values, np.nan)
+        for name, values in forecasts.items()
+    }
+
+def _mortgage_payment(loan_amount, monthly_rate, nper):
+    """Fixed monthly payment that repays `loan_amount` in `nper` months."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return loan_amount * np.where(
+            monthly_rate == 0,
+            1 / nper,
+            monthly_rate / -np.expm1(-nper * np.log1p(monthly_rate))
+        )
+
+def _mortgage_balance(loan_amount, monthly_rate, monthly_payment, month):
+    """Outstanding principal right after the payment of `month` (0 is the origination)."""
+    growth = np.expm1(month * np.log1p(monthly_rate))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annuity = np.where(monthly_rate == 0, month, growth / monthly_rate)
+    return loan_amount * (1 + growth) - monthly_payment * annuity
+
+def _monthly_rate_path(annual_interest_rate: np.ndarray, loans: int, months: int, resolution: str) -> np.ndarray:
+    """Monthly rates as a (loans, months) array, from one rate per loan or a monthly or yearly path."""
+    if resolution not in ("year", "month"):
+        raise ValueError(f"Unsupported rate resolution '{resolution}', use 'year' or 'month'")
+    periods = annual_interest_rate.shape[1]
+    if periods > 1:
+        needed = months if resolution == "month" else -(-months // 12)
+        if periods < needed:
+            raise ValueError(f"The rate path has {periods} periods, expected at least {needed} {resolution}s")
+        if resolution == "year":
+            annual_interest_rate = np.repeat(annual_interest_rate, 12, axis=1)
+        annual_interest_rate = annual_interest_rate[:, :months]
+    return np.broadcast_to(annual_interest_rate / 12, (loans, months))
+
+@timed
+def amortization_schedule(
+    loan_amount,
+    annual_interest_rate,
+    total_time_period_in_years,
+    prepayment=0.0,
+    prepayment_effect: str = "term",
+    rate_resolution: str = "year"
+) -> dict:
+    """Monthly amortization schedule of many loans at once.
+
+    Every parameter can be a scalar or hold one value per loan. The interest
+    rate can also be a (loans, years) path for variable rate mortgages, or a
+    (loans, months) path with `rate_resolution="month"`, whose payment is
+    recomputed over the remaining term whenever the rate changes. Paths
+    longer than the term are cut to it. The prepayment is paid every month on top of
+    the scheduled payment, or can be a (loans, months) array, e.g. to model
+    lump sums. With `prepayment_effect="term"` prepayments keep the payment
+    and shorten the term, with `"payment"` they keep the term and lower the
+    payment.
+
+    Fixed rate loans without prepayments use the closed form, the rest a
+    monthly recurrence vectorized over the loans.
+
+    Returns a dict with the `payment` (interest and principal), `interest`,
+    `principal`, `prepayment` and the `balance` left after each month, as
+    (loans, months) arrays. Months past the term of a loan, or after it is
+    repaid, are zeros.
+    """
+    if prepayment_effect not in ("term", "payment"):
+        raise ValueError(f"Unsupported prepayment effect '{prepayment_effect}', use 'term' or 'payment'")
+
+    nper = np.atleast_1d(np.asarray(total_time_period_in_years)).astype(int) * 12
+    loan_amount = np.atleast_1d(np.asarray(loan_amount, dtype=float))
+    rate = np.asarray(annual_interest_rate, dtype=float)
+    rate = rate.reshape(-1, 1) if rate.ndim < 2 else rate
+    prepayment = np.asarray(prepayment, dtype=float)
+    prepayment = prepayment.reshape(-1, 1) if prepayment.ndim < 2 else prepayment
 
-    forecasts = pd.DataFrame()
+    loans = np.broadcast_shapes(nper.shape, loan_amount.shape, rate.shape[:1], prepayment.shape[:1])[0]
+    months = int(nper.max())
+    nper = np.broadcast_to(nper, (loans,))
+    loan_amount = np.broadcast_to(loan_amount, (loans,))
+    monthly_rate = _monthly_rate_path(rate, loans, months, rate_resolution)
+    prepayment = np.broadcast_to(prepayment, (loans, months))
+    active = np.arange(1, months + 1) <= nper[:, None]
 
-    year_start = datetime.datetime.now().year
+    if not prepayment.any() and (monthly_rate == monthly_rate[:, :1]).all():
+        monthly_rate = monthly_rate[:, :1]
+        monthly_payment = _mortgage_payment(loan_amount[:, None], monthly_rate, nper[:, None])
+        balance = _mortgage_balance(
+            loan_amount[:, None], monthly_rate, monthly_payment, np.arange(0, months + 1)
+        )
+        balance = np.where(np.arange(0, months + 1) <= nper[:, None], balance, 0.0)
+        principal = np.where(active, balance[:, :-1] - balance[:, 1:], 0.0)
+        payment = np.where(active, monthly_payment, 0.0)
+        return {
+            "payment": payment,
+            "interest": payment - principal,
+            "principal": principal,
+            "prepayment": np.zeros((loans, months)),
+            "balance": balance[:, 1:],
+        }
 
-    year_end = year_start + time_period
+    schedule = {name: np.zeros((loans, months)) for name in ("payment", "interest", "principal", "prepayment", "balance")}
+    balance = loan_amount.copy()
+    monthly_payment = np.zeros(loans)
+    previous_rate = np.full(loans, np.nan)
+    for month in range(months):
+        rate = monthly_rate[:, month]
+        remaining = nper - month
+        live = remaining > 0
+        # re-amortize the balance over the remaining term when the rate changes
+        reset = live if prepayment_effect == "payment" else live & (rate != previous_rate)
+        if reset.any():
+            monthly_payment = np.where(
+                reset, _mortgage_payment(balance, rate, np.maximum(remaining, 1)), monthly_payment
+            )
+        interest = np.where(live, balance * rate, 0.0)
+        principal = np.where(live, np.minimum(monthly_payment - interest, balance), 0.0)
+        balance = balance - principal
+        extra = np.minimum(prepayment[:, month] * live, balance)
+        balance = balance - extra
 
-    forecasts.index = pd.date_range(
-        start=f'{year_start}-01-01',
-        end=f'{year_end-1}-12-31',
-        freq='Y'
+        schedule["payment"][:, month] = interest + principal
+        schedule["interest"][:, month] = interest
+        schedule["principal"][:, month] = principal
+        schedule["prepayment"][:, month] = extra
+        schedule["balance"][:, month] = balance
+        previous_rate = rate
+
+    return schedule
+
+def rent_forecasts_batch(
+    time_period,
+    rent_initial_amount,
+    net_annual_income,
+    inflation_rate,
+    budget,
+    market_return,
+    capital_gains_tax_rate
+) -> dict:
+    """Vectorized version of `rent_forecasts` for many scenarios at once.
+
+    Parameters accept scalars, one value per scenario or, for the rates, a
+    (scenarios, years) path. A parameter table can be passed directly with
+    `rent_forecasts_batch(**scenarios_df)`. Returns a dict mapping each column
+    of `rent_forecasts` to a (scenarios, years) array, with NaN on the years
+    beyond a scenario's `time_period`.
+    """
+    time_period, p, active = _scenario_params(
+        time_period,
+        rent_initial_amount=rent_initial_amount,
+        net_annual_income=net_annual_income,
+        inflation_rate=inflation_rate,
+        budget=budget,
+        market_return=market_return,
+        capital_gains_tax_rate=capital_gains_tax_rate,
+    )
+    shape = active.shape
+
+    f = {}
+    f["inflation_rate"] = np.broadcast_to(p["inflation_rate"], shape)
+    f["market_return"] = np.broadcast_to(p["market_return"], shape)
+    f["budget"] = np.broadcast_to(p["budget"], shape)
+
+    f["cumulative_inflation_rate"] = np.cumprod(1 + f["inflation_rate"], axis=1)
+    f["cumulative_market_return"] = np.cumprod(1 + f["market_return"], axis=1)
+
+    f["net_annual_income"] = p["net_annual_income"] * f["cumulative_inflation_rate"]
+
+    f["rent_amount"] = p["rent_initial_amount"] * f["cumulative_inflation_rate"]
+    f["savings"] = f["net_annual_income"] - f["rent_amount"]
+    f["cumulative_savings"] = np.cumsum(f["savings"], axis=1)
+    f["portfolio_value"] = f["budget"] * f["cumulative_market_return"]
+    f["portfolio_value_after_tax"] = (
+        f["portfolio_value"] -
+        (f["portfolio_value"] - f["budget"]) * p["capital_gains_tax_rate"]
     )
 
-    forecasts["inflation_rate"] = inflation_rate
-    forecasts["market_return"] = market_return
-    forecasts["budget"] = budget
+    return _mask_inactive(f, active)
+
+def buy_forecasts_batch(
+    time_period,
+    net_annual_income,
+    house_price,
+    house_appreciation_rate,
+    house_maintenance_cost_rate,
+    buying_transaction_cost_rate,
+    loan_amount,
+    mortgage_interest_rate
+) -> dict:
+    """Vectorized version of `buy_forecasts` for many scenarios at once.
 
-    forecasts["cumulative_inflation_rate"] = (1 + forecasts["inflation_rate"]).cumprod()
-    forecasts["cumulative_market_return"] = (1 + forecasts["market_return"]).cumprod()
+    Same conventions as `rent_forecasts_batch`, except that the mortgage is
+    fixed rate: `mortgage_interest_rate` takes one rate per scenario, or a
+    (scenarios, years) path that is constant over the years of the scenario,
+    see `amortization_schedule` for variable rate mortgages. The mortgage term
+    of each scenario is its `time_period`, and the mortgage figures are yearly
+    totals.
+    """
+    time_period, p, active = _scenario_params(
+        time_period,
+        net_annual_income=net_annual_income,
+        house_price=house_price,
+        house_appreciation_rate=house_appreciation_rate,
+        house_maintenance_cost_rate=house_maintenance_cost_rate,
+        buying_transaction_cost_rate=buying_transaction_cost_rate,
+        loan_amount=loan_amount,
+        mortgage_interest_rate=mortgage_interest_rate,
+    )
+    shape = active.shape
+    years = shape[1]
 
-    forecasts["net_annual_income"] = net_annual_income * forecasts["cumulative_inflation_rate"]
+    rate = p["mortgage_interest_rate"]
+    if ((rate != rate[:, :1]) & active[:, :rate.shape[1]]).any():
+        raise ValueError("The mortgage interest rate must be fixed over the years of a scenario")
 
-    forecasts["rent_amount"] = rent_initial_amount * forecasts["cumulative_inflation_rate"]
-    forecasts["savings"] = forecasts["net_annual_income"] - forecasts["rent_amount"]
-    forecasts["cumulative_savings"] = forecasts["savings"].cumsum()
-    forecasts["portfolio_value"] = (
-        forecasts["budget"] * forecasts["cumulative_market_return"]
+    # closed-form amortization evaluated at the year boundaries only
+    monthly_rate = rate[:, :1] / 12
+    nper = time_period[:, None] * 12
+    monthly_payment = _mortgage_payment(p["loan_amount"], monthly_rate, nper)
+    balance = _mortgage_balance(
+        p["loan_amount"], monthly_rate, monthly_payment, np.arange(0, years + 1) * 12
     )
-    forecasts["portfolio_value_after_tax"] = (
-        forecasts["portfolio_value"] - 
-        (forecasts["portfolio_value"] - forecasts["budget"]) * capital_gains_tax_rate
+
+    f = {}
+    f["mortgage_payment"] = np.broadcast_to(monthly_payment * 12, shape)
+    f["mortgage_principal"] = balance[:, :-1] - balance[:, 1:]
+    f["mortgage_interest"] = f["mortgage_payment"] - f["mortgage_principal"]
+
+    f["house_appreciation_rate"] = np.broadcast_to(p["house_appreciation_rate"], shape)
+    f["net_annual_income"] = np.broadcast_to(p["net_annual_income"], shape)
+    f["exceeding_budget"] = np.broadcast_to(p["loan_amount"], shape)
+
+    f["cumulative_house_appreciation"] = np.cumprod(1 + f["house_appreciation_rate"], axis=1)
+    f["house_value"] = p["house_price"] * f["cumulative_house_appreciation"]
+    f["buying_transaction_cost"] = np.broadcast_to(
+        -(p["house_price"] * p["buying_transaction_cost_rate"]), shape
     )
 
-    return forecasts
+    f["house_value_after_tax"] = f["house_value"] * (1 - p["buying_transaction_cost_rate"])
+    f["cumulative_mortgage_principal"] = np.cumsum(f["mortgage_principal"], axis=1)
+    f["buyer_savings"] = (
+        f["net_annual_income"] -
+        f["mortgage_payment"] -
+        f["house_value"] * p["house_maintenance_cost_rate"]
+    )
+    f["cumulative_buyer_savings"] = np.cumsum(f["buyer_savings"], axis=1)
+    f["mortgage_principal_pending_amount"] = -(p["loan_amount"] - f["cumulative_mortgage_principal"])
+
+    return _mask_inactive(f, active)
+
+class ForecastResult:
+    """Compact forecast: one contiguous float array plus its column names.
+
+    `values` has one row per column, so for a single scenario it is a
+    (columns, years) array and every column is a contiguous view. Batched
+    results built with `from_batch` keep a (columns, scenarios, years) array
+    instead. The DatetimeIndex and DataFrames are only built when asked for.
+    """
+
+    __slots__ = ("values", "columns", "year_start", "freq", "_positions", "_index")
+
+    def __init__(self, values, columns, year_start: int, freq: str = "Y", dtype=np.float64):
+        self.values = np.ascontiguousarray(values, dtype=dtype)
+        self.values.flags.writeable = False
+        self.columns = tuple(columns)
+        self.year_start = year_start
+        self.freq = freq
+        self._positions = {column: i for i, column in enumerate(self.columns)}
+        self._index = None
+
+    @classmethod
+    def from_batch(cls, forecasts: dict, columns, year_start: int, dtype=np.float64):
+        """Stack the (scenarios, years) arrays of a `*_batch` function, optionally as float32."""
+        values = np.empty((len(columns),) + forecasts[columns[0]].shape, dtype=dtype)
+        for i, column in enumerate(columns):
+            values[i] = forecasts[column]
+        return cls(values, columns, year_start, dtype=dtype)
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.values[self._positions[column]]
+
+    def __contains__(self, column: str) -> bool:
+        return column in self._positions
+
+    def __len__(self) -> int:
+        return self.values.shape[-1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes
+
+    @property
+    def index(self) -> "pd.DatetimeIndex":
+        if self._index is None:
+            import pandas as pd
+
+            periods = len(self)
+            self._index = pd.date_range(start=f'{self.year_start}-01-01', periods=periods, freq=self.freq)
+        return self._index
+
+    def with_columns(self, **columns) -> "ForecastResult":
+        """Return a new result with the given derived columns appended."""
+        added = np.broadcast_arrays(*columns.values(), np.empty(self.values.shape[1:]))[:-1]
+        return ForecastResult(
+            np.concatenate([self.values, np.stack(added)]),
+            self.columns + tuple(columns),
+            self.year_start,
+            self.freq,
+            self.values.dtype
+        )
 
+    def merge(self, other: "ForecastResult", suffixes=("_x", "_y")) -> "ForecastResult":
+        """Side by side concatenation of two results over the same years.
+
+        Like `pd.merge` on the index, but a single concatenation of both value
+        arrays with no index alignment. Column names present on both sides get
+        the `suffixes`.
+        """
+        if self.year_start != other.year_start or self.values.shape[1:] != other.values.shape[1:]:
+            raise ValueError("Only results over the same years can be merged")
+        overlap = set(self.columns) & set(other.columns)
+        columns = (
+            [c + suffixes[0] if c in overlap else c for c in self.columns] +
+            [c + suffixes[1] if c in overlap else c for c in other.columns]
+        )
+        return ForecastResult(
+            np.concatenate([self.values, other.values]),
+            columns,
+            self.year_start,
+            self.freq,
+            np.result_type(self.values, other.values)
+        )
+
+    def to_frame(self, columns=None) -> "pd.DataFrame":
+        """Build a DataFrame with all or some of the columns of a single scenario result."""
+        import pandas as pd
+
+        if self.values.ndim != 2:
+            raise ValueError("Only single scenario results can be converted to a DataFrame")
+        columns = self.columns if columns is None else list(columns)
+        values = self.values if columns == self.columns else self.values[[self._positions[c] for c in columns]]
+        return pd.DataFrame(values.T, index=self.index, columns=list(columns), copy=True)
+
+# bump to invalidate the cached forecasts when their meaning changes without
+# a change of this module, e.g. a new NumPy rounding behaviour
+CACHE_VERSION = 1
+
+@functools.lru_cache(maxsize=None)
+def _model_version() -> str:
+    """`CACHE_VERSION` and a digest of the source of this module, so that any change to the model misses the cache."""
+    try:
+        with open(__file__, "rb") as file:
+            digest = hashlib.sha256(file.read()).hexdigest()[:16]
+    except OSError:
+        digest = "unknown"
+    return f"{CACHE_VERSION}-{digest}"
+
+class ForecastCache:
+    """Two tier cache for forecast results.
+
+    Results are keyed on a hash of the model version, see `_model_version`,
+    the function name and its float-normalized arguments. An in-process LRU
+    of at most `max_entries` results sits in front of an optional on-disk
+    tier in `directory`, where each result is stored in a file named after
+    its key so that it can be shared across processes, apps and server
+    restarts. The files are plain NumPy archives loaded without pickle, so
+    that a file planted in a shared directory can not run code.
+    """
+
+    def __init__(self, max_entries: int = 256, directory: str | None = None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(function_name: str, params: dict) -> str:
+        """Canonical hash of a forecast call, equal for 30 and 30.0 or 0.0 and -0.0."""
+        def normalize(value):
+            if isinstance(value, (bool, str)) or value is None:
+                return value
+            return repr(float(value) + 0.0)
+
+        payload = json.dumps(
+            {
+                "version": _model_version(),
+                "function": function_name,
+                "params": {k: normalize(v) for k, v in params.items()},
+            },
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.npz")
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        if self.directory is not None and os.path.exists(self._path(key)):
+            try:
+                with np.load(self._path(key), allow_pickle=False) as archive:
+                    value = ForecastResult(
+                        archive["values"],
+                        archive["columns"].tolist(),
+                        int(archive["year_start"]),
+                        str(archive["freq"]),
+                        archive["values"].dtype
+                    )
+            except Exception:
+                # a partially written or stale file is just a miss
+                value = None
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value):
+        self._remember(key, value)
+        if self.directory is not None:
+            path = self._path(key)
+            temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(temporary_path, "wb") as file:
+                    np.savez(
+                        file,
+                        values=value.values,
+                        columns=np.array(value.columns),
+                        year_start=value.year_start,
+                        freq=value.freq
+                    )
+                os.replace(temporary_path, path)
+            except OSError:
+                # a read-only, full or missing directory only loses the disk tier
+                with contextlib.suppress(OSError):
+                    os.remove(temporary_path)
+
+    def _remember(self, key: str, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop the in-process entries and reset the counters (the disk tier is kept)."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+# shared by every forecast call in the process, set FORECAST_CACHE_DIR to
+# enable the on-disk tier
+forecast_cache = ForecastCache(directory=os.environ.get("FORECAST_CACHE_DIR"))
+
+def _memoize_forecast(function):
+    """Serve `function` results from `forecast_cache`.
+
+    `function` returns a `ForecastResult`, which is what gets cached, and
+    callers get it back as is with `as_frame=False` or as a new DataFrame they
+    are free to modify. `year_start` defaults to the current year, which is
+    resolved here so that it is part of the cache key.
+    """
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        if arguments.arguments["year_start"] is None:
+            arguments.arguments["year_start"] = datetime.datetime.now().year
+        as_frame = arguments.arguments.pop("as_frame")
+
+        key = forecast_cache.key(function.__qualname__, arguments.arguments)
+        forecasts = forecast_cache.get(key)
+        if forecasts is None:
+            forecasts = function(*arguments.args, **arguments.kwargs)
+            forecast_cache.put(key, forecasts)
+        return forecasts.to_frame() if as_frame else forecasts
+
+    return wrapper
+
+@timed
+@_memoize_forecast
+def rent_forecasts(
+    time_period: int,
+    rent_initial_amount: int,
+    net_annual_income: int,
+    inflation_rate: float,
+    budget: int,
+    market_return: float,
+    capital_gains_tax_rate: float,
+    year_start: int | None = None,
+    as_frame: bool = True
+):
+    """Yearly forecast of the renter scenario as a DataFrame, see `rent_forecasts_batch`.
+
+    Results are memoized in `forecast_cache`. The forecast starts on `year_start`,
+    the current year by default. Use `as_frame=False` to get a `ForecastResult`.
+    """
+    forecasts = rent_forecasts_batch(
+        time_period=time_period,
+        rent_initial_amount=rent_initial_amount,
+        net_annual_income=net_annual_income,
+        inflation_rate=inflation_rate,
+        budget=budget,
+        market_return=market_return,
+        capital_gains_tax_rate=capital_gains_tax_rate
+    )
+
+    return ForecastResult(
+        [forecasts[column][0] for column in RENT_FORECAST_COLUMNS],
+        RENT_FORECAST_COLUMNS,
+        year_start
+    )
+
+@timed
+@_memoize_forecast
 def buy_forecasts(
     time_period: int,
     net_annual_income: int,
@@ -92,75 +674,1061 @@ def buy_forecasts(
     house_maintenance_cost_rate: float,
     buying_transaction_cost_rate: float,
     loan_amount: float,
-    mortgage_interest_rate: float
+    mortgage_interest_rate: float,
+    resolution: str = "year",
+    year_start: int | None = None,
+    as_frame: bool = True
+):
+    """Yearly forecast of the buyer scenario as a DataFrame, see `buy_forecasts_batch`.
+
+    With `resolution="month"` the monthly mortgage schedule is returned instead.
+    Results are memoized in `forecast_cache`, as in `rent_forecasts`.
+    """
+    if resolution == "month":
+        schedule = amortization_schedule(loan_amount, mortgage_interest_rate, time_period)
+        return ForecastResult(
+            [
+                schedule["payment"][0],
+                np.arange(1, (time_period*12) + 1),
+                schedule["principal"][0],
+                schedule["interest"][0]
+            ],
+            ("mortgage_payment", "mortgage_period", "mortgage_principal", "mortgage_interest"),
+            year_start,
+            freq="M"
+        )
+    if resolution != "year":
+        raise ValueError(f"Unsupported resolution '{resolution}', use 'year' or 'month'")
+
+    forecasts = buy_forecasts_batch(
+        time_period=time_period,
+        net_annual_income=net_annual_income,
+        house_price=house_price,
+        house_appreciation_rate=house_appreciation_rate,
+        house_maintenance_cost_rate=house_maintenance_cost_rate,
+        buying_transaction_cost_rate=buying_transaction_cost_rate,
+        loan_amount=loan_amount,
+        mortgage_interest_rate=mortgage_interest_rate
+    )
+
+    return ForecastResult(
+        [forecasts[column][0] for column in BUY_FORECAST_COLUMNS],
+        BUY_FORECAST_COLUMNS,
+        year_start
+    )
+
+@timed
+def buy_vs_rent_analysis(
+    time_period: int,
+    budget: float,
+    net_annual_income: float,
+    rent_initial_amount: float,
+    inflation_rate: float,
+    market_return: float,
+    house_appreciation_rate: float,
+    house_maintenance_cost_rate: float,
+    down_payment_rate: float,
+    capital_gains_tax_rate: float,
+    mortgage_interest_rate: float,
+    transaction_cost_rate: float,
+    year_start: int | None = None
+) -> ForecastResult:
+    """Full buy-vs-rent analysis of a single scenario, as shown by the buy-vs-rent app.
+
+    The renter invests the whole budget on the markets. The buyer spends it on
+    the house and its transaction cost, and invests the loan amount (the
+    exceeding budget) on the markets. Returns the renter forecast, with
+    `renter_net_worth`, merged with the house and markets forecasts of the
+    buyer, with `buyer_net_worth`.
+    """
+    house_price = budget / (1 + transaction_cost_rate)
+    loan_amount = house_price * (1 - down_payment_rate)
+
+    rent = rent_forecasts(
+        time_period=time_period,
+        rent_initial_amount=rent_initial_amount,
+        inflation_rate=inflation_rate,
+        market_return=market_return,
+        budget=budget,
+        net_annual_income=net_annual_income,
+        capital_gains_tax_rate=capital_gains_tax_rate,
+        year_start=year_start,
+        as_frame=False
+    )
+    rent = rent.with_columns(
+        renter_net_worth=rent["portfolio_value_after_tax"] + rent["cumulative_savings"]
+    )
+
+    house = buy_forecasts(
+        time_period=time_period,
+        net_annual_income=net_annual_income,
+        house_price=house_price,
+        house_appreciation_rate=house_appreciation_rate,
+        house_maintenance_cost_rate=house_maintenance_cost_rate,
+        buying_transaction_cost_rate=transaction_cost_rate,
+        loan_amount=loan_amount,
+        mortgage_interest_rate=mortgage_interest_rate,
+        year_start=year_start,
+        as_frame=False
+    )
+    markets = rent_forecasts(
+        time_period=time_period,
+        rent_initial_amount=0,
+        inflation_rate=inflation_rate,
+        market_return=market_return,
+        budget=loan_amount,
+        net_annual_income=net_annual_income,
+        capital_gains_tax_rate=capital_gains_tax_rate,
+        year_start=year_start,
+        as_frame=False
+    )
+    buy = house.merge(markets, suffixes=("_house", "_markets"))
+    buy = buy.with_columns(
+        buyer_net_worth=(
+            buy["house_value_after_tax"] +
+            buy["buying_transaction_cost"] +
+            buy["mortgage_principal_pending_amount"] +
+            buy["cumulative_buyer_savings"] +
+            buy["portfolio_value_after_tax"]
+        )
+    )
+
+    return rent.merge(buy, suffixes=("_rent", "_buy"))
+
+def buy_vs_rent_batch(
+    time_period,
+    budget,
+    net_annual_income,
+    rent_initial_amount,
+    inflation_rate,
+    market_return,
+    house_appreciation_rate,
+    house_maintenance_cost_rate,
+    down_payment_rate,
+    capital_gains_tax_rate,
+    mortgage_interest_rate,
+    transaction_cost_rate
+) -> dict:
+    """Net worth of the renter and the buyer for many buy-vs-rent scenarios at once.
+
+    Same model as `buy_vs_rent_analysis`, returning only `renter_net_worth`
+    and `buyer_net_worth` as (scenarios, years) arrays.
+    """
+    budget = np.asarray(budget, dtype=float)
+    transaction_cost_rate = np.asarray(transaction_cost_rate, dtype=float)
+    house_price = budget / (1 + transaction_cost_rate)
+    loan_amount = house_price * (1 - np.asarray(down_payment_rate, dtype=float))
+
+    rent = rent_forecasts_batch(
+        time_period=time_period,
+        rent_initial_amount=rent_initial_amount,
+        net_annual_income=net_annual_income,
+        inflation_rate=inflation_rate,
+        budget=budget,
+        market_return=market_return,
+        capital_gains_tax_rate=capital_gains_tax_rate
+    )
+    house = buy_forecasts_batch(
+        time_period=time_period,
+        net_annual_income=net_annual_income,
+        house_price=house_price,
+        house_appreciation_rate=house_appreciation_rate,
+        house_maintenance_cost_rate=house_maintenance_cost_rate,
+        buying_transaction_cost_rate=transaction_cost_rate,
+        loan_amount=loan_amount,
+        mortgage_interest_rate=mortgage_interest_rate
+    )
+    markets = rent_forecasts_batch(
+        time_period=time_period,
+        rent_initial_amount=0,
+        net_annual_income=net_annual_income,
+        inflation_rate=inflation_rate,
+        budget=loan_amount,
+        market_return=market_return,
+        capital_gains_tax_rate=capital_gains_tax_rate
+    )
+
+    return {
+        "renter_net_worth": (
+            rent["portfolio_value_after_tax"] +
+            rent["cumulative_savings"]
+        ),
+        "buyer_net_worth": (
+            house["house_value_after_tax"] +
+            house["buying_transaction_cost"] +
+            house["mortgage_principal_pending_amount"] +
+            house["cumulative_buyer_savings"] +
+            markets["portfolio_value_after_tax"]
+        ),
+    }
+
+@timed
+def buy_vs_rent_analysis_batch(
+    time_period,
+    budget,
+    net_annual_income,
+    rent_initial_amount,
+    inflation_rate,
+    market_return,
+    house_appreciation_rate,
+    house_maintenance_cost_rate,
+    down_payment_rate,
+    capital_gains_tax_rate,
+    mortgage_interest_rate,
+    transaction_cost_rate,
+    year_start: int | None = None
+) -> ForecastResult:
+    """Vectorized version of `buy_vs_rent_analysis` for many scenarios at once.
+
+    Same conventions as `rent_forecasts_batch`. Returns a batched result with
+    the same columns as `buy_vs_rent_analysis`, as (columns, scenarios, years)
+    values.
+    """
+    year_start = datetime.date.today().year if year_start is None else year_start
+    budget = np.asarray(budget, dtype=float)
+    transaction_cost_rate = np.asarray(transaction_cost_rate, dtype=float)
+    house_price = budget / (1 + transaction_cost_rate)
+    loan_amount = house_price * (1 - np.asarray(down_payment_rate, dtype=float))
+
+    rent = ForecastResult.from_batch(
+        rent_forecasts_batch(
+            time_period=time_period,
+            rent_initial_amount=rent_initial_amount,
+            net_annual_income=net_annual_income,
+            inflation_rate=inflation_rate,
+            budget=budget,
+            market_return=market_return,
+            capital_gains_tax_rate=capital_gains_tax_rate
+        ),
+        RENT_FORECAST_COLUMNS,
+        year_start
+    )
+    rent = rent.with_columns(
+        renter_net_worth=rent["portfolio_value_after_tax"] + rent["cumulative_savings"]
+    )
+    house = ForecastResult.from_batch(
+        buy_forecasts_batch(
+            time_period=time_period,
+            net_annual_income=net_annual_income,
+            house_price=house_price,
+            house_appreciation_rate=house_appreciation_rate,
+            house_maintenance_cost_rate=house_maintenance_cost_rate,
+            buying_transaction_cost_rate=transaction_cost_rate,
+            loan_amount=loan_amount,
+            mortgage_interest_rate=mortgage_interest_rate
+        ),
+        BUY_FORECAST_COLUMNS,
+        year_start
+    )
+    markets = ForecastResult.from_batch(
+        rent_forecasts_batch(
+            time_period=time_period,
+            rent_initial_amount=0,
+            net_annual_income=net_annual_income,
+            inflation_rate=inflation_rate,
+            budget=loan_amount,
+            market_return=market_return,
+            capital_gains_tax_rate=capital_gains_tax_rate
+        ),
+        RENT_FORECAST_COLUMNS,
+        year_start
+    )
+    buy = house.merge(markets, suffixes=("_house", "_markets"))
+    buy = buy.with_columns(
+        buyer_net_worth=(
+            buy["house_value_after_tax"] +
+            buy["buying_transaction_cost"] +
+            buy["mortgage_principal_pending_amount"] +
+            buy["cumulative_buyer_savings"] +
+            buy["portfolio_value_after_tax"]
+        )
+    )
+
+    return rent.merge(buy, suffixes=("_rent", "_buy"))
+
+def _unchanged(previous, value) -> bool:
+    """Whether an input or node value is known to be the same, scalars are compared by value."""
+    if previous is value:
+        return True
+    if isinstance(previous, (int, float, str, np.generic)) and isinstance(value, (int, float, str, np.generic)):
+        return previous == value
+    return False
+
+class _Node:
+    __slots__ = ("function", "inputs", "extend", "value", "arguments", "versions")
+
+    def __init__(self, function, extend=None):
+        self.function = function
+        self.inputs = tuple(inspect.signature(function).parameters)
+        self.extend = extend
+        self.value = None
+        self.arguments = None
+        self.versions = None
+
+class ModelGraph:
+    """Graph of memoized quantities derived from a set of inputs.
+
+    Every node is a function whose parameters name the inputs and other nodes
+    it depends on. Nodes are computed when first asked for, with `graph[name]`,
+    and then only recomputed when one of their dependencies changed. A node
+    whose recomputed value is the same scalar as before does not invalidate
+    the nodes that depend on it.
+
+    A node can also have an `extend(previous, previous_arguments, arguments)`
+    function, tried before a full recomputation, that derives the new value
+    from the previous one, or returns None when it can not.
+
+    :param nodes: The functions of the nodes by name, or (function, extend) pairs.
+    :type nodes: dict
+    :param inputs: The initial value of the inputs.
+    """
+
+    def __init__(self, nodes: dict, **inputs):
+        self._nodes = {
+            name: _Node(*node) if isinstance(node, tuple) else _Node(node)
+            for name, node in nodes.items()
+        }
+        self._inputs = {}
+        self._versions = {}
+        # names of the nodes computed since the inputs were last set
+        self.recomputed = []
+        self.set(**inputs)
+
+    def set(self, **inputs):
+        """Set the value of some inputs, nodes depending on changed ones are recomputed on access."""
+        self.recomputed = []
+        for name, value in inputs.items():
+            if name in self._nodes:
+                raise ValueError(f"'{name}' is a node of the graph, not an input")
+            if name not in self._inputs or not _unchanged(self._inputs[name], value):
+                self._inputs[name] = value
+                self._versions[name] = self._versions.get(name, 0) + 1
+
+    def __getitem__(self, name: str):
+        if name in self._inputs:
+            return self._inputs[name]
+        node = self._nodes[name]
+        arguments = {dependency: self[dependency] for dependency in node.inputs}
+        versions = tuple(self._versions[dependency] for dependency in node.inputs)
+        if versions == node.versions:
+            return node.value
+
+        value = None
+        if node.extend is not None and node.versions is not None:
+            value = node.extend(node.value, node.arguments, arguments)
+        if value is None:
+            value = node.function(**arguments)
+        if node.versions is None or not _unchanged(node.value, value):
+            self._versions[name] = self._versions.get(name, 0) + 1
+        node.value, node.arguments, node.versions = value, arguments, versions
+        self.recomputed.append(name)
+        return value
+
+def _rent_side(
+    time_period,
+    rent_initial_amount,
+    net_annual_income,
+    inflation_rate,
+    budget,
+    market_return,
+    capital_gains_tax_rate,
+    year_start
+) -> ForecastResult:
+    forecasts = rent_forecasts_batch(
+        time_period=time_period,
+        rent_initial_amount=rent_initial_amount,
+        net_annual_income=net_annual_income,
+        inflation_rate=inflation_rate,
+        budget=budget,
+        market_return=market_return,
+        capital_gains_tax_rate=capital_gains_tax_rate
+    )
+    return ForecastResult([forecasts[column][0] for column in RENT_FORECAST_COLUMNS], RENT_FORECAST_COLUMNS, year_start)
+
+def _extend_rent_side(previous: ForecastResult, years: int, **params) -> ForecastResult:
+    """Append the years of a longer horizon to a single scenario rent forecast.
+
+    The rent forecast of year `n + k` is the one of year `k` of a forecast
+    starting with the inflation and returns accumulated until year `n`, so
+    only the appended years are computed.
+    """
+    inflation = previous["cumulative_inflation_rate"][-1]
+    returns = previous["cumulative_market_return"][-1]
+    tail = rent_forecasts_batch(
+        time_period=years - len(previous),
+        rent_initial_amount=params["rent_initial_amount"] * inflation,
+        net_annual_income=params["net_annual_income"] * inflation,
+        inflation_rate=params["inflation_rate"],
+        budget=params["budget"],
+        market_return=params["market_return"],
+        capital_gains_tax_rate=params["capital_gains_tax_rate"]
+    )
+    tail = {column: values[0] for column, values in tail.items()}
+    tail["cumulative_inflation_rate"] = tail["cumulative_inflation_rate"] * inflation
+    tail["cumulative_market_return"] = tail["cumulative_market_return"] * returns
+    tail["portfolio_value"] = tail["portfolio_value"] * returns
+    tail["portfolio_value_after_tax"] = (
+        tail["portfolio_value"] -
+        (tail["portfolio_value"] - tail["budget"]) * params["capital_gains_tax_rate"]
+    )
+    tail["cumulative_savings"] = tail["cumulative_savings"] + previous["cumulative_savings"][-1]
+    if "renter_net_worth" in previous:
+        tail["renter_net_worth"] = tail["portfolio_value_after_tax"] + tail["cumulative_savings"]
+
+    return ForecastResult(
+        np.concatenate([previous.values, np.stack([tail[column] for column in previous.columns])], axis=1),
+        previous.columns,
+        previous.year_start
+    )
+
+def _horizon_change(previous_arguments: dict, arguments: dict):
+    """The previous and new `time_period` when it is the only changed argument, else None."""
+    changed = [name for name in arguments if not _unchanged(previous_arguments[name], arguments[name])]
+    if changed != ["time_period"]:
+        return None
+    return previous_arguments["time_period"], arguments["time_period"]
+
+def _resize_rent_side(previous: ForecastResult, previous_arguments: dict, arguments: dict, **params):
+    horizon = _horizon_change(previous_arguments, arguments)
+    if horizon is None or arguments["time_period"] < 1:
+        return None
+    old, new = horizon
+    if new <= old:
+        return ForecastResult(previous.values[:, :new], previous.columns, previous.year_start)
+    return _extend_rent_side(previous, new, **params)
+
+def _house_price(budget, transaction_cost_rate):
+    return budget / (1 + transaction_cost_rate)
+
+def _loan_amount(house_price, down_payment_rate):
+    return house_price * (1 - down_payment_rate)
+
+def _rent_forecast(
+    time_period,
+    rent_initial_amount,
+    net_annual_income,
+    inflation_rate,
+    budget,
+    market_return,
+    capital_gains_tax_rate,
+    year_start
 ):
+    rent = _rent_side(
+        time_period, rent_initial_amount, net_annual_income, inflation_rate,
+        budget, market_return, capital_gains_tax_rate, year_start
+    )
+    return rent.with_columns(
+        renter_net_worth=rent["portfolio_value_after_tax"] + rent["cumulative_savings"]
+    )
 
-    forecasts = pd.DataFrame()
+def _extend_rent_forecast(previous, previous_arguments, arguments):
+    return _resize_rent_side(previous, previous_arguments, arguments, **arguments)
 
-    year_start = datetime.datetime.now().year
+def _market_forecast(
+    time_period,
+    net_annual_income,
+    inflation_rate,
+    loan_amount,
+    market_return,
+    capital_gains_tax_rate,
+    year_start
+):
+    return _rent_side(
+        time_period, 0, net_annual_income, inflation_rate,
+        loan_amount, market_return, capital_gains_tax_rate, year_start
+    )
 
-    year_end = year_start + time_period
+def _extend_market_forecast(previous, previous_arguments, arguments):
+    return _resize_rent_side(
+        previous, previous_arguments, arguments,
+        rent_initial_amount=0,
+        budget=arguments["loan_amount"],
+        **{name: value for name, value in arguments.items() if name != "loan_amount"}
+    )
 
-    forecasts.index = pd.date_range(
-        start=f'{year_start}-01-01',
-        end=f'{year_end-1}-12-31',
-        freq='M'
+def _house_forecast(
+    time_period,
+    net_annual_income,
+    house_price,
+    house_appreciation_rate,
+    house_maintenance_cost_rate,
+    transaction_cost_rate,
+    loan_amount,
+    mortgage_interest_rate,
+    year_start
+):
+    # the mortgage term is the horizon, so a new horizon changes every year
+    # of the house forecast and it is always rebuilt
+    forecasts = buy_forecasts_batch(
+        time_period=time_period,
+        net_annual_income=net_annual_income,
+        house_price=house_price,
+        house_appreciation_rate=house_appreciation_rate,
+        house_maintenance_cost_rate=house_maintenance_cost_rate,
+        buying_transaction_cost_rate=transaction_cost_rate,
+        loan_amount=loan_amount,
+        mortgage_interest_rate=mortgage_interest_rate
     )
+    return ForecastResult([forecasts[column][0] for column in BUY_FORECAST_COLUMNS], BUY_FORECAST_COLUMNS, year_start)
 
-    MORTGAGE_PAYMENT = -npf.pmt(
-        pv=loan_amount,
-        nper=time_period*12,
-        rate=mortgage_interest_rate/12 # TODO: not sure if i can just divide the annual rate by 12 to get the monthly rate
+def _buy_forecast(house_forecast, market_forecast):
+    buy = house_forecast.merge(market_forecast, suffixes=("_house", "_markets"))
+    return buy.with_columns(
+        buyer_net_worth=(
+            buy["house_value_after_tax"] +
+            buy["buying_transaction_cost"] +
+            buy["mortgage_principal_pending_amount"] +
+            buy["cumulative_buyer_savings"] +
+            buy["portfolio_value_after_tax"]
+        )
     )
 
-    forecasts["mortgage_payment"] = MORTGAGE_PAYMENT
-    forecasts["mortgage_period"] = range(1, (time_period*12) +1 )
-    forecasts["mortgage_principal"] = -npf.ppmt(
-        rate=mortgage_interest_rate/12,
-        per=forecasts["mortgage_period"],
-        nper=time_period*12,
-        pv=loan_amount
+def _net_worth(rent_forecast, buy_forecast):
+    return {
+        "renter_net_worth": rent_forecast["renter_net_worth"],
+        "buyer_net_worth": buy_forecast["buyer_net_worth"],
+    }
+
+def _analysis(rent_forecast, buy_forecast):
+    return rent_forecast.merge(buy_forecast, suffixes=("_rent", "_buy"))
+
+BUY_VS_RENT_NODES = {
+    "house_price": _house_price,
+    "loan_amount": _loan_amount,
+    "rent_forecast": (_rent_forecast, _extend_rent_forecast),
+    "house_forecast": _house_forecast,
+    "market_forecast": (_market_forecast, _extend_market_forecast),
+    "buy_forecast": _buy_forecast,
+    "net_worth": _net_worth,
+    "analysis": _analysis,
+}
+
+class BuyVsRentModel(ModelGraph):
+    """Incremental `buy_vs_rent_analysis` of a single scenario, for interactive use.
+
+    The analysis is a graph of memoized nodes, see `BUY_VS_RENT_NODES`, so
+    that after `update` only the nodes depending on the changed parameters are
+    recomputed, e.g. a new rent only recomputes the rent forecast, not the
+    buyer side. A longer horizon appends years to the rent and market
+    forecasts, while the house forecast is rebuilt as the mortgage term is the
+    horizon.
+
+        model = BuyVsRentModel(**params)
+        model.analysis
+        model.update(rent_initial_amount=15000)
+        model.recomputed  # ["rent_forecast", "analysis"]
+
+    Takes the parameters of `buy_vs_rent_analysis`.
+    """
+
+    def __init__(self, year_start: int | None = None, **params):
+        year_start = datetime.date.today().year if year_start is None else year_start
+        super().__init__(BUY_VS_RENT_NODES, year_start=year_start, **params)
+
+    @timed
+    def update(self, **params) -> "BuyVsRentModel":
+        """Set some parameters of the analysis, returning the model."""
+        self.set(**params)
+        return self
+
+    @property
+    @timed("financial.BuyVsRentModel.analysis")
+    def analysis(self) -> ForecastResult:
+        """The same result as `buy_vs_rent_analysis`."""
+        return self["analysis"]
+
+    @property
+    def net_worth(self) -> dict:
+        """The renter and buyer net worth series, by name."""
+        return self["net_worth"]
+
+# assumed yearly volatility and correlation of market return, inflation and
+# house appreciation for the Monte Carlo simulation
+MONTE_CARLO_VOLATILITY = (0.15, 0.01, 0.05)
+MONTE_CARLO_CORRELATION = (
+    (1.0, -0.2, 0.1),
+    (-0.2, 1.0, 0.5),
+    (0.1, 0.5, 1.0),
+)
+
+@timed
+def simulate_buy_vs_rent(
+    paths: int = 20000,
+    seed: int | None = None,
+    volatility=MONTE_CARLO_VOLATILITY,
+    correlation=MONTE_CARLO_CORRELATION,
+    percentiles=(5, 25, 50, 75, 95),
+    chunk_size: int = 5000,
+    **params
+) -> dict:
+    """Monte Carlo simulation of the buy-vs-rent outcome.
+
+    Market return, inflation and house appreciation are drawn each year as
+    correlated normals centered on the `market_return`, `inflation_rate` and
+    `house_appreciation_rate` in `params` (the rest of the `buy_vs_rent_batch`
+    parameters, as scalars). Paths are simulated `chunk_size` at a time so the
+    intermediate forecast columns never hold more than a chunk; only the two
+    net worth series are kept, in float32. The same `seed` reproduces the same
+    paths whatever the chunk size.
+
+    Returns the requested `percentiles` of `renter_net_worth` and
+    `buyer_net_worth` as (percentiles, years) arrays and the yearly
+    `buy_wins_probability`.
+    """
+    years = int(params["time_period"])
+    mean = np.array([
+        params.pop("market_return"),
+        params.pop("inflation_rate"),
+        params.pop("house_appreciation_rate")
+    ])
+    scale = np.linalg.cholesky(np.asarray(correlation)) * np.asarray(volatility)[:, None]
+
+    rng = np.random.default_rng(seed)
+    renter = np.empty((paths, years), dtype=np.float32)
+    buyer = np.empty((paths, years), dtype=np.float32)
+    for start in range(0, paths, chunk_size):
+        stop = min(start + chunk_size, paths)
+        draws = mean + rng.standard_normal((stop - start, years, 3)) @ scale.T
+        net_worth = buy_vs_rent_batch(
+            market_return=draws[..., 0],
+            inflation_rate=draws[..., 1],
+            house_appreciation_rate=draws[..., 2],
+            **params
+        )
+        renter[start:stop] = net_worth["renter_net_worth"]
+        buyer[start:stop] = net_worth["buyer_net_worth"]
+
+    return {
+        "percentiles": np.asarray(percentiles),
+        "renter_net_worth": np.percentile(renter, percentiles, axis=0),
+        "buyer_net_worth": np.percentile(buyer, percentiles, axis=0),
+        "buy_wins_probability": (buyer > renter).mean(axis=0),
+    }
+
+@timed
+def sensitivity_analysis(
+    relative_step: float = 0.1,
+    parameters=None,
+    absolute_steps=None,
+    **params
+) -> dict:
+    """Sensitivity of `buyer_net_worth - renter_net_worth` to every buy-vs-rent input.
+
+    Each of `parameters` (by default every input but `time_period`) is nudged
+    down and up by `relative_step` of its value, and all the nudged scenarios
+    are evaluated together in a single `buy_vs_rent_batch` call. A relative
+    step of a zero input is no move at all, so inputs equal to zero are
+    nudged by their step in `absolute_steps` instead, e.g.
+    `{"net_annual_income": 1200}`, and left out of the analysis without one.
+
+    Returns the analysed `parameters` and the `excluded` zero inputs, the net
+    worth difference of the `baseline` (years,) and of the `low` and `high`
+    scenarios (parameters, years), along with the central difference
+    `partial_effect` per unit of each parameter (parameters, years).
+    """
+    absolute_steps = {} if absolute_steps is None else absolute_steps
+    if parameters is None:
+        parameters = [name for name in params if name != "time_period"]
+    excluded = [name for name in parameters if params[name] == 0 and name not in absolute_steps]
+    parameters = [name for name in parameters if name not in excluded]
+
+    value = np.array([params[name] for name in parameters], dtype=float)
+    absolute = np.array([absolute_steps.get(name, np.nan) for name in parameters], dtype=float)
+    step = np.where(value == 0, absolute, np.abs(value) * relative_step)
+
+    # scenario 0 is the baseline, then the low and high nudge of each parameter
+    scenarios = {name: np.full(1 + 2 * len(parameters), params[name], dtype=float) for name in params}
+    for i, name in enumerate(parameters):
+        scenarios[name][1 + i] -= step[i]
+        scenarios[name][1 + len(parameters) + i] += step[i]
+    scenarios["time_period"] = int(params["time_period"])
+
+    net_worth = buy_vs_rent_batch(**scenarios)
+    difference = net_worth["buyer_net_worth"] - net_worth["renter_net_worth"]
+    low = difference[1:1 + len(parameters)]
+    high = difference[1 + len(parameters):]
+
+    return {
+        "parameters": parameters,
+        "excluded": excluded,
+        "baseline": difference[0],
+        "low": low,
+        "high": high,
+        "partial_effect": (high - low) / (2 * step[:, None]),
+    }
+
+@timed
+def break_even_year(**params) -> np.ndarray:
+    """First year in which `buyer_net_worth` is above `renter_net_worth`.
+
+    Takes the `buy_vs_rent_batch` parameters and returns one year number
+    (1 is the first forecast year) per scenario, or NaN when buying never
+    overtakes renting within the time period.
+    """
+    net_worth = buy_vs_rent_batch(**params)
+    ahead = net_worth["buyer_net_worth"] > net_worth["renter_net_worth"]
+    return np.where(ahead.any(axis=1), ahead.argmax(axis=1) + 1, np.nan)
+
+@timed
+def solve_break_even(
+    parameter: str,
+    lower: float,
+    upper: float,
+    horizons=None,
+    tolerance: float = 1e-8,
+    max_iterations: int = 100,
+    **params
+) -> np.ndarray:
+    """Value of `parameter` that makes buying and renting equal at the end of each horizon.
+
+    `horizons` are time periods in years (the mortgage term follows the time
+    period, as in the app) and default to `params["time_period"]`. The other
+    `buy_vs_rent_batch` parameters can be scalars or one value per horizon.
+    All the roots are found together with a vectorized Illinois (regula falsi)
+    iteration within the `lower` and `upper` bracket, so every iteration is a
+    single batched evaluation of the model. Horizons without a sign change in
+    the bracket get NaN.
+    """
+    horizons = np.atleast_1d(params.pop("time_period") if horizons is None else horizons).astype(int)
+    params.pop("time_period", None)
+    params.pop(parameter, None)
+    rows = np.arange(len(horizons))
+
+    def difference(value):
+        net_worth = buy_vs_rent_batch(time_period=horizons, **{parameter: value}, **params)
+        return (net_worth["buyer_net_worth"] - net_worth["renter_net_worth"])[rows, horizons - 1]
+
+    a = np.full(len(horizons), lower, dtype=float)
+    b = np.full(len(horizons), upper, dtype=float)
+    fa, fb = difference(a), difference(b)
+    bracketed = np.sign(fa) != np.sign(fb)
+
+    for _ in range(max_iterations):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            c = np.where(fb == fa, (a + b) / 2, b - fb * (b - a) / (fb - fa))
+        fc = difference(c)
+        crossed = np.sign(fc) != np.sign(fb)
+        a, fa = np.where(crossed, b, a), np.where(crossed, fb, fa / 2)
+        b, fb = c, fc
+        if (~bracketed | (np.abs(b - a) <= tolerance * (1 + np.abs(b))) | (fb == 0)).all():
+            break
+
+    return np.where(bracketed, b, np.nan)
+
+RENTAL_ROI_COLUMNS = (
+    "house_value",
+    "mortgage_principal_pending_amount",
+    "home_equity",
+    "expected_annual_rent",
+    "inflation_rate",
+    "Long term renter income",
+    "Long term renter costs",
+    "Long term renter cashflow",
+    "Long term renter cumulative cashflow",
+    "Long term renter net worth",
+    "Long term renter net profit",
+    "Long term renter cumulative ROI",
+    "Long term renter incremental ROI",
+    "Short term renter income",
+    "Short term renter costs",
+    "Short term renter cashflow",
+    "Short term renter cumulative cashflow",
+    "Short term renter net worth",
+    "Short term renter net profit",
+    "Short term renter cumulative ROI",
+    "Short term renter incremental ROI",
+    "Market returns",
+    "Market returns cumulative ROI",
+)
+
+def _incremental_return(values: np.ndarray) -> np.ndarray:
+    """Year over year change along the last axis, NaN on the first year."""
+    change = np.full(values.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change[..., 1:] = values[..., 1:] / values[..., :-1] - 1
+    return change
+
+def rental_roi_batch(
+    house_price,
+    airbnb_multiplier,
+    usage_pct,
+    maintenance_pct,
+    service_fee,
+    annual_suplies,
+    rent_expectation_rate,
+    buying_transaction_costs_pct,
+    down_payment_rate,
+    annual_interest_rate,
+    total_time_period_in_years,
+    market_return,
+    private_use_nights,
+    inflation_rate,
+    house_appreciation_rate=None
+) -> dict:
+    """ROI of buying a house to rent it out, long term or short term, against the market.
+
+    Uses the out-of-pocket method: the net profit (cumulative cashflow plus
+    home equity, minus the down payment and buying transaction cost) over the
+    initial investment. The house is financed over the whole time period and
+    appreciates with inflation, unless a `house_appreciation_rate` is given.
+    Parameters follow the conventions of
+    `rent_forecasts_batch` and the result maps each of `RENTAL_ROI_COLUMNS` to
+    a (scenarios, years) array.
+    """
+    time_period, p, active = _scenario_params(
+        total_time_period_in_years,
+        house_price=house_price,
+        airbnb_multiplier=airbnb_multiplier,
+        usage_pct=usage_pct,
+        maintenance_pct=maintenance_pct,
+        service_fee=service_fee,
+        annual_suplies=annual_suplies,
+        rent_expectation_rate=rent_expectation_rate,
+        buying_transaction_costs_pct=buying_transaction_costs_pct,
+        down_payment_rate=down_payment_rate,
+        annual_interest_rate=annual_interest_rate,
+        market_return=market_return,
+        private_use_nights=private_use_nights,
+        inflation_rate=inflation_rate,
+        house_appreciation_rate=inflation_rate if house_appreciation_rate is None else house_appreciation_rate,
     )
-    forecasts["mortgage_interest"] = -npf.ipmt(
-        rate=mortgage_interest_rate/12,
-        per=forecasts["mortgage_period"],
-        nper=time_period*12,
-        pv=loan_amount
+    shape = active.shape
+
+    down_payment = p["house_price"] * p["down_payment_rate"]
+    initial_investment = down_payment + p["house_price"] * p["buying_transaction_costs_pct"]
+    house = buy_forecasts_batch(
+        time_period=time_period,
+        net_annual_income=0,
+        house_price=p["house_price"],
+        house_appreciation_rate=p["house_appreciation_rate"],
+        house_maintenance_cost_rate=p["maintenance_pct"],
+        buying_transaction_cost_rate=p["buying_transaction_costs_pct"],
+        loan_amount=p["house_price"] - down_payment,
+        mortgage_interest_rate=p["annual_interest_rate"]
     )
 
-    assert (
-        forecasts["mortgage_payment"].round(2) == 
-        (forecasts["mortgage_principal"] + forecasts["mortgage_interest"]).round(2)
-    ).all()
+    f = {}
+    f["house_value"] = house["house_value"]
+    f["mortgage_principal_pending_amount"] = np.abs(house["mortgage_principal_pending_amount"])
+    f["home_equity"] = f["house_value"] - f["mortgage_principal_pending_amount"]
+    f["expected_annual_rent"] = f["house_value"] * p["rent_expectation_rate"]
+    f["inflation_rate"] = np.broadcast_to(p["inflation_rate"], shape)
 
-    # aggregate at the year level
-    forecasts["year"] = forecasts.index.year
-    forecasts = forecasts.groupby("year").sum()
+    # Long term renter
+    costs = {
+        "Long term renter": (
+            house["mortgage_payment"] +
+            house["house_value"] * p["maintenance_pct"]
+        )
+    }
+    incomes = {"Long term renter": f["expected_annual_rent"]}
 
-    del forecasts["mortgage_period"]
-    forecasts.index = pd.date_range(
-        start=f'{year_start}-01-01',
-        end=f'{year_end-1}-12-31',
-        freq='Y'
+    # Short term renter
+    effective_use_pct = p["usage_pct"] - p["private_use_nights"] / 365
+    short_term_rent = f["expected_annual_rent"] * p["airbnb_multiplier"] * effective_use_pct
+    incomes["Short term renter"] = short_term_rent
+    costs["Short term renter"] = (
+        house["mortgage_payment"] +
+        # maintenance costs depend on usage
+        house["house_value"] * p["maintenance_pct"] * effective_use_pct +
+        # airbnb take
+        short_term_rent * p["service_fee"] +
+        p["annual_suplies"] * effective_use_pct
     )
-    
-    forecasts["house_appreciation_rate"] = house_appreciation_rate
-    forecasts["net_annual_income"] = net_annual_income
-    forecasts["exceeding_budget"] = loan_amount
 
-    forecasts["cumulative_house_appreciation"] = (1 + forecasts["house_appreciation_rate"]).cumprod()
-    forecasts["house_value"] = house_price * forecasts["cumulative_house_appreciation"]
-    forecasts["buying_transaction_cost"] = -(house_price * buying_transaction_cost_rate)
+    for renter in ("Long term renter", "Short term renter"):
+        f[f"{renter} income"] = incomes[renter]
+        f[f"{renter} costs"] = costs[renter]
+        f[f"{renter} cashflow"] = f[f"{renter} income"] - f[f"{renter} costs"]
+        f[f"{renter} cumulative cashflow"] = np.cumsum(f[f"{renter} cashflow"], axis=1)
+        f[f"{renter} net worth"] = f[f"{renter} cumulative cashflow"] + f["home_equity"]
+        f[f"{renter} net profit"] = f[f"{renter} net worth"] - initial_investment
+        f[f"{renter} cumulative ROI"] = f[f"{renter} net profit"] / initial_investment
+        f[f"{renter} incremental ROI"] = _incremental_return(f[f"{renter} net worth"])
+
+    # Market returns
+    f["Market returns"] = np.broadcast_to(p["market_return"], shape)
+    f["Market returns cumulative ROI"] = np.cumprod(1 + f["Market returns"], axis=1) - 1
+
+    return _mask_inactive({column: f[column] for column in RENTAL_ROI_COLUMNS}, active)
+
+@timed
+@_memoize_forecast
+def rental_roi_forecasts(
+    house_price: float,
+    airbnb_multiplier: float,
+    usage_pct: float,
+    maintenance_pct: float,
+    service_fee: float,
+    annual_suplies: float,
+    rent_expectation_rate: float,
+    buying_transaction_costs_pct: float,
+    down_payment_rate: float,
+    annual_interest_rate: float,
+    total_time_period_in_years: int,
+    market_return: float,
+    private_use_nights: int,
+    inflation_rate: float,
+    year_start: int | None = None,
+    as_frame: bool = True
+):
+    """Yearly rental ROI of a single scenario as a DataFrame, see `rental_roi_batch`.
+
+    Memoized like `rent_forecasts`.
+    """
+    forecasts = rental_roi_batch(
+        house_price=house_price,
+        airbnb_multiplier=airbnb_multiplier,
+        usage_pct=usage_pct,
+        maintenance_pct=maintenance_pct,
+        service_fee=service_fee,
+        annual_suplies=annual_suplies,
+        rent_expectation_rate=rent_expectation_rate,
+        buying_transaction_costs_pct=buying_transaction_costs_pct,
+        down_payment_rate=down_payment_rate,
+        annual_interest_rate=annual_interest_rate,
+        total_time_period_in_years=total_time_period_in_years,
+        market_return=market_return,
+        private_use_nights=private_use_nights,
+        inflation_rate=inflation_rate
+    )
 
-    forecasts["house_value_after_tax"] = forecasts["house_value"] * (1 - buying_transaction_cost_rate)
-    forecasts["cumulative_mortgage_principal"] = forecasts["mortgage_principal"].cumsum()
-    forecasts["buyer_savings"] = (
-        forecasts["net_annual_income"] - 
-        forecasts["mortgage_payment"] - 
-        forecasts["house_value"] * house_maintenance_cost_rate
+    return ForecastResult(
+        [forecasts[column][0] for column in RENTAL_ROI_COLUMNS],
+        RENTAL_ROI_COLUMNS,
+        year_start
     )
-    forecasts["cumulative_buyer_savings"] = forecasts["buyer_savings"].cumsum()
-    forecasts["mortgage_principal_pending_amount"] = -(loan_amount - forecasts["cumulative_mortgage_principal"])
-    
 
+# historical series of `load_historical_series`, as yearly rates
+HISTORICAL_SERIES = ("market_return", "inflation_rate", "house_appreciation_rate", "mortgage_interest_rate")
+
+def load_historical_series(file) -> dict:
+    """Load annual historical series from a CSV file for the backtests.
+
+    The file has a `year` column, with consecutive years, and a column per
+    available series of `HISTORICAL_SERIES`, as rates (0.05 for 5%). House
+    prices can be given instead of their appreciation, as a `house_price`
+    index column: the appreciation of a year is then its change from the
+    previous year, and the first year is dropped.
+
+    :param file: The path of the CSV file, or a file object.
+    :return: A dict with the `year` and one array per series.
+    :rtype: dict
+    """
+    table = np.genfromtxt(file, delimiter=",", names=True, dtype=float, encoding="utf-8")
+    table = np.atleast_1d(table)
+    columns = table.dtype.names
+    if "year" not in columns:
+        raise ValueError("The historical series need a 'year' column")
+    history = {"year": table["year"].astype(int)}
+    for name in HISTORICAL_SERIES:
+        if name in columns:
+            history[name] = table[name]
+    if "house_price" in columns and "house_appreciation_rate" not in columns:
+        history = {name: values[1:] for name, values in history.items()}
+        history["house_appreciation_rate"] = table["house_price"][1:] / table["house_price"][:-1] - 1
+    if len(history) == 1:
+        raise ValueError(f"No historical series found, expected some of {', '.join(HISTORICAL_SERIES)}")
+    if (np.diff(history["year"]) != 1).any():
+        raise ValueError("The years of the historical series must be consecutive")
+    if any(np.isnan(values).any() for name, values in history.items() if name != "year"):
+        raise ValueError("The historical series have missing values")
+    return history
+
+def _backtest(function, history: dict, parameters: dict, horizon: str, params: dict, fixed=()) -> dict:
+    """Run a `*_batch` function once over every start year of the historical series.
+
+    `parameters` maps the historical series to the parameters of `function`,
+    and the parameters in `fixed` take the value of the start year only.
+    """
+    years = int(params[horizon])
+    series = {parameters[name]: values for name, values in history.items() if name in parameters}
+    given = set(series) & set(params)
+    if given:
+        raise ValueError(f"{', '.join(sorted(given))} taken from the historical series can not be given")
+    if len(history["year"]) < years:
+        raise ValueError(f"The historical series cover less than {years} years")
+
+    # one (cohorts, years) view of every series, a row per cohort start year, without copies
+    windows = {name: sliding_window_view(values, years) for name, values in series.items()}
+    windows.update({name: windows[name][:, :1] for name in fixed if name in windows})
+    forecasts = function(**windows, **params)
+    forecasts["start_year"] = history["year"][:len(history["year"]) - years + 1]
     return forecasts
+
+def _cohort_distribution(result: dict, outputs, percentiles) -> dict:
+    result["percentiles"] = np.asarray(percentiles)
+    for output in outputs:
+        result[f"{output} percentiles"] = np.percentile(result[output], percentiles, axis=0)
+    return result
+
+@timed
+def backtest_buy_vs_rent(history: dict, percentiles=(5, 25, 50, 75, 95), **params) -> dict:
+    """Buy-vs-rent outcome of every historical cohort, i.e. start year, at once.
+
+    Each cohort lives `time_period` years of the historical series instead of
+    constant rates, and takes a mortgage at the rate of its start year. All
+    the cohorts are evaluated in a single `buy_vs_rent_batch` call on sliding
+    window views of the series.
+
+    :param history: Historical series, see `load_historical_series`.
+    :type history: dict
+    :param percentiles: The percentiles of the distribution across cohorts.
+    :param params: The other `buy_vs_rent_batch` parameters, as scalars, for
+        the rates without historical series too.
+    :return: The `start_year` of the cohorts, their `renter_net_worth`,
+        `buyer_net_worth` and `difference` (buyer minus renter) as
+        (cohorts, years) arrays, the percentiles of each of them across
+        cohorts as "<output> percentiles", the `break_even_year` of every
+        cohort and the yearly `buy_wins_share` of cohorts.
+    :rtype: dict
+    """
+    result = _backtest(
+        buy_vs_rent_batch,
+        history,
+        {name: name for name in HISTORICAL_SERIES},
+        "time_period",
+        params,
+        fixed=("mortgage_interest_rate",)
+    )
+    result["difference"] = result["buyer_net_worth"] - result["renter_net_worth"]
+    ahead = result["difference"] > 0
+    result["break_even_year"] = np.where(ahead.any(axis=1), ahead.argmax(axis=1) + 1, np.nan)
+    result["buy_wins_share"] = ahead.mean(axis=0)
+    return _cohort_distribution(result, ("renter_net_worth", "buyer_net_worth", "difference"), percentiles)
+
+@timed
+def backtest_buy_for_rent(history: dict, percentiles=(5, 25, 50, 75, 95), **params) -> dict:
+    """Rental ROI of every historical cohort at once, see `backtest_buy_vs_rent`.
+
+    The mortgage `annual_interest_rate` is the historical mortgage rate of
+    the start year, and the house appreciates with the historical house
+    prices when available, with inflation otherwise.
+
+    :param history: Historical series, see `load_historical_series`.
+    :type history: dict
+    :param percentiles: The percentiles of the distribution across cohorts.
+    :param params: The other `rental_roi_batch` parameters, as scalars.
+    :return: The `start_year` of the cohorts and every `RENTAL_ROI_COLUMNS`
+        as (cohorts, years) arrays, with the percentiles of the cumulative
+        ROIs across cohorts.
+    :rtype: dict
+    """
+    result = _backtest(
+        rental_roi_batch,
+        history,
+        {
+            "market_return": "market_return",
+            "inflation_rate": "inflation_rate",
+            "house_appreciation_rate": "house_appreciation_rate",
+            "mortgage_interest_rate": "annual_interest_rate",
+        },
+        "total_time_period_in_years",
+        params,
+        fixed=("annual_interest_rate",)
+    )
+    return _cohort_distribution(
+        result,
+        ("Long term renter cumulative ROI", "Short term renter cumulative ROI", "Market returns cumulative ROI"),
+        percentiles
+    )
@@ -1,17 +1,58 @@
-from typing import List
+"""Google Calendar API helpers.
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+The Google client libraries and pandas are only imported on first use, so
+that importing this module stays cheap for processes that never call the API.
+"""
 
+from typing import TYPE_CHECKING, List
+
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+import contextlib
+import functools
+import hashlib
+import json
 import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from shared.profiling import stage, timed
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from google.oauth2.credentials import Credentials
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
 
-def authenticate(credentials_file_path: str) -> Credentials:
+# Event fields requested from the API, nextPageToken is needed for pagination
+EVENT_FIELDS = "nextPageToken,nextSyncToken,items(id,status,summary,start,end,recurringEventId)"
+# Event fields read by EventDecoder
+DECODED_EVENT_FIELDS = "nextPageToken,items(status,summary,start,end)"
+
+# Retries of failed API requests, with exponential backoff starting at RETRY_BACKOFF seconds
+RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_WORKERS = 8
+# how far from now recurring events without an end are expanded when no time_max is given
+RECURRENCE_HORIZON = timedelta(days=366)
+# stored end of recurring events without an end
+RECURRENCE_UNBOUNDED = "9999-12-31T23:59:59Z"
+# default time to live, in seconds, and memory bound, in bytes, of a CalendarCache
+CACHE_TTL = 600
+CACHE_MAX_BYTES = 256 * 2 ** 20
+
+@timed
+def authenticate(credentials_file_path: str) -> "Credentials":
     """Authenticate the user using OAuth 2.0.
 
     :param credentials_file_path: Path to the credentials file.
@@ -19,6 +60,10 @@ def authenticate(credentials_file_path: str) -> Credentials:
     :return: A valid credentials object.
     :rtype: Credentials
     """
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
     # The file token.json stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
@@ -40,47 +85,984 @@ def authenticate(credentials_file_path: str) -> Credentials:
             token.write(creds.to_json())
         return creds
 
-def fetch_calendar_events(credentials: Credentials, calendar_names: List[str]):
+class EventStore:
+    """Local SQLite store of calendar events and the sync token of each calendar.
+
+    A new connection is opened for every operation so that the store can be
+    shared by the threads of a Streamlit server.
+
+    By default the API expands recurring events and every instance is
+    stored. With `single_events=False` only the recurring events themselves
+    and their modified or cancelled instances are synced and stored, and the
+    instances are expanded locally for the requested window when reading,
+    see `expand_recurring_events`. A calendar synced in one mode is fully
+    synced again when read in the other.
+
+    :param path: Path to the SQLite database file.
+    :type path: str
+    :param single_events: Whether to sync the instances of recurring events
+        expanded by the API.
+    :type single_events: bool
+    """
+
+    def __init__(self, path: str = "events.sqlite", single_events: bool = True):
+        self.path = path
+        self.single_events = single_events
+        with self._connect() as connection:
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(events)")]
+            if columns and "start_time" not in columns:
+                # stores without time bounds are rebuilt from a full sync
+                connection.execute("DROP TABLE events")
+                connection.execute("DROP TABLE IF EXISTS sync_tokens")
+            elif columns and "recurring_event_id" not in columns:
+                connection.execute("ALTER TABLE events ADD COLUMN recurring_event_id TEXT")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "calendar_id TEXT NOT NULL, event_id TEXT NOT NULL, "
+                "start_time TEXT NOT NULL, end_time TEXT NOT NULL, payload TEXT NOT NULL, "
+                "recurring_event_id TEXT, "
+                "PRIMARY KEY (calendar_id, event_id))"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS events_start_time ON events (calendar_id, start_time)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sync_tokens ("
+                "calendar_id TEXT PRIMARY KEY, token TEXT NOT NULL)"
+            )
+
+    def __repr__(self):
+        return f"EventStore({self.path!r}, single_events={self.single_events})"
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _token_keys(self, calendar_id: str):
+        """The sync token key of a calendar in the mode of the store, then in the other mode."""
+        keys = (calendar_id, f"{calendar_id} (recurring)")
+        return keys if self.single_events else keys[::-1]
+
+    def sync_token(self, calendar_id: str):
+        """Return the sync token of the last complete sync of a calendar, if any."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT token FROM sync_tokens WHERE calendar_id = ?", (self._token_keys(calendar_id)[0],)
+            ).fetchone()
+        return row[0] if row else None
+
+    def apply(self, calendar_id: str, events: List[dict], sync_token: str = None, full: bool = False):
+        """Apply a complete sync result to a calendar in a single transaction.
+
+        Cancelled events are deleted and the rest are inserted or replaced. A
+        `full` sync replaces every stored event of the calendar. Without
+        `single_events`, cancelled instances of recurring events are kept to
+        leave them out of the expansion, and the instances of deleted
+        recurring events are deleted with them.
+        """
+        key, other_key = self._token_keys(calendar_id)
+        exceptions = not self.single_events
+        deleted, kept = [], []
+        for event in events:
+            if event.get("status") == "cancelled" and not (exceptions and event.get("recurringEventId")):
+                deleted.append(event)
+            else:
+                kept.append(event)
+        with self._connect() as connection:
+            if full:
+                connection.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+                connection.execute("DELETE FROM sync_tokens WHERE calendar_id = ?", (other_key,))
+            connection.executemany(
+                "DELETE FROM events WHERE calendar_id = ? AND event_id = ?",
+                [(calendar_id, event["id"]) for event in deleted]
+            )
+            if exceptions:
+                connection.executemany(
+                    "DELETE FROM events WHERE calendar_id = ? AND recurring_event_id = ?",
+                    [(calendar_id, event["id"]) for event in deleted]
+                )
+            connection.executemany(
+                "INSERT OR REPLACE INTO events "
+                "(calendar_id, event_id, start_time, end_time, payload, recurring_event_id) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (calendar_id, event["id"], *_stored_bounds(event), json.dumps(event), event.get("recurringEventId"))
+                    for event in kept
+                ]
+            )
+            if sync_token is None:
+                connection.execute("DELETE FROM sync_tokens WHERE calendar_id = ?", (key,))
+            else:
+                connection.execute(
+                    "INSERT OR REPLACE INTO sync_tokens (calendar_id, token) VALUES (?, ?)",
+                    (key, sync_token)
+                )
+
+    def _select(
+        self,
+        columns: str,
+        calendar_ids: List[str],
+        time_min: datetime = None,
+        time_max: datetime = None,
+        where: str = None
+    ):
+        query = "SELECT %s FROM events WHERE calendar_id IN (%s)" % (columns, ",".join("?" * len(calendar_ids)))
+        params = list(calendar_ids)
+        if time_min is not None:
+            query += " AND end_time > ?"
+            params.append(_utc_timestamp(time_min))
+        if time_max is not None:
+            query += " AND start_time < ?"
+            params.append(_utc_timestamp(time_max))
+        if where is not None:
+            query += f" AND {where}"
+        query += " ORDER BY start_time DESC"
+        return query, params
+
+    def _single_events_where(self):
+        if self.single_events:
+            return None
+        return "recurring_event_id IS NULL AND json_extract(payload, '$.recurrence') IS NULL"
+
+    def _expanded(self, calendar_ids: List[str], time_min: datetime = None, time_max: datetime = None):
+        """Yield the calendar id and the expanded instances of the stored recurring events."""
+        queries = [
+            # the recurring events of the window, and all the exceptions, as
+            # instances may have been moved into or out of the window
+            self._select(
+                "calendar_id, payload", calendar_ids, time_min, time_max,
+                "json_extract(payload, '$.recurrence') IS NOT NULL"
+            ),
+            self._select("calendar_id, payload", calendar_ids, where="recurring_event_id IS NOT NULL"),
+        ]
+        recurring = {calendar_id: [] for calendar_id in calendar_ids}
+        with self._connect() as connection:
+            for query, params in queries:
+                for calendar_id, payload in connection.execute(query, params):
+                    recurring[calendar_id].append(json.loads(payload))
+        for calendar_id, events in recurring.items():
+            if events:
+                yield calendar_id, list(expand_recurring_events(events, time_min, time_max))
+
+    @timed
+    def events(self, calendar_ids: List[str], time_min: datetime = None, time_max: datetime = None) -> List[dict]:
+        """Return the stored events of the given calendars, latest first.
+
+        Like the API, `time_min` bounds the end and `time_max` the start of
+        the returned events.
+        """
+        query, params = self._select("payload", calendar_ids, time_min, time_max, self._single_events_where())
+        with self._connect() as connection:
+            rows = connection.execute(query, params).fetchall()
+        events = [json.loads(payload) for payload, in rows]
+        if not self.single_events:
+            for _, instances in self._expanded(calendar_ids, time_min, time_max):
+                events.extend(instances)
+            events.sort(key=lambda event: _utc_timestamp(event["start"]), reverse=True)
+        return events
+
+    @timed
+    def decode(
+        self,
+        calendar_ids: List[str],
+        time_min: datetime = None,
+        time_max: datetime = None,
+        decoder: "EventDecoder" = None
+    ) -> "EventDecoder":
+        """Decode the stored events of the given calendars, see `events`.
+
+        The fields are extracted by SQLite, so no event payload is parsed in
+        Python, but for the recurring events expanded locally.
+        """
+        decoder = EventDecoder() if decoder is None else decoder
+        query, params = self._select(
+            "calendar_id, CAST(strftime('%s', start_time) AS INTEGER), "
+            "CAST(strftime('%s', end_time) AS INTEGER), "
+            "json_extract(payload, '$.start.date') IS NOT NULL, json_extract(payload, '$.summary')",
+            calendar_ids, time_min, time_max, self._single_events_where()
+        )
+        with self._connect() as connection:
+            decoder.add_rows(connection.execute(query, params))
+        if not self.single_events:
+            for calendar_id, instances in self._expanded(calendar_ids, time_min, time_max):
+                decoder.add(instances, calendar_id)
+        return decoder
+
+def sync_calendar_events(service, calendar_id: str, store: EventStore, retries: int = RETRIES) -> int:
+    """Bring the stored events of a calendar up to date.
+
+    The first sync downloads every event. Later syncs send the stored sync
+    token and only receive the events that changed or were deleted since. When
+    the server invalidates the token (HTTP 410) the calendar is fully synced
+    again.
+
+    :param service: A Calendar API service object.
+    :param calendar_id: The calendar to sync.
+    :type calendar_id: str
+    :param store: The local event store.
+    :type store: EventStore
+    :param retries: How many times a failed request is retried.
+    :type retries: int
+    :return: The number of changed events received.
+    :rtype: int
+    """
+    from googleapiclient.errors import HttpError
+
+    sync_token = store.sync_token(calendar_id)
+    try:
+        events, next_sync_token = _list_changes(service, calendar_id, sync_token, retries, store.single_events)
+    except HttpError as error:
+        if sync_token is None or error.resp.status != 410:
+            raise
+        sync_token = None
+        events, next_sync_token = _list_changes(service, calendar_id, None, retries, store.single_events)
+
+    store.apply(calendar_id, events, next_sync_token, full=sync_token is None)
+    return len(events)
+
+def _list_changes(service, calendar_id: str, sync_token: str, retries: int = RETRIES, single_events: bool = True):
+    """Follow every page of an events list and return the events and the next sync token."""
+    events = []
+    request = dict(calendarId=calendar_id, maxResults=2500, singleEvents=single_events)
+    if sync_token is not None:
+        request["syncToken"] = sync_token
+    for result in _iter_pages(service, request, retries):
+        events.extend(result.get("items", []))
+    return events, result.get("nextSyncToken")
+
+def _execute(request, retries: int = RETRIES):
+    """Execute an API request, retrying rate limited, server and connection errors with backoff."""
+    from googleapiclient.errors import HttpError
+
+    for attempt in range(retries + 1):
+        try:
+            return request.execute()
+        except (HttpError, socket.timeout, ConnectionError) as error:
+            retryable = not isinstance(error, HttpError) or error.resp.status in RETRY_STATUSES
+            if not retryable or attempt == retries:
+                raise
+            time.sleep(RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+
+def _iter_pages(service, request: dict, retries: int = RETRIES):
+    """Yield every page of an events list request, following the page tokens."""
+    page_token = None
+    while True:
+        result = _execute(service.events().list(**request, pageToken=page_token), retries)
+        yield result
+        page_token = result.get("nextPageToken")
+        if page_token is None:
+            return
+
+def _utc_timestamp(value) -> str:
+    """Sortable UTC timestamp of a datetime or of an event start / end, all-day events start at midnight UTC."""
+    if isinstance(value, dict):
+        value = value.get("dateTime") or value["date"]
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _recurrence_rules(event: dict):
+    """The rule set and the first start of a recurring event, in its time zone.
+
+    All-day events recur on naive dates. The RRULE, RDATE and EXDATE lines
+    are adapted to what dateutil accepts: UNTIL in UTC for timed events and
+    as a naive date for all-day ones, and no VALUE parameters.
+    """
+    from dateutil.rrule import rrulestr
+    from zoneinfo import ZoneInfo
+
+    start = event["start"]
+    if "dateTime" in start:
+        first = datetime.fromisoformat(start["dateTime"])
+        if start.get("timeZone"):
+            first = first.astimezone(ZoneInfo(start["timeZone"]))
+        elif first.tzinfo is None:
+            first = first.replace(tzinfo=timezone.utc)
+    else:
+        first = datetime.fromisoformat(start["date"])
+
+    lines = []
+    for line in event["recurrence"]:
+        name, _, value = line.partition(":")
+        name = name.replace(";VALUE=DATE-TIME", "").replace(";VALUE=DATE", "")
+        if name == "RRULE":
+            parts = []
+            for part in value.split(";"):
+                if part.startswith("UNTIL="):
+                    until = part[len("UNTIL="):]
+                    if first.tzinfo is None:
+                        until = until.rstrip("Z")
+                    elif not until.endswith("Z"):
+                        until = f"{until}T235959Z" if "T" not in until else f"{until}Z"
+                    part = f"UNTIL={until}"
+                parts.append(part)
+            value = ";".join(parts)
+        lines.append(f"{name}:{value}")
+    return rrulestr("\n".join(lines), dtstart=first, forceset=True), first
+
+def _event_duration(event: dict, first: datetime) -> timedelta:
+    end = event["end"]
+    if "dateTime" in end:
+        return datetime.fromisoformat(end["dateTime"]) - first
+    return datetime.fromisoformat(end["date"]) - first
+
+def _stored_bounds(event: dict):
+    """Start and end UTC timestamps of an event as stored, the whole span of recurring events."""
+    start = event.get("start") or event["originalStartTime"]
+    if "recurrence" not in event:
+        return _utc_timestamp(start), _utc_timestamp(event.get("end") or start)
+    rules, first = _recurrence_rules(event)
+    unbounded = any(
+        line.startswith("RRULE") and "UNTIL=" not in line and "COUNT=" not in line
+        for line in event["recurrence"]
+    )
+    if unbounded:
+        return _utc_timestamp(start), RECURRENCE_UNBOUNDED
+    last = first
+    for last in rules:
+        pass
+    return _utc_timestamp(start), _utc_timestamp(last + _event_duration(event, first))
+
+def expand_recurring_events(events: List[dict], time_min: datetime = None, time_max: datetime = None):
+    """Expand recurring events into their instances within a time window, lazily.
+
+    Takes the events of a calendar as listed with `singleEvents=False`:
+    single events, recurring events with their `recurrence` lines (RRULE,
+    RDATE and EXDATE), and their exceptions, the instances that were modified
+    or cancelled, with a `recurringEventId` and an `originalStartTime`.
+    Yields the events of the window as the API would with `singleEvents=True`,
+    in no particular order: the single events, the modified instances and
+    the instances generated by the recurrence rules that were neither
+    modified nor cancelled. Instances recur in the time zone of their
+    recurring event, so that they keep their local time across DST changes.
+
+    :param events: The events of a calendar, without the expanded instances.
+    :type events: List[dict]
+    :param time_min: Only instances ending after this time.
+    :type time_min: datetime
+    :param time_max: Only instances starting before this time, `RECURRENCE_HORIZON`
+        from now by default.
+    :type time_max: datetime
+    :return: A generator of events.
+    """
+    time_max = datetime.now(timezone.utc) + RECURRENCE_HORIZON if time_max is None else time_max
+    window_min = None if time_min is None else _utc_timestamp(time_min)
+    window_max = _utc_timestamp(time_max)
+
+    def in_window(start: str, end: str) -> bool:
+        return start < window_max and (window_min is None or end > window_min)
+
+    masters = []
+    replaced = {}
+    for event in events:
+        if "recurrence" in event:
+            if event.get("status") != "cancelled":
+                masters.append(event)
+            continue
+        if event.get("recurringEventId"):
+            original = event.get("originalStartTime")
+            if original is not None:
+                replaced.setdefault(event["recurringEventId"], set()).add(_utc_timestamp(original))
+        if event.get("status") != "cancelled" and in_window(*_stored_bounds(event)):
+            yield event
+
+    for master in masters:
+        rules, first = _recurrence_rules(master)
+        duration = _event_duration(master, first)
+        skipped = replaced.get(master["id"], ())
+        fields = {name: value for name, value in master.items() if name not in ("recurrence", "start", "end")}
+        all_day = first.tzinfo is None
+        zone = master["start"].get("timeZone")
+
+        after = first if time_min is None else _as_recurrence_time(time_min, first) - duration
+        before = _as_recurrence_time(time_max, first)
+        for start in rules.xafter(max(after, first), inc=True):
+            if start >= before:
+                break
+            if all_day:
+                start_time = {"date": start.date().isoformat()}
+                end_time = {"date": (start + duration).date().isoformat()}
+                suffix = start.strftime("%Y%m%d")
+            else:
+                start_time = {"dateTime": start.isoformat()}
+                end_time = {"dateTime": (start + duration).isoformat()}
+                if zone:
+                    start_time["timeZone"] = end_time["timeZone"] = zone
+                suffix = start.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+            original = _utc_timestamp(start_time)
+            if original in skipped or not in_window(original, _utc_timestamp(end_time)):
+                continue
+            yield {
+                **fields,
+                "id": f"{master['id']}_{suffix}",
+                "recurringEventId": master["id"],
+                "originalStartTime": start_time,
+                "start": start_time,
+                "end": end_time,
+            }
+
+def _as_recurrence_time(value: datetime, first: datetime) -> datetime:
+    """A window bound comparable with the instances of a recurring event starting at `first`."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    if first.tzinfo is None:
+        # all-day instances are naive dates, compared as midnight UTC
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def iter_calendar_events(
+    service,
+    calendar_id: str,
+    time_min: datetime = None,
+    time_max: datetime = None,
+    fields: str = EVENT_FIELDS,
+    page_size: int = 2500,
+    retries: int = RETRIES
+):
+    """Stream the events of a calendar page by page, in start time order.
+
+    The time window and the fields are sent to the API so that only the
+    events and the fields needed are transferred.
+
+    :param service: A Calendar API service object.
+    :param calendar_id: The calendar to fetch events from.
+    :type calendar_id: str
+    :param time_min: Only events ending after this time.
+    :type time_min: datetime
+    :param time_max: Only events starting before this time.
+    :type time_max: datetime
+    :param fields: The response fields to request, `None` for all of them.
+    :type fields: str
+    :param page_size: The maximum number of events per page.
+    :type page_size: int
+    :param retries: How many times a failed request is retried.
+    :type retries: int
+    :return: A generator of lists of calendar events.
+    """
+    request = dict(calendarId=calendar_id, maxResults=page_size, orderBy="startTime", singleEvents=True)
+    if time_min is not None:
+        request["timeMin"] = _utc_timestamp(time_min)
+    if time_max is not None:
+        request["timeMax"] = _utc_timestamp(time_max)
+    if fields is not None:
+        request["fields"] = fields if "nextPageToken" in fields else f"nextPageToken,{fields}"
+
+    for result in _iter_pages(service, request, retries):
+        yield result.get("items", [])
+
+def _epoch_seconds(value: dict) -> int:
+    """Unix time of an event start / end, all-day events start at midnight UTC."""
+    value = datetime.fromisoformat(value.get("dateTime") or value["date"])
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+def _category_code(categories: dict, value) -> int:
+    if value is None:
+        return -1
+    code = categories.get(value)
+    if code is None:
+        code = categories[value] = len(categories)
+    return code
+
+class EventDecoder:
+    """Columnar decoder of calendar events.
+
+    Events are decoded as their pages stream in and only the fields used by
+    the analyses are kept, in typed arrays: start and end as int64 Unix
+    seconds, whether the event lasts all day, and the stripped summary and
+    the calendar id as categorical codes. All-day events start and end at
+    midnight UTC of their dates. Cancelled events are skipped.
+    """
+
+    COLUMNS = ["calendar_id", "summary", "start", "end", "all_day"]
+
+    def __init__(self):
+        self._start = array("q")
+        self._end = array("q")
+        self._all_day = array("b")
+        self._summary = array("i")
+        self._calendar = array("i")
+        self._summaries = {}
+        self._calendars = {}
+
+    def __len__(self):
+        return len(self._start)
+
+    def add(self, events: List[dict], calendar_id: str = None):
+        """Decode a page of events of a calendar."""
+        calendar = _category_code(self._calendars, calendar_id)
+        for event in events:
+            if event.get("status") == "cancelled":
+                continue
+            start = event["start"]
+            summary = event.get("summary")
+            self._start.append(_epoch_seconds(start))
+            self._end.append(_epoch_seconds(event["end"]))
+            self._all_day.append("dateTime" not in start)
+            self._summary.append(_category_code(self._summaries, summary.strip() if summary else None))
+            self._calendar.append(calendar)
+
+    def add_rows(self, rows):
+        """Decode `(calendar_id, start, end, all_day, summary)` rows, with epoch start and end."""
+        for calendar_id, start, end, all_day, summary in rows:
+            self._start.append(start)
+            self._end.append(end)
+            self._all_day.append(all_day)
+            self._summary.append(_category_code(self._summaries, summary.strip() if summary else None))
+            self._calendar.append(_category_code(self._calendars, calendar_id))
+
+    def to_frame(self) -> "pd.DataFrame":
+        """Return the decoded events as a DataFrame, latest first."""
+        import pandas as pd
+
+        start = np.array(self._start, dtype=np.int64)
+        order = np.argsort(-start, kind="stable")
+        return pd.DataFrame({
+            "calendar_id": pd.Categorical.from_codes(
+                np.array(self._calendar, dtype=np.int32)[order], list(self._calendars)
+            ),
+            "summary": pd.Categorical.from_codes(
+                np.array(self._summary, dtype=np.int32)[order], list(self._summaries)
+            ),
+            "start": start[order],
+            "end": np.array(self._end, dtype=np.int64)[order],
+            "all_day": np.array(self._all_day, dtype=bool)[order],
+        }, columns=self.COLUMNS)
+
+def map_calendars(service_factory, calendar_ids: List[str], function, max_workers: int = MAX_WORKERS) -> list:
+    """Run `function(service, calendar_id)` for every calendar on a bounded thread pool.
+
+    API service objects are not thread safe, so every worker thread builds its
+    own with `service_factory`.
+
+    :param service_factory: A callable returning a new Calendar API service object.
+    :param calendar_ids: The calendars to run `function` for.
+    :type calendar_ids: List[str]
+    :param function: The callable to run for every calendar.
+    :param max_workers: The maximum number of calendars processed at once.
+    :type max_workers: int
+    :return: The results of `function`, in the order of `calendar_ids`.
+    :rtype: list
+    """
+    if max_workers <= 1 or len(calendar_ids) <= 1:
+        service = service_factory()
+        return [function(service, calendar_id) for calendar_id in calendar_ids]
+
+    local = threading.local()
+
+    def run(calendar_id):
+        if not hasattr(local, "service"):
+            local.service = service_factory()
+        return function(local.service, calendar_id)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(calendar_ids))) as executor:
+        return list(executor.map(run, calendar_ids))
+
+@timed
+def fetch_events(
+    service_factory,
+    calendar_ids: List[str],
+    store: EventStore = None,
+    time_min: datetime = None,
+    time_max: datetime = None,
+    fields: str = EVENT_FIELDS,
+    max_workers: int = MAX_WORKERS,
+    retries: int = RETRIES
+) -> List[dict]:
+    """Fetch the events of several calendars concurrently, see `fetch_calendar_events`.
+
+    :param service_factory: A callable returning a new Calendar API service object.
+    :param calendar_ids: The ids of the calendars to fetch events from.
+    :type calendar_ids: List[str]
+    :return: A list of calendar events.
+    :rtype: List[dict]
+    """
+    if store is not None:
+        _sync_calendars(service_factory, calendar_ids, store, max_workers, retries)
+        return store.events(calendar_ids, time_min, time_max)
+
+    def fetch(service, calendar_id):
+        return [
+            event
+            for page in iter_calendar_events(
+                service, calendar_id, time_min, time_max, fields, retries=retries
+            )
+            for event in page
+        ]
+
+    events = []
+    for calendar_events in map_calendars(service_factory, calendar_ids, fetch, max_workers):
+        events.extend(calendar_events)
+
+    return events[::-1]
+
+def _sync_calendars(service_factory, calendar_ids: List[str], store: EventStore, max_workers: int, retries: int):
+    with stage("googlelib.sync"):
+        map_calendars(
+            service_factory,
+            calendar_ids,
+            lambda service, calendar_id: sync_calendar_events(service, calendar_id, store, retries),
+            max_workers
+        )
+
+@timed
+def fetch_event_frame(
+    service_factory,
+    calendar_ids: List[str],
+    store: EventStore = None,
+    time_min: datetime = None,
+    time_max: datetime = None,
+    fields: str = DECODED_EVENT_FIELDS,
+    max_workers: int = MAX_WORKERS,
+    retries: int = RETRIES
+) -> "pd.DataFrame":
+    """Fetch the events of several calendars into a columnar frame, see `EventDecoder`.
+
+    Takes the same arguments as `fetch_events`, but every page is decoded as
+    soon as it arrives, so the raw events are never held all at once.
+
+    :param service_factory: A callable returning a new Calendar API service object.
+    :param calendar_ids: The ids of the calendars to fetch events from.
+    :type calendar_ids: List[str]
+    :return: The decoded events, latest first.
+    :rtype: pd.DataFrame
+    """
+    decoder = EventDecoder()
+    if store is not None:
+        _sync_calendars(service_factory, calendar_ids, store, max_workers, retries)
+        return store.decode(calendar_ids, time_min, time_max, decoder).to_frame()
+
+    lock = threading.Lock()
+
+    def fetch(service, calendar_id):
+        for page in iter_calendar_events(service, calendar_id, time_min, time_max, fields, retries=retries):
+            with lock:
+                decoder.add(page, calendar_id)
+
+    map_calendars(service_factory, calendar_ids, fetch, max_workers)
+    return decoder.to_frame()
+
+def fetch_calendar_events(
+    credentials: "Credentials",
+    calendar_names: List[str],
+    store: EventStore = None,
+    time_min: datetime = None,
+    time_max: datetime = None,
+    fields: str = EVENT_FIELDS,
+    max_workers: int = MAX_WORKERS,
+    retries: int = RETRIES
+):
     """Fetch calendar events from Google Calendar API and return them as a list.
 
+    Only the events within `time_min` and `time_max` are returned. Up to
+    `max_workers` calendars are fetched at once and the events are merged in
+    the order of the calendars. With a `store`, each calendar is synced
+    incrementally into it and the events are read back from it, latest first.
+
     :param credentials: An initialized credentials object.
     :type credentials: Credentials
     :param calendar_names: A list of calendar names to fetch events from.
     :type calendars: List[str]
+    :param store: An optional local event store.
+    :type store: EventStore
+    :param time_min: Only events ending after this time.
+    :type time_min: datetime
+    :param time_max: Only events starting before this time.
+    :type time_max: datetime
+    :param fields: The event fields to request, see `iter_calendar_events`.
+    :type fields: str
+    :param max_workers: The maximum number of calendars fetched at once.
+    :type max_workers: int
+    :param retries: How many times a failed request is retried.
+    :type retries: int
     :return: A list of calendar events.
     :rtype: List[dict]
     """
+    client = calendar_client(credentials)
 
-    # Build the Google Calendar API client
-    service = build('calendar', 'v3', credentials=credentials)
+    return fetch_events(
+        client.service_factory,
+        client.calendar_ids(calendar_names),
+        store=store,
+        time_min=time_min,
+        time_max=time_max,
+        fields=fields,
+        max_workers=max_workers,
+        retries=retries
+    )
 
-    events = []
+def fetch_calendars(credentials: "Credentials"):
+    """Fetch calendars from Google Calendar API and return them as a list.
+
+    :param credentials: An initialized credentials object.
+    :type credentials: Credentials
+    """
+    return calendar_client(credentials).calendars()
 
-    # Fetch all calendars and filter by the calendar names
-    all_calendars = fetch_calendars(credentials)
-    calendar_ids = []
-    for calendar in all_calendars:
-        if calendar["summary"] in calendar_names:
-            calendar_ids.append(calendar["id"])
+@functools.lru_cache(maxsize=None)
+def _discovery_document(service_name: str, version: str):
+    """Parsed discovery document shipped with googleapiclient, None when it is not bundled."""
+    from googleapiclient import discovery_cache
 
-    # Loop through each calendar ID and fetch events
-    for calendar_id in calendar_ids:
-        events_result = service.events().list(calendarId=calendar_id, maxResults=2500, orderBy='startTime', singleEvents=True).execute()
-        events.extend(events_result.get('items', []))
+    document = discovery_cache.get_static_doc(service_name, version)
+    return json.loads(document) if document is not None else None
 
-    return events[::-1]
+class CalendarClient:
+    """Calendar API session for one set of credentials.
 
-def fetch_calendars(credentials: Credentials):
-    """Fetch calendars from Google Calendar API and return them as a list.
+    Service objects are built once per thread from the locally cached
+    discovery document, each with its own authorized HTTP connection that is
+    reused across requests. The calendar list, and with it the name to id
+    mapping, is fetched once.
+
+    :param credentials: An initialized credentials object.
+    :type credentials: Credentials
+    """
+
+    def __init__(self, credentials: "Credentials"):
+        self.credentials = credentials
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._calendars = None
+
+    def service_factory(self):
+        """Return the service object of the calling thread, building it on first use."""
+        service = getattr(self._local, "service", None)
+        if service is None:
+            from google_auth_httplib2 import AuthorizedHttp
+            from googleapiclient.discovery import build, build_from_document
+            import httplib2
+
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http())
+            document = _discovery_document("calendar", "v3")
+            if document is None:
+                service = build("calendar", "v3", http=http)
+            else:
+                service = build_from_document(document, http=http)
+            self._local.service = service
+        return service
+
+    @property
+    def service(self):
+        return self.service_factory()
+
+    @property
+    def account(self) -> str:
+        """Key of the account of the client, see `account_key`."""
+        return account_key(self.credentials)
+
+    @timed
+    def calendars(self, refresh: bool = False) -> List[dict]:
+        """Return the calendars of the user, fetched once unless `refresh` is set."""
+        with self._lock:
+            if self._calendars is None or refresh:
+                calendars = []
+                page_token = None
+                while True:
+                    result = _execute(self.service.calendarList().list(pageToken=page_token))
+                    calendars.extend(result.get("items", []))
+                    page_token = result.get("nextPageToken")
+                    if page_token is None:
+                        break
+                self._calendars = calendars
+            return self._calendars
+
+    def calendar_ids(self, calendar_names: List[str]) -> List[str]:
+        """Resolve calendar names to ids, in the order of the calendar list."""
+        return [calendar["id"] for calendar in self.calendars() if calendar["summary"] in calendar_names]
+
+    def fetch_events(self, calendar_names: List[str], **kwargs) -> List[dict]:
+        """Fetch the events of the named calendars, see `fetch_calendar_events`."""
+        return fetch_events(self.service_factory, self.calendar_ids(calendar_names), **kwargs)
+
+    def fetch_event_frame(self, calendar_names: List[str], **kwargs) -> "pd.DataFrame":
+        """Fetch the events of the named calendars into a columnar frame, see `fetch_event_frame`."""
+        return fetch_event_frame(self.service_factory, self.calendar_ids(calendar_names), **kwargs)
+
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+def calendar_client(credentials: "Credentials") -> CalendarClient:
+    """Return the client of a credentials object, creating it on first use.
 
     :param credentials: An initialized credentials object.
     :type credentials: Credentials
+    :rtype: CalendarClient
     """
-    # Build the Google Calendar API client
-    service = build('calendar', 'v3', credentials=credentials)
+    with _clients_lock:
+        client = _clients.get(credentials)
+        if client is None:
+            client = _clients[credentials] = CalendarClient(credentials)
+        return client
+
+def account_key(credentials: "Credentials") -> str:
+    """Key identifying the account of a credentials object, a hash that reveals none of its secrets."""
+    identity = getattr(credentials, "refresh_token", None) or getattr(credentials, "token", None)
+    if identity is None:
+        identity = f"object:{id(credentials)}"
+    payload = f"{getattr(credentials, 'client_id', None)}:{identity}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def _nbytes(value) -> int:
+    """Approximate memory size of a cached value."""
+    if hasattr(value, "memory_usage"):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return len(json.dumps(value, default=str))
+
+class _CacheEntry:
+    __slots__ = ("account", "calendar_ids", "value", "nbytes", "expires_at")
+
+    def __init__(self, account, calendar_ids, value, nbytes, expires_at):
+        self.account = account
+        self.calendar_ids = calendar_ids
+        self.value = value
+        self.nbytes = nbytes
+        self.expires_at = expires_at
+
+class CalendarCache:
+    """Bounded in-memory cache of calendar lists and event frames, per account.
+
+    Entries are scoped to the account of the client they were fetched with,
+    expire `ttl` seconds after being fetched and are evicted least recently
+    used first to keep their total size under `max_bytes`. An event frame of
+    some calendars is served from a cached frame of more calendars, fetched
+    with the same arguments, instead of being fetched again.
+
+    :param ttl: Seconds after which an entry is fetched again.
+    :type ttl: float
+    :param max_bytes: The maximum total size of the entries, in bytes.
+    :type max_bytes: int
+    :param clock: The monotonic clock the expiry is measured with.
+    """
+
+    def __init__(self, ttl: float = CACHE_TTL, max_bytes: int = CACHE_MAX_BYTES, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.hits = 0
+        self.subset_hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def calendars(self, client: CalendarClient) -> List[dict]:
+        """The calendars of the account of `client`, see `CalendarClient.calendars`."""
+        key = (client.account, "calendars")
+        with self._lock:
+            entry = self._get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry.value
+            self.misses += 1
+        calendars = client.calendars(refresh=True)
+        self._put(key, _CacheEntry(client.account, None, calendars, _nbytes(calendars), self.clock() + self.ttl))
+        return calendars
+
+    def event_frame(self, client: CalendarClient, calendar_names: List[str], **kwargs) -> "pd.DataFrame":
+        """The events of the named calendars, see `CalendarClient.fetch_event_frame`.
+
+        The returned frame is shared with the cache and must not be modified.
+        Its `attrs["fetched_at"]` is the Unix time the events were fetched at,
+        which changes whenever they are fetched again.
+        """
+        calendar_ids = frozenset(client.calendar_ids(calendar_names))
+        arguments = json.dumps(kwargs, default=repr, sort_keys=True)
+        key = (client.account, "events", arguments, calendar_ids)
+        with self._lock:
+            entry = self._get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry.value
+            superset = None
+            candidates = [
+                other_key for other_key in reversed(self._entries)
+                if other_key[:3] == key[:3] and calendar_ids <= other_key[3]
+            ]
+            for other_key in candidates:
+                superset = self._get(other_key)
+                if superset is not None:
+                    break
+            if superset is not None:
+                self.subset_hits += 1
+            else:
+                self.misses += 1
+
+        if superset is not None:
+            frame = superset.value
+            frame = frame[frame["calendar_id"].isin(calendar_ids).to_numpy()].reset_index(drop=True)
+            for column in ("calendar_id", "summary"):
+                frame[column] = frame[column].cat.remove_unused_categories()
+            # a frame derived from a cached one expires with it
+            expires_at = superset.expires_at
+            frame.attrs["fetched_at"] = superset.value.attrs["fetched_at"]
+        else:
+            frame = client.fetch_event_frame(calendar_names, **kwargs)
+            expires_at = self.clock() + self.ttl
+            frame.attrs["fetched_at"] = time.time()
+        self._put(key, _CacheEntry(client.account, calendar_ids, frame, _nbytes(frame), expires_at))
+        return frame
+
+    def _get(self, key):
+        """The live entry of `key`, if any, dropping it if expired; the lock must be held."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.clock() >= entry.expires_at:
+            self._drop(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _drop(self, key):
+        self.nbytes -= self._entries.pop(key).nbytes
+
+    def _put(self, key, entry: _CacheEntry):
+        if entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self.nbytes += entry.nbytes
+            while self.nbytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self, account: str = None):
+        """Drop the entries of an account, or every entry and the counters."""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if account in (None, entry.account)]:
+                self._drop(key)
+            if account is None:
+                self.hits = self.subset_hits = self.misses = self.expirations = self.evictions = 0
 
-    # Call the API to fetch the calendar events
-    calendars_result = service.calendarList().list().execute()
-    calendars = calendars_result.get('items', [])
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "subset_hits": self.subset_hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "accounts": len({entry.account for entry in self._entries.values()}),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+            }
 
-    return calendars
+# shared by the sessions of a Streamlit server
+calendar_cache = CalendarCache()
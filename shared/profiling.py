@@ -0,0 +1,238 @@
+"""Lightweight timing of named stages, e.g. of every rerun of a Streamlit app.
+
+Stages are recorded on the profile active in the current thread, and cost a
+single lookup when there is none:
+
+    profile = Profile("buy-vs-rent")
+    profile.activate()
+    with stage("forecasts"):
+        ...
+    profile.records  # wall time, and allocations if tracked, per stage
+
+Functions are timed as a stage with the `timed` decorator. In the apps, the
+script body runs in `streamlit_profile`, which profiles the rerun and shows it
+with `streamlit_panel` in an opt-in sidebar panel with a JSON export. When
+`PROFILE_DIR` is set, every rerun is also appended as a JSON line to
+`{PROFILE_DIR}/{app}.jsonl`.
+
+tracemalloc is process-wide, so allocations are traced by at most one profile
+at a time, e.g. of one of the sessions of a Streamlit server, and tracing is
+stopped when that profile finishes, even if its run raised.
+"""
+
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+_active = contextvars.ContextVar("profile", default=None)
+
+# the profile that started tracemalloc, if any
+_tracer = None
+_tracer_lock = threading.Lock()
+
+PANEL_KEY = "profiling_panel"
+ALLOCATIONS_KEY = "profiling_allocations"
+
+class Profile:
+    """Wall time and, optionally, allocations of the stages of one run.
+
+    :param name: The name of the profiled run, e.g. the app.
+    :type name: str
+    :param track_allocations: Whether to trace the memory allocated by every
+        stage with tracemalloc, which slows the run down. Reset to False on
+        activation when tracemalloc is already tracing, e.g. for another
+        profile, whose peaks would otherwise be reset by this one.
+    :type track_allocations: bool
+    """
+
+    def __init__(self, name: str, track_allocations: bool = False):
+        self.name = name
+        self.track_allocations = track_allocations
+        self.records = []
+        self.started_at = time.time()
+        self.seconds = None
+        self._started = time.perf_counter()
+        self._stack = []
+        self._tracing = False
+
+    def activate(self):
+        """Make this the profile of the current thread, until another one is activated."""
+        global _tracer
+        if self.track_allocations and not self._tracing:
+            with _tracer_lock:
+                if _tracer is None and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    _tracer = self
+                    self._tracing = True
+                else:
+                    self.track_allocations = False
+        _active.set(self)
+        return self
+
+    def finish(self):
+        """Stop the profile, if still active, and record its total time."""
+        global _tracer
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self._started
+        if _active.get() is self:
+            _active.set(None)
+        if self._tracing:
+            with _tracer_lock:
+                tracemalloc.stop()
+                _tracer = None
+            self._tracing = False
+        return self
+
+    def __enter__(self):
+        return self.activate()
+
+    def __exit__(self, *exc_info):
+        self.finish()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Record the block as a stage, nested stages are named `outer/inner`."""
+        path = "/".join([frame["stage"] for frame in self._stack] + [name])
+        frame = {"stage": path}
+        tracing = self._tracing
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+            frame.update(start=current, peak=current)
+        self._stack.append(frame)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self._stack.pop()
+            record = {"stage": path, "seconds": seconds}
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(frame["peak"], peak)
+                record.update(allocated_bytes=current - frame["start"], peak_bytes=peak - frame["start"])
+                if self._stack:
+                    self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+            self.records.append(record)
+
+    def summary(self) -> "pd.DataFrame":
+        """Calls, total and maximum time, and allocations per stage, slowest first."""
+        import pandas as pd
+
+        records = pd.DataFrame(self.records, columns=["stage", "seconds", "allocated_bytes", "peak_bytes"])
+        summary = records.groupby("stage", sort=False).agg(
+            calls=("seconds", "size"),
+            seconds=("seconds", "sum"),
+            max_seconds=("seconds", "max"),
+            allocated_bytes=("allocated_bytes", "sum"),
+            peak_bytes=("peak_bytes", "max"),
+        )
+        if not self.track_allocations:
+            summary = summary.drop(columns=["allocated_bytes", "peak_bytes"])
+        return summary.sort_values("seconds", ascending=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "stages": self.records,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+def active_profile():
+    """Return the profile of the current thread, if any."""
+    return _active.get()
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Record the block as a stage of the active profile, a no-op without one."""
+    profile = _active.get()
+    if profile is None:
+        yield
+        return
+    with profile.stage(name):
+        yield
+
+def timed(name=None):
+    """Decorator recording every call of a function as a stage, see `stage`.
+
+    The stage is named after the module and the function by default, e.g.
+    `financial.buy_vs_rent_analysis`. Can be used with or without arguments.
+    """
+    def decorator(function):
+        stage_name = name or f"{function.__module__.rsplit('.', 1)[-1]}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profile = _active.get()
+            if profile is None:
+                return function(*args, **kwargs)
+            with profile.stage(stage_name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    if callable(name):
+        function, name = name, None
+        return decorator(function)
+    return decorator
+
+@contextlib.contextmanager
+def streamlit_profile(app: str):
+    """Profile the Streamlit rerun run in the block, tracing allocations if asked in the panel.
+
+    The profile is shown with `streamlit_panel` when the block completes, and
+    finished in any case, e.g. when the rerun raises or calls `st.stop`.
+    """
+    import streamlit as st
+
+    with Profile(app, track_allocations=st.session_state.get(ALLOCATIONS_KEY, False)) as profile:
+        yield profile
+        streamlit_panel(profile)
+
+def streamlit_panel(profile: Profile):
+    """Finish the profile of a rerun and show it in an opt-in sidebar panel.
+
+    The rerun is also appended to `{PROFILE_DIR}/{app}.jsonl` when the
+    `PROFILE_DIR` environment variable is set.
+    """
+    import streamlit as st
+
+    profile.finish()
+    directory = os.environ.get("PROFILE_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{profile.name}.jsonl"), "a") as file:
+            file.write(profile.to_json() + "\n")
+
+    with st.sidebar:
+        st.header("Performance")
+        if st.toggle("Show stage timings", key=PANEL_KEY):
+            st.toggle(
+                "Track allocations",
+                key=ALLOCATIONS_KEY,
+                help="Trace the memory allocated by every stage from the next rerun on, which slows it down."
+            )
+            if st.session_state.get(ALLOCATIONS_KEY) and not profile.track_allocations:
+                st.caption("Allocations were not traced, as another session is tracing them.")
+            st.metric("Rerun time", f"{profile.seconds * 1e3:,.0f} ms")
+            st.dataframe(profile.summary())
+            st.download_button(
+                "Download timings (JSON)",
+                data=profile.to_json(),
+                file_name=f"{profile.name}-timings.json",
+                mime="application/json"
+            )
@@ -0,0 +1,140 @@
+"""Parallel parameter sweeps over the `*_batch` functions of shared.financial.
+
+The scenarios of a parameter grid are split in chunks across worker
+processes. Both the grid and the results live in shared memory: workers read
+their chunk of parameters from it and write their results into it, so only
+chunk bounds are sent between processes.
+
+    grid = parameter_grid(
+        down_payment_rate=np.linspace(0.1, 0.5, 9),
+        mortgage_interest_rate=np.linspace(0.01, 0.06, 11),
+        time_period=np.arange(5, 41),
+    )
+    results = parallel_sweep(
+        financial.buy_vs_rent_batch, grid, outputs=("renter_net_worth", "buyer_net_worth"),
+        budget=350000, ...
+    )
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+
+import numpy as np
+
+CHUNK_SIZE = 5000
+
+# parameters holding the horizon, in years, of the batch functions
+HORIZON_PARAMETERS = ("time_period", "total_time_period_in_years")
+
+def parameter_grid(**axes) -> dict:
+    """Every combination of the given parameter values, as one flat array per parameter."""
+    mesh = np.meshgrid(*(np.asarray(values) for values in axes.values()), indexing="ij")
+    return {name: values.ravel() for name, values in zip(axes, mesh)}
+
+# per worker process state, set by _attach
+_worker = {}
+
+def _attach(function, fixed, names, inputs_name, inputs_shape, outputs, outputs_name, outputs_shape, dtype):
+    inputs = shared_memory.SharedMemory(name=inputs_name)
+    results = shared_memory.SharedMemory(name=outputs_name)
+    _worker.update(
+        function=function,
+        fixed=fixed,
+        names=names,
+        outputs=outputs,
+        memory=(inputs, results),
+        inputs=np.ndarray(inputs_shape, dtype=np.float64, buffer=inputs.buf),
+        results=np.ndarray(outputs_shape, dtype=dtype, buffer=results.buf),
+    )
+
+def _run_chunk(start: int, stop: int, state: dict = None) -> int:
+    state = _worker if state is None else state
+    inputs = state["inputs"]
+    params = {name: inputs[i, start:stop] for i, name in enumerate(state["names"])}
+    forecasts = state["function"](**params, **state["fixed"])
+    results = state["results"]
+    for i, output in enumerate(state["outputs"]):
+        values = forecasts[output]
+        results[i, start:stop, :values.shape[1]] = values
+        results[i, start:stop, values.shape[1]:] = np.nan
+    return stop - start
+
+def parallel_sweep(
+    function,
+    grid: dict,
+    outputs,
+    processes: int | None = None,
+    chunk_size: int = CHUNK_SIZE,
+    years: int | None = None,
+    dtype=np.float64,
+    **fixed
+) -> dict:
+    """Run a `*_batch` function of shared.financial over every scenario of a grid in parallel.
+
+    :param function: A module level `*_batch` function, e.g. `buy_vs_rent_batch`.
+    :param grid: One array of values per varying parameter, all of the same
+        length, e.g. from `parameter_grid`.
+    :param outputs: The output columns of `function` to keep.
+    :param processes: The number of worker processes, all the CPUs by default.
+        With a single process the sweep runs in the calling process.
+    :param chunk_size: The number of scenarios computed at once by a worker.
+    :param years: The horizon of the results, inferred from the time period
+        parameter of the grid or of `fixed` when not given.
+    :param dtype: The dtype of the results, float32 halves their memory.
+    :param fixed: The parameters shared by every scenario.
+    :return: A dict mapping each output to a (scenarios, years) array, with
+        NaN on the years beyond a scenario's own horizon.
+    :rtype: dict
+    """
+    outputs = tuple(outputs)
+    names = tuple(grid)
+    scenarios = len(next(iter(grid.values())))
+    if years is None:
+        horizons = [np.max(grid.get(name, fixed.get(name, 0))) for name in HORIZON_PARAMETERS]
+        years = int(max(horizons))
+        if years <= 0:
+            raise ValueError("The horizon could not be inferred from the parameters, pass `years`")
+    processes = os.cpu_count() if processes is None else processes
+    bounds = [(start, min(start + chunk_size, scenarios)) for start in range(0, scenarios, chunk_size)]
+    outputs_shape = (len(outputs), scenarios, years)
+
+    if processes <= 1 or len(bounds) <= 1:
+        results = np.empty(outputs_shape, dtype=dtype)
+        state = dict(
+            function=function, fixed=fixed, names=names, outputs=outputs,
+            inputs=np.stack([np.asarray(grid[name], dtype=np.float64) for name in names]),
+            results=results,
+        )
+        for start, stop in bounds:
+            _run_chunk(start, stop, state)
+        return {output: results[i] for i, output in enumerate(outputs)}
+
+    inputs_shape = (len(names), scenarios)
+    inputs_memory = shared_memory.SharedMemory(create=True, size=max(int(np.prod(inputs_shape)) * 8, 1))
+    outputs_memory = shared_memory.SharedMemory(
+        create=True, size=max(int(np.prod(outputs_shape)) * np.dtype(dtype).itemsize, 1)
+    )
+    try:
+        inputs = np.ndarray(inputs_shape, dtype=np.float64, buffer=inputs_memory.buf)
+        for i, name in enumerate(names):
+            inputs[i] = grid[name]
+        with ProcessPoolExecutor(
+            max_workers=min(processes, len(bounds)),
+            initializer=_attach,
+            initargs=(
+                function, fixed, names, inputs_memory.name, inputs_shape,
+                outputs, outputs_memory.name, outputs_shape, dtype
+            )
+        ) as executor:
+            for _ in executor.map(_run_chunk, *zip(*bounds)):
+                pass
+        results = np.ndarray(outputs_shape, dtype=dtype, buffer=outputs_memory.buf).copy()
+        del inputs
+    finally:
+        inputs_memory.close()
+        inputs_memory.unlink()
+        outputs_memory.close()
+        outputs_memory.unlink()
+
+    return {output: results[i] for i, output in enumerate(outputs)}
@@ -0,0 +1,110 @@
+"""In-memory fake of the parts of the Google Calendar API used by googlelib.
+"""
+
+from datetime import datetime, timezone
+from googleapiclient.errors import HttpError
+import httplib2
+import threading
+import time
+
+def _utc(time: dict) -> str:
+    if "date" in time:
+        return f"{time['date']}T00:00:00Z"
+    return datetime.fromisoformat(time["dateTime"]).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+class FakeRequest:
+
+    def __init__(self, service, function, **kwargs):
+        self.service = service
+        self.function = function
+        self.kwargs = kwargs
+
+    def execute(self, **_):
+        time.sleep(self.service.latency)
+        with self.service.lock:
+            status = self.service.failures.pop(0) if self.service.failures else None
+        if status is not None:
+            raise HttpError(httplib2.Response({"status": status}), b"Injected failure")
+        return self.function(**self.kwargs)
+
+class FakeCalendarService:
+    """Fake Calendar API service holding the events of a few calendars.
+
+    Every change made through `put` or `delete` gets a new version number,
+    and sync tokens point to the version they were issued at. Calling
+    `invalidate_sync_tokens` makes every issued token fail with HTTP 410, as
+    the real API does when a token expires. Every request waits `latency`
+    seconds, and the next requests fail with the HTTP statuses in `failures`.
+    """
+
+    def __init__(self, calendars: dict, names: dict = None, latency: float = 0.0):
+        self.latency = latency
+        self.failures = []
+        self.lock = threading.Lock()
+        self.names = names or {calendar_id: calendar_id for calendar_id in calendars}
+        self.calendars = {calendar_id: {} for calendar_id in calendars}
+        self.changed_at = {calendar_id: {} for calendar_id in calendars}
+        self.version = 0
+        self.epoch = 0
+        self.requests = []
+        for calendar_id, events in calendars.items():
+            for event in events:
+                self.put(calendar_id, event)
+
+    def put(self, calendar_id: str, event: dict):
+        self.version += 1
+        self.calendars[calendar_id][event["id"]] = event
+        self.changed_at[calendar_id][event["id"]] = self.version
+
+    def delete(self, calendar_id: str, event_id: str):
+        self.put(calendar_id, {"id": event_id, "status": "cancelled"})
+
+    def invalidate_sync_tokens(self):
+        self.epoch += 1
+
+    def calendarList(self):
+        return self
+
+    def events(self):
+        return self
+
+    def list(self, **kwargs):
+        if "calendarId" in kwargs:
+            return FakeRequest(self, self._list_events, **kwargs)
+        return FakeRequest(self, self._list_calendars)
+
+    def _list_calendars(self):
+        self.requests.append({"resource": "calendarList"})
+        return {"items": [{"id": calendar_id, "summary": name} for calendar_id, name in self.names.items()]}
+
+    def _list_events(self, calendarId, maxResults=250, pageToken=None, syncToken=None, **kwargs):
+        self.requests.append({"calendarId": calendarId, "pageToken": pageToken, "syncToken": syncToken, **kwargs})
+        events = self.calendars[calendarId]
+        if syncToken is not None:
+            epoch, version = map(int, syncToken.split(":"))
+            if epoch != self.epoch:
+                raise HttpError(httplib2.Response({"status": 410}), b"Sync token is no longer valid")
+            changed = [
+                event for event_id, event in events.items()
+                if self.changed_at[calendarId][event_id] > version
+            ]
+        else:
+            # like the API, cancelled instances of recurring events are listed unless expanded
+            changed = [
+                event for event in events.values()
+                if event.get("status") != "cancelled" or (event.get("recurringEventId") and not kwargs.get("singleEvents"))
+            ]
+            if "timeMin" in kwargs:
+                changed = [event for event in changed if _utc(event["end"]) > kwargs["timeMin"]]
+            if "timeMax" in kwargs:
+                changed = [event for event in changed if _utc(event["start"]) < kwargs["timeMax"]]
+            if kwargs.get("orderBy") == "startTime":
+                changed.sort(key=lambda event: _utc(event["start"]))
+
+        offset = int(pageToken or 0)
+        result = {"items": changed[offset:offset + maxResults]}
+        if offset + maxResults < len(changed):
+            result["nextPageToken"] = str(offset + maxResults)
+        else:
+            result["nextSyncToken"] = f"{self.epoch}:{self.version}"
+        return result
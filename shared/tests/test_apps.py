@@ -0,0 +1,129 @@
+"""Smoke tests of the Streamlit apps, run with streamlit's AppTest.
+"""
+
+import io
+import os
+import tempfile
+import tracemalloc
+import unittest
+from unittest import mock
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+from shared import googlelib
+from shared.profiling import ALLOCATIONS_KEY, PANEL_KEY
+from shared.tests.fake_calendar import FakeCalendarService
+
+APPS_DIRECTORY = os.path.join(os.path.dirname(__file__), "..", "..", "apps")
+
+def app_test(app: str) -> AppTest:
+    return AppTest.from_file(os.path.join(APPS_DIRECTORY, app, "streamlit.py"), default_timeout=120)
+
+class TestBuyVsRentApp(unittest.TestCase):
+
+    def test_short_horizon(self):
+        app = app_test("buy-vs-rent").run()
+        self.assertFalse(app.exception)
+        app.sidebar.number_input[0].set_value(3).run()
+        self.assertFalse(app.exception)
+        lump_sum_year = next(widget for widget in app.number_input if widget.label == "Lump sum in year")
+        self.assertEqual(lump_sum_year.value, 3)
+
+class TestCalendarAnalyticsApp(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)
+        now = pd.Timestamp.now(tz="UTC").floor("h")
+        events = []
+        for i in range(40):
+            start = now - pd.Timedelta(days=i + 1)
+            events.append({
+                "id": str(i), "summary": "Focus" if i % 2 else "Review",
+                "start": {"dateTime": start.isoformat()},
+                "end": {"dateTime": (start + pd.Timedelta(hours=2)).isoformat()},
+            })
+        self.fake = FakeCalendarService({"work": events}, names={"work": "Work"})
+        self.patches = [
+            mock.patch.object(googlelib, "authenticate", lambda path: None),
+            mock.patch.object(googlelib.CalendarClient, "service_factory", lambda client: self.fake),
+        ]
+        for patch in self.patches:
+            patch.start()
+        googlelib.calendar_cache.clear()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        googlelib.calendar_cache.clear()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def hours(self, app: AppTest) -> dict:
+        return app.dataframe[0].value.groupby("summary", observed=True)["hours"].sum().to_dict()
+
+    def test_edited_and_deleted_past_events_reach_the_charts(self):
+        app = app_test("calendar-analytics").run()
+        self.assertFalse(app.exception)
+        self.assertEqual(self.hours(app), {"Focus": 30.0, "Review": 30.0})
+
+        event = dict(self.fake.calendars["work"]["1"], summary="Planning")
+        self.fake.put("work", event)
+        self.fake.delete("work", "2")
+        # until the cached events expire, the charts are unchanged
+        app.run()
+        self.assertEqual(self.hours(app), {"Focus": 30.0, "Review": 30.0})
+
+        googlelib.calendar_cache.clear()
+        app.run()
+        self.assertFalse(app.exception)
+        self.assertEqual(self.hours(app), {"Focus": 28.0, "Planning": 2.0, "Review": 28.0})
+
+class TestBuyVsRentBacktest(unittest.TestCase):
+
+    def run_with_history(self, csv: str) -> AppTest:
+        with mock.patch("streamlit.file_uploader", lambda *args, **kwargs: io.StringIO(csv)):
+            return app_test("buy-vs-rent").run()
+
+    def test_short_history_caps_the_horizon(self):
+        csv = "year,market_return,inflation_rate,house_appreciation_rate,mortgage_interest_rate\n" + "\n".join(
+            f"{year},0.05,0.02,0.03,0.04" for year in range(2000, 2010)
+        )
+        app = self.run_with_history(csv)
+        self.assertFalse(app.exception)
+        self.assertIn("10 years only", app.warning[0].value)
+        self.assertEqual(app.metric[-1].label, "Start years in which buying wins after 10 years")
+
+    def test_malformed_history_is_reported(self):
+        app = self.run_with_history("year,market_return\n2000,0.05\n2002,0.03\n")
+        self.assertFalse(app.exception)
+        self.assertIn("consecutive", app.error[0].value)
+
+def stopped_app():
+    import streamlit as st
+    from shared.profiling import streamlit_profile
+
+    with streamlit_profile("stopped"):
+        st.title("Stopped")
+        st.stop()
+
+class TestProfilingPanel(unittest.TestCase):
+
+    def test_allocations_are_traced_for_the_rerun_only(self):
+        app = app_test("buy-vs-rent")
+        app.session_state[PANEL_KEY] = True
+        app.session_state[ALLOCATIONS_KEY] = True
+        app.run()
+        self.assertFalse(app.exception)
+        self.assertIn("peak_bytes", app.sidebar.dataframe[0].value.columns)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_stopped_rerun_stops_tracing(self):
+        app = AppTest.from_function(stopped_app)
+        app.session_state[ALLOCATIONS_KEY] = True
+        app.run()
+        self.assertFalse(app.exception)
+        self.assertEqual(app.title[0].value, "Stopped")
+        self.assertFalse(tracemalloc.is_tracing())
@@ -0,0 +1,62 @@
+"""Unit tests for the batch.py module.
+"""
+
+from shared.batch import SCENARIO_COLUMNS, main, run_batch
+from shared.financial import buy_vs_rent_analysis
+from shared.tests.test_financial import BUY_VS_RENT_PARAMS
+import contextlib
+import io
+import numpy as np
+import os
+import pandas as pd
+import tempfile
+import unittest
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scenarios = pd.DataFrame([
+            dict(BUY_VS_RENT_PARAMS, time_period=time_period, budget=budget)
+            for time_period, budget in ((30, 350000), (10, 200000), (25, 500000), (1, 100000), (5, 300000))
+        ])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory.name, name)
+
+    def test_matches_single_scenario_analysis(self):
+        self.scenarios.to_csv(self.path("scenarios.csv"), index=False)
+        stats = run_batch(self.path("scenarios.csv"), self.path("results.parquet"), chunk_size=2, year_start=2024)
+        results = pd.read_parquet(self.path("results.parquet"))
+
+        self.assertEqual(stats["scenarios"], 5)
+        self.assertEqual(stats["rows"], 71)
+        self.assertEqual(len(results), 71)
+        for scenario, params in self.scenarios.iterrows():
+            analysis = buy_vs_rent_analysis(**params.to_dict(), year_start=2024)
+            rows = results[results["scenario"] == scenario]
+            self.assertEqual(list(rows["year"]), list(range(2024, 2024 + int(params["time_period"]))))
+            for column in analysis.columns:
+                np.testing.assert_allclose(rows[column].to_numpy(), analysis[column], rtol=1e-12)
+
+    def test_parquet_input_and_cli(self):
+        self.scenarios.to_parquet(self.path("scenarios.parquet"))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+            main([
+                self.path("scenarios.parquet"), self.path("results.parquet"),
+                "--column", "renter_net_worth", "--column", "buyer_net_worth"
+            ])
+        results = pd.read_parquet(self.path("results.parquet"))
+        self.assertEqual(list(results.columns), ["scenario", "year", "renter_net_worth", "buyer_net_worth"])
+        self.assertIn("scenarios/s", output.getvalue())
+        self.assertNotIn("rows/s", output.getvalue())
+
+    def test_missing_columns(self):
+        self.scenarios.drop(columns="budget").to_csv(self.path("scenarios.csv"), index=False)
+        with self.assertRaisesRegex(ValueError, "budget"):
+            run_batch(self.path("scenarios.csv"), self.path("results.parquet"))
+        self.assertEqual(len(SCENARIO_COLUMNS), 12)
@@ -0,0 +1,42 @@
+"""Tests for the shared.financial benchmark suite.
+
+The timing comparison against the stored baseline only runs when the
+BENCHMARK environment variable is set, since timings depend on the machine:
+
+    BENCHMARK=1 python -m pytest shared/tests/test_benchmarks.py
+"""
+
+from shared.benchmarks import BENCHMARKS, compare, load_results, run_benchmarks
+import os
+import unittest
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_compare(self):
+        baseline = [
+            {"name": "rent_forecasts", "horizon": 30, "batch": 1, "seconds": 1.0},
+            {"name": "buy_forecasts", "horizon": 30, "batch": 1, "seconds": 1.0},
+        ]
+        results = [
+            {"name": "rent_forecasts", "horizon": 30, "batch": 1, "seconds": 1.2},
+            {"name": "buy_forecasts", "horizon": 30, "batch": 1, "seconds": 2.0},
+            {"name": "buy_forecasts", "horizon": 50, "batch": 1, "seconds": 9.0},
+        ]
+        regressions = compare(results, baseline, threshold=0.5)
+        self.assertEqual(len(regressions), 1)
+        self.assertEqual(regressions[0]["name"], "buy_forecasts")
+        self.assertAlmostEqual(regressions[0]["slowdown"], 2.0)
+
+    def test_every_benchmark_runs(self):
+        results = run_benchmarks(horizons=(2,), batch_sizes=(1, 3), repeat=1, number=1)
+        self.assertEqual(len(results), len(BENCHMARKS) * 2)
+        self.assertTrue(all(record["seconds"] > 0 for record in results))
+
+    @unittest.skipUnless(os.environ.get("BENCHMARK"), "set BENCHMARK=1 to check timings")
+    def test_no_regressions(self):
+        baseline = load_results(BASELINE_PATH)
+        results = run_benchmarks()
+        regressions = compare(results, baseline)
+        self.assertEqual(regressions, [])
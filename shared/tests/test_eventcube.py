@@ -0,0 +1,95 @@
+"""Unit tests for the eventcube.py module.
+"""
+
+from shared.eventcube import EventCube, downsample_weeks, top_summaries
+from shared.googlelib import EventDecoder
+import numpy as np
+import pandas as pd
+import unittest
+
+def decode(*events) -> pd.DataFrame:
+    decoder = EventDecoder()
+    decoder.add([
+        {"summary": summary, "start": {"dateTime": start}, "end": {"dateTime": end}}
+        for summary, start, end in events
+    ], "calendar")
+    return decoder.to_frame()
+
+def epoch(time: str) -> int:
+    return int(pd.Timestamp(time).timestamp())
+
+class TestEventCube(unittest.TestCase):
+
+    def setUp(self):
+        self.events = decode(
+            ("Focus", "2023-12-31T10:00:00+01:00", "2023-12-31T12:00:00+01:00"),
+            ("Focus", "2024-12-30T10:00:00+01:00", "2024-12-30T11:30:00+01:00"),
+            ("Focus", "2025-01-02T10:00:00+01:00", "2025-01-02T11:00:00+01:00"),
+            ("Gym", "2025-01-06T23:30:00+01:00", "2025-01-07T00:30:00+01:00"),
+            ("Gym", "2025-01-07T18:00:00+01:00", "2025-01-07T19:00:00+01:00"),
+        )
+
+    def test_weeks_include_the_iso_year(self):
+        weekly = EventCube(self.events, as_of=epoch("2026-01-01T00:00:00Z")).weekly()
+        self.assertEqual(
+            weekly.values.tolist(),
+            [["Focus", "2023-W52", 2.0, 1], ["Focus", "2025-W01", 2.5, 2], ["Gym", "2025-W02", 2.0, 2]]
+        )
+
+    def test_window_and_exclusions(self):
+        cube = EventCube(self.events, as_of=epoch("2026-01-01T00:00:00Z"))
+        weekly = cube.weekly(first_day="2025-01-01", last_day="2025-01-06")
+        self.assertEqual(weekly.values.tolist(), [["Focus", "2025-W01", 1.0, 1], ["Gym", "2025-W02", 1.0, 1]])
+        self.assertEqual(list(cube.weekly(exclude=["Focus"])["summary"]), ["Gym"])
+
+    def test_incremental_update_matches_full_build(self):
+        cube = EventCube(self.events, as_of=epoch("2025-01-01T00:00:00Z"))
+        self.assertEqual(cube.weekly()["events"].sum(), 2)
+        cube.update(self.events, as_of=epoch("2025-01-07T12:00:00Z"))
+        cube.update(self.events, as_of=epoch("2026-01-01T00:00:00Z"))
+        full = EventCube(self.events, as_of=epoch("2026-01-01T00:00:00Z"))
+        pd.testing.assert_frame_equal(cube.weekly(), full.weekly())
+        np.testing.assert_array_equal(cube.days, full.days)
+
+    def test_skips_all_day_events(self):
+        decoder = EventDecoder()
+        decoder.add([{"summary": "Holiday", "start": {"date": "2025-01-01"}, "end": {"date": "2025-01-02"}}])
+        self.assertTrue(EventCube(decoder.to_frame(), as_of=epoch("2026-01-01T00:00:00Z")).weekly().empty)
+
+class TestChartData(unittest.TestCase):
+
+    def setUp(self):
+        weeks = [f"2024-W{week:02d}" for week in range(1, 41)]
+        self.weekly = pd.DataFrame({
+            "summary": np.repeat([f"s{i}" for i in range(20)], len(weeks)),
+            "week": weeks * 20,
+            "hours": np.repeat(np.arange(20, dtype=float), len(weeks)),
+            "events": 1,
+        })
+
+    def test_top_summaries_bucket_the_rest(self):
+        top = top_summaries(self.weekly, n=3, other="Other")
+        self.assertEqual(sorted(top["summary"].unique()), ["Other", "s17", "s18", "s19"])
+        self.assertEqual(len(top), 4 * 40)
+        self.assertEqual(top["hours"].sum(), self.weekly["hours"].sum())
+        self.assertIs(top_summaries(self.weekly, n=20), self.weekly)
+
+    def test_top_summaries_do_not_clash_with_other(self):
+        # a summary named "Other" among the top ones, and among the rest
+        for renamed, other_hours in (("s19", 19 * 40), ("s0", 0)):
+            weekly = self.weekly.replace({"summary": {renamed: "Other"}})
+            top = top_summaries(weekly, n=3)
+            hours = top.groupby("summary")["hours"].sum()
+            self.assertEqual(len(hours), 4)
+            self.assertIn("Other (17 summaries)", hours.index)
+            self.assertEqual(hours.get("Other", 0), other_hours)
+            self.assertEqual(hours.sum(), weekly["hours"].sum())
+
+    def test_downsample_weeks_keeps_weekly_averages(self):
+        periods = downsample_weeks(self.weekly, max_weeks=15)
+        self.assertEqual(list(periods["week"].unique()[:3]), ["2024-W01", "2024-W04", "2024-W07"])
+        self.assertLessEqual(periods["week"].nunique(), 15)
+        self.assertEqual(periods["events"].sum(), self.weekly["events"].sum())
+        np.testing.assert_allclose(
+            periods.groupby("summary")["hours"].mean(), self.weekly.groupby("summary")["hours"].mean()
+        )
@@ -1,8 +1,43 @@
 """Unit tests for my utils.py module.
 """
 
-from shared.financial import mortgage_principal_contribution, mortgage_monthly_payment
+from shared import financial
+from shared.financial import (
+    amortization_schedule,
+    mortgage_principal_contribution,
+    mortgage_monthly_payment,
+    rent_forecasts,
+    rent_forecasts_batch,
+    buy_forecasts,
+    buy_forecasts_batch,
+    RENT_FORECAST_COLUMNS,
+    BUY_FORECAST_COLUMNS,
+    buy_vs_rent_batch,
+    buy_vs_rent_analysis,
+    BuyVsRentModel,
+    simulate_buy_vs_rent,
+    sensitivity_analysis,
+    break_even_year,
+    solve_break_even,
+    ForecastCache,
+    ForecastResult,
+    rental_roi_batch,
+    rental_roi_forecasts,
+    RENTAL_ROI_COLUMNS,
+    load_historical_series,
+    backtest_buy_vs_rent,
+    backtest_buy_for_rent
+)
+import datetime
+import io
+import os
+import pickle
+import tempfile
+import numpy as np
+import numpy_financial as npf
+import pandas as pd
 import unittest
+from unittest import mock
 
 class TestUtils(unittest.TestCase):
 
@@ -21,3 +56,604 @@ class TestUtils(unittest.TestCase):
             round(mortgage_principal_contribution(0.08, principal + interest, 10, 2), 2),
             principal
         )
+
+class TestForecastsBatch(unittest.TestCase):
+
+    def test_rent_batch_matches_scalar(self):
+        batch = rent_forecasts_batch(
+            time_period=[10, 20],
+            rent_initial_amount=[12000, 15000],
+            net_annual_income=30000,
+            inflation_rate=[0.02, 0.04],
+            budget=350000,
+            market_return=0.05,
+            capital_gains_tax_rate=0.2
+        )
+        scalar = rent_forecasts(20, 15000, 30000, 0.04, 350000, 0.05, 0.2)
+        for column in RENT_FORECAST_COLUMNS:
+            np.testing.assert_allclose(batch[column][1], scalar[column].values)
+        # years beyond the horizon of the first scenario are masked
+        self.assertTrue(np.isnan(batch["portfolio_value"][0, 10:]).all())
+        self.assertFalse(np.isnan(batch["portfolio_value"][0, :10]).any())
+
+    def test_buy_batch_matches_scalar(self):
+        batch = buy_forecasts_batch(
+            time_period=30,
+            net_annual_income=0,
+            house_price=[300000, 200000],
+            house_appreciation_rate=0.02,
+            house_maintenance_cost_rate=0.005,
+            buying_transaction_cost_rate=0.15,
+            loan_amount=[240000, 150000],
+            mortgage_interest_rate=[0.03, 0.0]
+        )
+        scalar = buy_forecasts(30, 0, 200000, 0.02, 0.005, 0.15, 150000, 0.0)
+        for column in BUY_FORECAST_COLUMNS:
+            np.testing.assert_allclose(batch[column][1], scalar[column].values)
+        np.testing.assert_allclose(
+            batch["mortgage_payment"],
+            batch["mortgage_principal"] + batch["mortgage_interest"]
+        )
+        # the loan is fully repaid at the end of the term
+        np.testing.assert_allclose(
+            batch["mortgage_principal_pending_amount"][:, -1], 0, atol=1e-6
+        )
+
+    def test_buy_batch_mortgage_rate_is_fixed(self):
+        params = dict(
+            time_period=[10, 5],
+            net_annual_income=0,
+            house_price=300000,
+            house_appreciation_rate=0.02,
+            house_maintenance_cost_rate=0.005,
+            buying_transaction_cost_rate=0.15,
+            loan_amount=240000
+        )
+        # a constant path, whatever it holds past the term of a scenario
+        rates = np.array([[0.03] * 10, [0.04] * 5 + [0.08] * 5])
+        batch = buy_forecasts_batch(**params, mortgage_interest_rate=rates)
+        expected = buy_forecasts_batch(**params, mortgage_interest_rate=[0.03, 0.04])
+        for column in BUY_FORECAST_COLUMNS:
+            np.testing.assert_array_equal(batch[column], expected[column])
+        rates[0, 5:] = 0.05
+        with self.assertRaisesRegex(ValueError, "fixed"):
+            buy_forecasts_batch(**params, mortgage_interest_rate=rates)
+
+    def test_batch_accepts_rate_paths(self):
+        path = np.array([[0.1, -0.1, 0.05]])
+        batch = rent_forecasts_batch(3, 0, 0, 0.0, 100, path, 0.0)
+        np.testing.assert_allclose(
+            batch["portfolio_value"][0], [110, 99, 103.95]
+        )
+
+class TestAnnualAmortization(unittest.TestCase):
+
+    def test_yearly_totals_match_monthly_schedule(self):
+        for rate in (0.0, 0.001, 0.03, 0.12):
+            for time_period in (1, 15, 40):
+                yearly = buy_forecasts(time_period, 0, 300000, 0.02, 0.005, 0.15, 250000, rate)
+                monthly = buy_forecasts(
+                    time_period, 0, 300000, 0.02, 0.005, 0.15, 250000, rate,
+                    resolution="month"
+                )
+                self.assertEqual(len(monthly), time_period * 12)
+                for column in ("mortgage_payment", "mortgage_principal", "mortgage_interest"):
+                    np.testing.assert_allclose(
+                        yearly[column].values,
+                        monthly[column].values.reshape(time_period, 12).sum(axis=1),
+                        atol=0.005
+                    )
+
+    def test_monthly_schedule_matches_numpy_financial(self):
+        monthly = buy_forecasts(30, 0, 300000, 0.02, 0.005, 0.15, 250000, 0.03, resolution="month")
+        period = np.arange(1, 361)
+        np.testing.assert_allclose(
+            monthly["mortgage_principal"].values,
+            -npf.ppmt(rate=0.0025, per=period, nper=360, pv=250000),
+            atol=0.005
+        )
+        np.testing.assert_allclose(
+            monthly["mortgage_interest"].values,
+            -npf.ipmt(rate=0.0025, per=period, nper=360, pv=250000),
+            atol=0.005
+        )
+
+    def test_unknown_resolution(self):
+        with self.assertRaises(ValueError):
+            buy_forecasts(30, 0, 300000, 0.02, 0.005, 0.15, 250000, 0.03, resolution="day")
+
+class TestAmortizationSchedule(unittest.TestCase):
+
+    def test_fixed_rate_matches_numpy_financial(self):
+        schedule = amortization_schedule([250000, 100000], [0.03, 0.0], [30, 10])
+        period = np.arange(1, 361)
+        np.testing.assert_allclose(
+            schedule["principal"][0], -npf.ppmt(rate=0.0025, per=period, nper=360, pv=250000), atol=0.005
+        )
+        np.testing.assert_allclose(schedule["payment"][1, :120], 100000 / 120)
+        self.assertTrue((schedule["payment"][1, 120:] == 0).all())
+        np.testing.assert_allclose(schedule["balance"][:, -1], 0, atol=1e-6)
+
+    def test_variable_rate_reamortizes_the_balance(self):
+        path = np.r_[np.full(60, 0.03), np.full(300, 0.05)]
+        fixed = amortization_schedule(250000, 0.03, 30)
+        variable = amortization_schedule(250000, path[None], 30, rate_resolution="month")
+        yearly = amortization_schedule(250000, np.r_[np.full(5, 0.03), np.full(25, 0.05)][None], 30)
+        np.testing.assert_allclose(variable["balance"][0, :60], fixed["balance"][0, :60])
+        np.testing.assert_allclose(
+            variable["payment"][0, 60], -npf.pmt(0.05 / 12, 300, fixed["balance"][0, 59])
+        )
+        np.testing.assert_allclose(variable["balance"][0, -1], 0, atol=1e-6)
+        np.testing.assert_allclose(yearly["balance"], variable["balance"])
+
+    def test_rate_path_resolution_is_explicit(self):
+        path = np.r_[np.full(60, 0.03), np.full(400, 0.05)]
+        # a monthly path longer than the term is cut, not read as yearly
+        longer = amortization_schedule(250000, path[None], 30, rate_resolution="month")
+        exact = amortization_schedule(250000, path[None, :360], 30, rate_resolution="month")
+        np.testing.assert_allclose(longer["balance"], exact["balance"])
+        with self.assertRaises(ValueError):
+            amortization_schedule(250000, path[None, :100], 30, rate_resolution="month")
+        with self.assertRaises(ValueError):
+            amortization_schedule(250000, np.full((1, 20), 0.03), 30)
+        with self.assertRaises(ValueError):
+            amortization_schedule(250000, path[None], 30, rate_resolution="week")
+
+    def test_prepayments(self):
+        lump_sum = np.zeros((1, 360))
+        lump_sum[0, 12] = 50000
+        base = amortization_schedule(250000, 0.03, 30)
+        term = amortization_schedule(250000, 0.03, 30, prepayment=lump_sum)
+        payment = amortization_schedule(250000, 0.03, 30, prepayment=lump_sum, prepayment_effect="payment")
+
+        for schedule in (term, payment):
+            self.assertAlmostEqual(schedule["principal"].sum() + schedule["prepayment"].sum(), 250000, places=6)
+            self.assertLess(schedule["interest"].sum(), base["interest"].sum())
+        # a shorter term with the same payment, or the same term with a lower payment
+        self.assertLess((term["payment"] > 0).sum(), 360)
+        np.testing.assert_allclose(term["payment"][0, 13], base["payment"][0, 13])
+        self.assertEqual((payment["payment"] > 0).sum(), 360)
+        self.assertLess(payment["payment"][0, 13], base["payment"][0, 13])
+
+    def test_many_loans_with_recurring_prepayments(self):
+        schedule = amortization_schedule(
+            np.full(100, 200000.0), np.linspace(0.01, 0.08, 100), 25, prepayment=np.linspace(0, 1000, 100)
+        )
+        self.assertEqual(schedule["balance"].shape, (100, 300))
+        np.testing.assert_allclose(schedule["principal"].sum(axis=1) + schedule["prepayment"].sum(axis=1), 200000)
+        months = (schedule["payment"] > 0).sum(axis=1)
+        self.assertEqual(months[0], 300)
+        self.assertTrue((months[1:] < 300).all())
+        with self.assertRaises(ValueError):
+            amortization_schedule(200000, 0.03, 25, prepayment_effect="rate")
+
+BUY_VS_RENT_PARAMS = dict(
+    time_period=30,
+    budget=350000,
+    net_annual_income=12000,
+    rent_initial_amount=14400,
+    inflation_rate=0.04,
+    market_return=0.05,
+    house_appreciation_rate=0.02,
+    house_maintenance_cost_rate=0.005,
+    down_payment_rate=0.2,
+    capital_gains_tax_rate=0.2,
+    mortgage_interest_rate=0.03,
+    transaction_cost_rate=0.15
+)
+
+class TestBuyVsRent(unittest.TestCase):
+
+    def test_batch_matches_forecasts(self):
+        p = BUY_VS_RENT_PARAMS
+        house_price = p["budget"] / (1 + p["transaction_cost_rate"])
+        loan_amount = house_price * (1 - p["down_payment_rate"])
+        rent = rent_forecasts(
+            p["time_period"], p["rent_initial_amount"], p["net_annual_income"],
+            p["inflation_rate"], p["budget"], p["market_return"], p["capital_gains_tax_rate"]
+        )
+        house = buy_forecasts(
+            p["time_period"], p["net_annual_income"], house_price, p["house_appreciation_rate"],
+            p["house_maintenance_cost_rate"], p["transaction_cost_rate"], loan_amount,
+            p["mortgage_interest_rate"]
+        )
+        markets = rent_forecasts(
+            p["time_period"], 0, p["net_annual_income"], p["inflation_rate"], loan_amount,
+            p["market_return"], p["capital_gains_tax_rate"]
+        )
+        batch = buy_vs_rent_batch(**p)
+        np.testing.assert_allclose(
+            batch["renter_net_worth"][0],
+            rent["portfolio_value_after_tax"] + rent["cumulative_savings"]
+        )
+        np.testing.assert_allclose(
+            batch["buyer_net_worth"][0],
+            house["house_value_after_tax"] + house["buying_transaction_cost"] +
+            house["mortgage_principal_pending_amount"] + house["cumulative_buyer_savings"] +
+            markets["portfolio_value_after_tax"]
+        )
+
+    def test_simulation_is_reproducible(self):
+        first = simulate_buy_vs_rent(paths=1000, seed=42, chunk_size=300, **BUY_VS_RENT_PARAMS)
+        second = simulate_buy_vs_rent(paths=1000, seed=42, chunk_size=1000, **BUY_VS_RENT_PARAMS)
+        np.testing.assert_array_equal(first["buyer_net_worth"], second["buyer_net_worth"])
+        np.testing.assert_array_equal(first["buy_wins_probability"], second["buy_wins_probability"])
+        self.assertEqual(first["renter_net_worth"].shape, (5, 30))
+        # percentiles are ordered
+        self.assertTrue((np.diff(first["renter_net_worth"], axis=0) >= 0).all())
+
+    def test_simulation_without_volatility_is_deterministic(self):
+        simulation = simulate_buy_vs_rent(
+            paths=10, seed=0, volatility=(0, 0, 0), **BUY_VS_RENT_PARAMS
+        )
+        expected = buy_vs_rent_batch(**BUY_VS_RENT_PARAMS)
+        np.testing.assert_allclose(
+            simulation["buyer_net_worth"][2], expected["buyer_net_worth"][0], rtol=1e-6
+        )
+
+class TestSensitivity(unittest.TestCase):
+
+    def test_matches_single_scenarios(self):
+        sensitivity = sensitivity_analysis(relative_step=0.1, **BUY_VS_RENT_PARAMS)
+        self.assertNotIn("time_period", sensitivity["parameters"])
+        i = sensitivity["parameters"].index("mortgage_interest_rate")
+
+        def difference(**overrides):
+            net_worth = buy_vs_rent_batch(**{**BUY_VS_RENT_PARAMS, **overrides})
+            return (net_worth["buyer_net_worth"] - net_worth["renter_net_worth"])[0]
+
+        np.testing.assert_allclose(sensitivity["baseline"], difference())
+        np.testing.assert_allclose(sensitivity["low"][i], difference(mortgage_interest_rate=0.027))
+        np.testing.assert_allclose(sensitivity["high"][i], difference(mortgage_interest_rate=0.033))
+        # a higher mortgage rate always hurts the buyer
+        self.assertTrue((sensitivity["partial_effect"][i] < 0).all())
+
+    def test_partial_effect_of_linear_input(self):
+        # the renter's net worth is linear on the initial rent, one euro of
+        # yearly rent costs the accumulated inflated rent of the years so far
+        sensitivity = sensitivity_analysis(
+            parameters=["rent_initial_amount"], **BUY_VS_RENT_PARAMS
+        )
+        cumulative_inflation = np.cumprod(np.full(30, 1.04))
+        np.testing.assert_allclose(
+            sensitivity["partial_effect"][0], np.cumsum(cumulative_inflation)
+        )
+
+    def test_zero_inputs(self):
+        params = {**BUY_VS_RENT_PARAMS, "net_annual_income": 0}
+        sensitivity = sensitivity_analysis(**params)
+        # a zero input has no relative step, it is left out rather than nudged by a few cents
+        self.assertEqual(sensitivity["excluded"], ["net_annual_income"])
+        self.assertNotIn("net_annual_income", sensitivity["parameters"])
+        self.assertEqual(sensitivity["low"].shape, (len(sensitivity["parameters"]), 30))
+
+        sensitivity = sensitivity_analysis(absolute_steps={"net_annual_income": 1200}, **params)
+        self.assertEqual(sensitivity["excluded"], [])
+        i = sensitivity["parameters"].index("net_annual_income")
+        net_worth = buy_vs_rent_batch(**{**params, "net_annual_income": 1200})
+        np.testing.assert_allclose(
+            sensitivity["high"][i], (net_worth["buyer_net_worth"] - net_worth["renter_net_worth"])[0]
+        )
+
+class TestBreakEven(unittest.TestCase):
+
+    def test_break_even_year(self):
+        net_worth = buy_vs_rent_batch(**BUY_VS_RENT_PARAMS)
+        ahead = np.flatnonzero(net_worth["buyer_net_worth"][0] > net_worth["renter_net_worth"][0])
+        self.assertEqual(break_even_year(**BUY_VS_RENT_PARAMS)[0], ahead[0] + 1)
+        never = break_even_year(**{**BUY_VS_RENT_PARAMS, "time_period": 2})
+        self.assertTrue(np.isnan(never[0]))
+
+    def test_solve_curve_across_horizons(self):
+        horizons = np.arange(1, 41)
+        rates = solve_break_even(
+            "mortgage_interest_rate", 0.0, 0.2, horizons=horizons, **BUY_VS_RENT_PARAMS
+        )
+        solved = ~np.isnan(rates)
+        self.assertTrue(solved[-1])
+        self.assertFalse(solved[0])
+        for horizon, rate in zip(horizons[solved], rates[solved]):
+            net_worth = buy_vs_rent_batch(**{
+                **BUY_VS_RENT_PARAMS,
+                "time_period": horizon,
+                "mortgage_interest_rate": rate
+            })
+            self.assertAlmostEqual(
+                net_worth["buyer_net_worth"][0, -1] - net_worth["renter_net_worth"][0, -1],
+                0,
+                places=3
+            )
+
+class TestForecastCache(unittest.TestCase):
+
+    def setUp(self):
+        self.default_cache = financial.forecast_cache
+        financial.forecast_cache = ForecastCache(max_entries=2)
+
+    def tearDown(self):
+        financial.forecast_cache = self.default_cache
+
+    def test_hits_and_copies(self):
+        first = rent_forecasts(30, 14400, 30000, 0.04, 350000, 0.05, 0.2)
+        first["renter_net_worth"] = 0
+        second = rent_forecasts(30.0, 14400.0, 30000, 0.04, 350000, 0.05, 0.2)
+        self.assertNotIn("renter_net_worth", second.columns)
+        self.assertEqual(financial.forecast_cache.stats()["hits"], 1)
+        self.assertEqual(financial.forecast_cache.stats()["misses"], 1)
+
+    def test_year_start_is_part_of_the_key(self):
+        current = rent_forecasts(10, 14400, 30000, 0.04, 350000, 0.05, 0.2)
+        previous = rent_forecasts(10, 14400, 30000, 0.04, 350000, 0.05, 0.2, year_start=2000)
+        self.assertEqual(previous.index[0].year, 2000)
+        self.assertEqual(current.index[0].year, datetime.datetime.now().year)
+        self.assertEqual(financial.forecast_cache.stats()["misses"], 2)
+
+    def test_lru_eviction(self):
+        for rate in (0.01, 0.02, 0.03):
+            buy_forecasts(30, 0, 300000, 0.02, 0.005, 0.15, 250000, rate)
+        buy_forecasts(30, 0, 300000, 0.02, 0.005, 0.15, 250000, 0.01)
+        self.assertEqual(financial.forecast_cache.stats()["misses"], 4)
+        self.assertEqual(financial.forecast_cache.stats()["entries"], 2)
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as directory:
+            financial.forecast_cache = ForecastCache(directory=directory)
+            expected = buy_forecasts(30, 0, 300000, 0.02, 0.005, 0.15, 250000, 0.03)
+            # a new process starts with an empty in-memory tier
+            financial.forecast_cache = ForecastCache(directory=directory)
+            cached = buy_forecasts(30, 0, 300000, 0.02, 0.005, 0.15, 250000, 0.03)
+            self.assertEqual(financial.forecast_cache.stats()["disk_hits"], 1)
+            pd.testing.assert_frame_equal(cached, expected)
+
+    def test_disk_tier_write_errors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            blocker = os.path.join(directory, "not-a-directory")
+            open(blocker, "w").close()
+            financial.forecast_cache = ForecastCache(directory=os.path.join(blocker, "cache"))
+            expected = rent_forecasts(30, 14400, 30000, 0.04, 350000, 0.05, 0.2)
+            cached = rent_forecasts(30, 14400, 30000, 0.04, 350000, 0.05, 0.2)
+            self.assertEqual(financial.forecast_cache.stats()["hits"], 1)
+            pd.testing.assert_frame_equal(cached, expected)
+
+            # a failed write leaves no temporary file behind
+            financial.forecast_cache = ForecastCache(directory=directory)
+            with mock.patch.object(np, "savez", side_effect=OSError("No space left on device")):
+                buy_forecasts(30, 0, 300000, 0.02, 0.005, 0.15, 250000, 0.03)
+            self.assertEqual(
+                [name for _, _, names in os.walk(directory) for name in names], ["not-a-directory"]
+            )
+
+    def test_disk_tier_ignores_pickles(self):
+        with tempfile.TemporaryDirectory() as directory:
+            financial.forecast_cache = ForecastCache(directory=directory)
+            buy_forecasts(30, 0, 300000, 0.02, 0.005, 0.15, 250000, 0.03)
+            (path,) = [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names]
+            with open(path, "wb") as file:
+                pickle.dump(object(), file)
+            financial.forecast_cache = ForecastCache(directory=directory)
+            buy_forecasts(30, 0, 300000, 0.02, 0.005, 0.15, 250000, 0.03)
+            self.assertEqual(financial.forecast_cache.stats()["disk_hits"], 0)
+            self.assertEqual(financial.forecast_cache.stats()["misses"], 1)
+
+    def test_model_version_is_part_of_the_key(self):
+        params = {"time_period": 30}
+        key = ForecastCache.key("rent_forecasts", params)
+        try:
+            financial.CACHE_VERSION += 1
+            financial._model_version.cache_clear()
+            self.assertNotEqual(ForecastCache.key("rent_forecasts", params), key)
+        finally:
+            financial.CACHE_VERSION -= 1
+            financial._model_version.cache_clear()
+        self.assertEqual(ForecastCache.key("rent_forecasts", params), key)
+
+class TestForecastResult(unittest.TestCase):
+
+    def test_merge_matches_pandas(self):
+        house = buy_forecasts(30, 0, 300000, 0.02, 0.005, 0.15, 250000, 0.03, as_frame=False)
+        markets = rent_forecasts(30, 0, 0, 0.04, 250000, 0.05, 0.2, as_frame=False)
+        merged = house.merge(markets, suffixes=("_house", "_markets"))
+        expected = pd.merge(
+            house.to_frame(), markets.to_frame(),
+            left_index=True, right_index=True, suffixes=("_house", "_markets")
+        )
+        pd.testing.assert_frame_equal(merged.to_frame(), expected)
+        self.assertIn("net_annual_income_house", merged)
+        np.testing.assert_array_equal(merged["house_value"], house["house_value"])
+
+    def test_with_columns_and_subset(self):
+        rent = rent_forecasts(10, 12000, 30000, 0.02, 100000, 0.05, 0.2, as_frame=False)
+        rent = rent.with_columns(
+            renter_net_worth=rent["portfolio_value_after_tax"] + rent["cumulative_savings"],
+            constant=1.0
+        )
+        frame = rent.to_frame(["renter_net_worth", "constant"])
+        self.assertEqual(list(frame.columns), ["renter_net_worth", "constant"])
+        self.assertTrue((frame["constant"] == 1).all())
+        self.assertEqual(len(frame.index), 10)
+        with self.assertRaises(ValueError):
+            rent["budget"][0] = 0
+
+    def test_float32_batch(self):
+        batch = rent_forecasts_batch(30, 12000, 30000, 0.02, np.linspace(1e5, 5e5, 100), 0.05, 0.2)
+        double = ForecastResult.from_batch(batch, RENT_FORECAST_COLUMNS, 2024)
+        single = ForecastResult.from_batch(batch, RENT_FORECAST_COLUMNS, 2024, dtype=np.float32)
+        self.assertEqual(single.values.shape, (len(RENT_FORECAST_COLUMNS), 100, 30))
+        self.assertEqual(single.nbytes * 2, double.nbytes)
+        np.testing.assert_allclose(single["portfolio_value"], batch["portfolio_value"], rtol=1e-6)
+
+class TestBuyVsRentAnalysis(unittest.TestCase):
+
+    def test_analysis_matches_batch(self):
+        analysis = buy_vs_rent_analysis(**BUY_VS_RENT_PARAMS)
+        batch = buy_vs_rent_batch(**BUY_VS_RENT_PARAMS)
+        np.testing.assert_allclose(analysis["renter_net_worth"], batch["renter_net_worth"][0])
+        np.testing.assert_allclose(analysis["buyer_net_worth"], batch["buyer_net_worth"][0])
+        for column in ("portfolio_value_after_tax_rent", "portfolio_value_after_tax_buy",
+                       "net_annual_income_house", "net_annual_income_markets", "house_value"):
+            self.assertIn(column, analysis)
+
+class TestBuyVsRentModel(unittest.TestCase):
+
+    def setUp(self):
+        self.model = BuyVsRentModel(year_start=2024, **BUY_VS_RENT_PARAMS)
+        self.model.analysis
+
+    def assert_analysis(self, **params):
+        expected = buy_vs_rent_analysis(**{**BUY_VS_RENT_PARAMS, **params}, year_start=2024)
+        analysis = self.model.analysis
+        self.assertEqual(analysis.columns, expected.columns)
+        np.testing.assert_allclose(analysis.values, expected.values, rtol=1e-12)
+
+    def test_matches_analysis(self):
+        self.assert_analysis()
+        np.testing.assert_array_equal(
+            self.model.net_worth["buyer_net_worth"], self.model.analysis["buyer_net_worth"]
+        )
+
+    def test_rent_input_only_recomputes_rent_side(self):
+        self.model.update(rent_initial_amount=18000)
+        self.assert_analysis(rent_initial_amount=18000)
+        self.assertEqual(self.model.recomputed, ["rent_forecast", "analysis"])
+
+    def test_unchanged_inputs_recompute_nothing(self):
+        self.model.update(**BUY_VS_RENT_PARAMS)
+        self.model.analysis
+        self.assertEqual(self.model.recomputed, [])
+
+    def test_buy_input_leaves_rent_side(self):
+        self.model.update(down_payment_rate=0.3)
+        self.assert_analysis(down_payment_rate=0.3)
+        self.assertNotIn("rent_forecast", self.model.recomputed)
+        self.assertNotIn("house_price", self.model.recomputed)
+
+    def test_horizon_extension_appends_years(self):
+        rent = self.model["rent_forecast"]
+        self.model.update(time_period=45)
+        self.assert_analysis(time_period=45)
+        np.testing.assert_array_equal(self.model["rent_forecast"].values[:, :30], rent.values)
+
+    def test_horizon_reduction_slices(self):
+        self.model.update(time_period=12)
+        self.assert_analysis(time_period=12)
+        self.model.update(time_period=20, market_return=0.06)
+        self.assert_analysis(time_period=20, market_return=0.06)
+
+RENTAL_PARAMS = dict(
+    house_price=200000,
+    airbnb_multiplier=3,
+    usage_pct=0.2,
+    maintenance_pct=0.005,
+    service_fee=0.1,
+    annual_suplies=1200,
+    rent_expectation_rate=0.035,
+    buying_transaction_costs_pct=0.15,
+    down_payment_rate=0.2,
+    annual_interest_rate=0.028,
+    total_time_period_in_years=30,
+    market_return=0.06,
+    private_use_nights=20,
+    inflation_rate=0.02
+)
+
+class TestRentalROI(unittest.TestCase):
+
+    def test_long_term_renter(self):
+        results = rental_roi_forecasts(**RENTAL_PARAMS)
+        house = buy_forecasts(30, 0, 200000, 0.02, 0.005, 0.15, 160000, 0.028)
+        initial_investment = 200000 * (0.2 + 0.15)
+        cashflow = house["house_value"] * 0.035 - house["mortgage_payment"] - house["house_value"] * 0.005
+        net_worth = cashflow.cumsum() + house["house_value"] + house["mortgage_principal_pending_amount"]
+        np.testing.assert_allclose(
+            results["Long term renter cumulative ROI"],
+            (net_worth - initial_investment) / initial_investment
+        )
+        np.testing.assert_allclose(
+            results["Long term renter incremental ROI"], net_worth.pct_change()
+        )
+        np.testing.assert_allclose(
+            results["Market returns cumulative ROI"].iloc[-1], 1.06 ** 30 - 1
+        )
+
+    def test_batch_matches_scalar(self):
+        multipliers = np.array([2, 3, 4, 5])
+        batch = rental_roi_batch(**{**RENTAL_PARAMS, "airbnb_multiplier": multipliers})
+        for i, multiplier in enumerate(multipliers):
+            scalar = rental_roi_forecasts(**{**RENTAL_PARAMS, "airbnb_multiplier": multiplier})
+            for column in RENTAL_ROI_COLUMNS:
+                np.testing.assert_allclose(batch[column][i], scalar[column].values)
+        # a higher multiplier always increases the short term renter ROI
+        self.assertTrue((np.diff(batch["Short term renter cumulative ROI"], axis=0) > 0).all())
+
+def synthetic_history(years=60, seed=0):
+    """Random but reproducible historical series, as a CSV file with house prices."""
+    rng = np.random.default_rng(seed)
+    lines = ["year,market_return,inflation_rate,house_price,mortgage_interest_rate"]
+    house_price = 100.0
+    for year in range(1950, 1950 + years + 1):
+        house_price *= 1 + rng.normal(0.03, 0.05)
+        lines.append(
+            f"{year},{rng.normal(0.07, 0.15)},{rng.normal(0.03, 0.02)},{house_price},{rng.uniform(0.02, 0.08)}"
+        )
+    return io.StringIO("\n".join(lines))
+
+class TestBacktest(unittest.TestCase):
+
+    def setUp(self):
+        self.history = load_historical_series(synthetic_history())
+        self.params = {
+            name: value for name, value in BUY_VS_RENT_PARAMS.items()
+            if name not in financial.HISTORICAL_SERIES
+        }
+
+    def test_load_historical_series(self):
+        # house prices are turned into appreciation rates, losing the first year
+        self.assertEqual(self.history["year"][0], 1951)
+        self.assertEqual(len(self.history["house_appreciation_rate"]), 60)
+        with self.assertRaises(ValueError):
+            load_historical_series(io.StringIO("year,market_return\n2000,0.05\n2002,0.03"))
+
+    def test_every_cohort_matches_its_own_forecast(self):
+        result = backtest_buy_vs_rent(self.history, **self.params)
+        np.testing.assert_array_equal(result["start_year"], np.arange(1951, 1982))
+        self.assertEqual(result["buyer_net_worth"].shape, (31, 30))
+        for cohort in (0, 17, 30):
+            window = slice(cohort, cohort + 30)
+            expected = buy_vs_rent_batch(
+                market_return=self.history["market_return"][window][None],
+                inflation_rate=self.history["inflation_rate"][window][None],
+                house_appreciation_rate=self.history["house_appreciation_rate"][window][None],
+                mortgage_interest_rate=self.history["mortgage_interest_rate"][cohort],
+                **self.params
+            )
+            np.testing.assert_allclose(result["buyer_net_worth"][cohort], expected["buyer_net_worth"][0])
+            np.testing.assert_allclose(result["renter_net_worth"][cohort], expected["renter_net_worth"][0])
+
+    def test_distribution_across_cohorts(self):
+        result = backtest_buy_vs_rent(self.history, percentiles=(0, 50, 100), **self.params)
+        np.testing.assert_allclose(result["difference percentiles"][0], result["difference"].min(axis=0))
+        np.testing.assert_allclose(result["difference percentiles"][2], result["difference"].max(axis=0))
+        np.testing.assert_allclose(result["buy_wins_share"], (result["difference"] > 0).mean(axis=0))
+
+    def test_historical_rates_can_not_be_given(self):
+        with self.assertRaises(ValueError):
+            backtest_buy_vs_rent(self.history, market_return=0.05, **self.params)
+        with self.assertRaises(ValueError):
+            backtest_buy_vs_rent(self.history, **{**self.params, "time_period": 70})
+
+    def test_buy_for_rent(self):
+        params = {
+            name: value for name, value in RENTAL_PARAMS.items()
+            if name not in ("market_return", "inflation_rate", "annual_interest_rate")
+        }
+        result = backtest_buy_for_rent(self.history, **params)
+        self.assertEqual(result["Long term renter cumulative ROI percentiles"].shape, (5, 30))
+        expected = rental_roi_batch(
+            market_return=self.history["market_return"][5:35][None],
+            inflation_rate=self.history["inflation_rate"][5:35][None],
+            house_appreciation_rate=self.history["house_appreciation_rate"][5:35][None],
+            annual_interest_rate=self.history["mortgage_interest_rate"][5],
+            **params
+        )
+        for column in RENTAL_ROI_COLUMNS:
+            np.testing.assert_allclose(result[column][5], expected[column][0])
@@ -0,0 +1,386 @@
+"""Unit tests for the googlelib.py module, against a local fake of the Calendar API.
+"""
+
+from shared import googlelib
+from shared.googlelib import (
+    CalendarCache,
+    CalendarClient,
+    EventDecoder,
+    EventStore,
+    calendar_client,
+    expand_recurring_events,
+    fetch_event_frame,
+    fetch_events,
+    iter_calendar_events,
+    sync_calendar_events
+)
+from shared.tests.fake_calendar import FakeCalendarService
+from datetime import datetime, timezone
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+import numpy as np
+import os
+import pandas as pd
+import threading
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+def make_event(event_id: str, summary: str = "Meeting", start: str = "2024-01-08T10:00:00+01:00",
+               end: str = "2024-01-08T11:00:00+01:00") -> dict:
+    return {"id": event_id, "summary": summary, "start": {"dateTime": start}, "end": {"dateTime": end}}
+
+class TestIncrementalSync(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = EventStore(os.path.join(self.directory.name, "events.sqlite"))
+        self.service = FakeCalendarService({
+            "work": [make_event(str(i)) for i in range(3000)],
+            "home": [make_event("h1", "Gym")],
+        })
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def stored_ids(self, calendar_id: str) -> set:
+        return {event["id"] for event in self.store.events([calendar_id])}
+
+    def test_full_then_incremental_sync(self):
+        self.assertEqual(sync_calendar_events(self.service, "work", self.store), 3000)
+        self.assertEqual(len(self.stored_ids("work")), 3000)
+        # two pages were needed for the full sync
+        self.assertEqual(len(self.service.requests), 2)
+
+        self.service.put("work", make_event("1", "Renamed"))
+        self.service.put("work", make_event("new"))
+        self.service.delete("work", "2")
+        self.assertEqual(sync_calendar_events(self.service, "work", self.store), 3)
+        self.assertIsNotNone(self.service.requests[-1]["syncToken"])
+
+        events = {event["id"]: event for event in self.store.events(["work"])}
+        self.assertEqual(events["1"]["summary"], "Renamed")
+        self.assertIn("new", events)
+        self.assertNotIn("2", events)
+        self.assertEqual(self.stored_ids("home"), set())
+
+    def test_nothing_changed(self):
+        sync_calendar_events(self.service, "home", self.store)
+        self.assertEqual(sync_calendar_events(self.service, "home", self.store), 0)
+        self.assertEqual(self.stored_ids("home"), {"h1"})
+
+    def test_full_resync_on_invalid_token(self):
+        sync_calendar_events(self.service, "home", self.store)
+        # a deletion the store can no longer hear about through the old token
+        self.service.delete("home", "h1")
+        self.service.put("home", make_event("h2", "Yoga"))
+        self.service.invalidate_sync_tokens()
+        sync_calendar_events(self.service, "home", self.store)
+        self.assertIsNone(self.service.requests[-1]["syncToken"])
+        self.assertEqual(self.stored_ids("home"), {"h2"})
+        self.assertTrue(self.store.sync_token("home").startswith("1:"))
+
+class TestStreamingFetch(unittest.TestCase):
+
+    def setUp(self):
+        self.service = FakeCalendarService({
+            "work": [
+                make_event(str(day), start=f"2024-01-{day:02d}T10:00:00+01:00", end=f"2024-01-{day:02d}T11:00:00+01:00")
+                for day in range(31, 0, -1)
+            ] + [{"id": "holiday", "start": {"date": "2024-01-15"}, "end": {"date": "2024-01-16"}}],
+        })
+
+    def test_follows_page_tokens(self):
+        pages = list(iter_calendar_events(self.service, "work", page_size=10))
+        self.assertEqual([len(page) for page in pages], [10, 10, 10, 2])
+        starts = [event["start"].get("dateTime", event["start"].get("date")) for page in pages for event in page]
+        self.assertEqual(starts[0], "2024-01-01T10:00:00+01:00")
+        self.assertEqual(len(starts), 32)
+
+    def test_pushes_window_and_fields_down(self):
+        pages = iter_calendar_events(
+            self.service, "work",
+            time_min=datetime(2024, 1, 10, tzinfo=timezone.utc),
+            time_max=datetime(2024, 1, 20, tzinfo=timezone.utc),
+            fields="items(id,start,end)"
+        )
+        events = [event for page in pages for event in page]
+        # days 10 to 19 and the all-day holiday
+        self.assertEqual(len(events), 11)
+        request = self.service.requests[-1]
+        self.assertEqual(request["timeMin"], "2024-01-10T00:00:00Z")
+        self.assertEqual(request["timeMax"], "2024-01-20T00:00:00Z")
+        self.assertIn("nextPageToken", request["fields"])
+
+    def test_store_window(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = EventStore(os.path.join(directory, "events.sqlite"))
+            sync_calendar_events(self.service, "work", store)
+            events = store.events(
+                ["work"], time_min=datetime(2024, 1, 14, 12), time_max=datetime(2024, 1, 16, 9, 30)
+            )
+        self.assertEqual([event["id"] for event in events], ["16", "15", "holiday"])
+
+class TestConcurrentFetch(unittest.TestCase):
+
+    def setUp(self):
+        backoff = mock.patch.object(googlelib, "RETRY_BACKOFF", 0.0)
+        backoff.start()
+        self.addCleanup(backoff.stop)
+        self.service = FakeCalendarService(
+            {f"calendar{i}": [make_event(f"{i}-{j}") for j in range(3)] for i in range(12)},
+            latency=0.05
+        )
+        self.calendar_ids = [f"calendar{i}" for i in range(12)]
+
+    def test_same_result_as_sequential(self):
+        sequential = fetch_events(lambda: self.service, self.calendar_ids, max_workers=1)
+        concurrent = fetch_events(lambda: self.service, self.calendar_ids, max_workers=4)
+        self.assertEqual(concurrent, sequential)
+        self.assertEqual(concurrent[0]["id"], "11-2")
+        self.assertEqual(concurrent[-1]["id"], "0-0")
+
+    def test_speedup_with_latency(self):
+        start = time.perf_counter()
+        fetch_events(lambda: self.service, self.calendar_ids, max_workers=1)
+        sequential = time.perf_counter() - start
+        start = time.perf_counter()
+        fetch_events(lambda: self.service, self.calendar_ids, max_workers=12)
+        concurrent = time.perf_counter() - start
+        # 12 round trips of 50ms one after the other, or all at once
+        self.assertGreater(sequential, 0.6)
+        self.assertLess(concurrent, sequential / 3)
+
+    def test_retries_transient_errors(self):
+        self.service.failures = [503, 429]
+        events = fetch_events(lambda: self.service, self.calendar_ids[:1], retries=2)
+        self.assertEqual(len(events), 3)
+
+        self.service.failures = [503, 503, 503]
+        with self.assertRaises(HttpError):
+            fetch_events(lambda: self.service, self.calendar_ids[:1], retries=2)
+
+        self.service.failures = [404]
+        with self.assertRaises(HttpError):
+            fetch_events(lambda: self.service, self.calendar_ids[:1], retries=2)
+        self.assertEqual(self.service.failures, [])
+
+class TestCalendarClient(unittest.TestCase):
+
+    def setUp(self):
+        self.credentials = Credentials(token="token")
+        self.fake = FakeCalendarService(
+            {"id-work": [make_event("1")], "id-home": [make_event("2")]},
+            names={"id-work": "Work", "id-home": "Home"}
+        )
+
+    def test_one_client_per_credentials(self):
+        client = calendar_client(self.credentials)
+        self.assertIs(calendar_client(self.credentials), client)
+        self.assertIsNot(calendar_client(Credentials(token="other")), client)
+
+    def test_service_built_once_per_thread(self):
+        client = CalendarClient(self.credentials)
+        service = client.service
+        self.assertIs(client.service, service)
+        other_thread = []
+        thread = threading.Thread(target=lambda: other_thread.append(client.service))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other_thread[0], service)
+
+    def test_calendars_resolved_once(self):
+        client = CalendarClient(self.credentials)
+        client.service_factory = lambda: self.fake
+        self.assertEqual(client.calendar_ids(["Home"]), ["id-home"])
+        events = client.fetch_events(["Work", "Home"], max_workers=1)
+        self.assertEqual([event["id"] for event in events], ["2", "1"])
+        calendar_list_requests = [r for r in self.fake.requests if r.get("resource") == "calendarList"]
+        self.assertEqual(len(calendar_list_requests), 1)
+
+class TestEventDecoder(unittest.TestCase):
+
+    def test_decodes_timed_and_all_day_events(self):
+        decoder = EventDecoder()
+        decoder.add([
+            make_event("1", " Work ", "2024-01-01T10:00:00+01:00", "2024-01-01T11:30:00+01:00"),
+            {"id": "2", "summary": "Holiday", "start": {"date": "2024-01-02"}, "end": {"date": "2024-01-03"}},
+            {"id": "3", "status": "cancelled"},
+        ], "work")
+        decoder.add([make_event("4", "Work", "2024-01-03T08:00:00Z", "2024-01-03T09:00:00Z")], "home")
+        frame = decoder.to_frame()
+
+        self.assertEqual(list(frame.columns), EventDecoder.COLUMNS)
+        self.assertEqual(frame["start"].dtype, np.int64)
+        self.assertIsInstance(frame["summary"].dtype, pd.CategoricalDtype)
+        self.assertEqual(list(frame["summary"].cat.categories), ["Work", "Holiday"])
+        self.assertEqual(list(frame["calendar_id"]), ["home", "work", "work"])
+        self.assertEqual(list(frame["all_day"]), [False, True, False])
+        self.assertEqual(frame["start"].iloc[2], pd.Timestamp("2024-01-01T09:00:00Z").timestamp())
+        self.assertEqual(frame["end"].iloc[2] - frame["start"].iloc[2], 90 * 60)
+        self.assertEqual(frame["start"].iloc[1], pd.Timestamp("2024-01-02T00:00:00Z").timestamp())
+
+    def test_store_and_stream_decode_alike(self):
+        events = {
+            "work": [make_event(str(i), "Focus", f"2024-01-{i:02d}T10:00:00Z", f"2024-01-{i:02d}T12:00:00Z") for i in range(1, 11)],
+            "home": [{"id": "h", "summary": "Trip", "start": {"date": "2024-01-05"}, "end": {"date": "2024-01-07"}}],
+        }
+        window = dict(time_min=datetime(2024, 1, 3, tzinfo=timezone.utc), time_max=datetime(2024, 1, 9, tzinfo=timezone.utc))
+        streamed = fetch_event_frame(lambda: FakeCalendarService(events), ["work", "home"], **window)
+        with tempfile.TemporaryDirectory() as directory:
+            store = EventStore(os.path.join(directory, "events.sqlite"))
+            stored = fetch_event_frame(lambda: FakeCalendarService(events), ["work", "home"], store=store, **window)
+
+        self.assertEqual(len(streamed), 7)
+        pd.testing.assert_frame_equal(
+            streamed.astype({"calendar_id": str, "summary": str}),
+            stored.astype({"calendar_id": str, "summary": str})
+        )
+
+def make_standup() -> list:
+    """A weekly recurring event in Madrid with an excluded, a moved and a cancelled instance."""
+    return [
+        {
+            "id": "standup", "summary": "Standup",
+            "start": {"dateTime": "2024-03-18T09:00:00+01:00", "timeZone": "Europe/Madrid"},
+            "end": {"dateTime": "2024-03-18T09:15:00+01:00", "timeZone": "Europe/Madrid"},
+            "recurrence": ["RRULE:FREQ=WEEKLY;BYDAY=MO", "EXDATE;TZID=Europe/Madrid:20240401T090000"],
+        },
+        {
+            "id": "standup_20240408T070000Z", "recurringEventId": "standup", "summary": "Standup (moved)",
+            "originalStartTime": {"dateTime": "2024-04-08T09:00:00+02:00", "timeZone": "Europe/Madrid"},
+            "start": {"dateTime": "2024-04-09T10:00:00+02:00"}, "end": {"dateTime": "2024-04-09T10:15:00+02:00"},
+        },
+        {
+            "id": "standup_20240415T070000Z", "recurringEventId": "standup", "status": "cancelled",
+            "originalStartTime": {"dateTime": "2024-04-15T09:00:00+02:00", "timeZone": "Europe/Madrid"},
+        },
+    ]
+
+class TestRecurringEvents(unittest.TestCase):
+
+    window = dict(time_min=datetime(2024, 3, 20, tzinfo=timezone.utc), time_max=datetime(2024, 5, 1, tzinfo=timezone.utc))
+
+    def test_expands_within_window(self):
+        events = sorted(expand_recurring_events(make_standup(), **self.window), key=lambda event: event["id"])
+        self.assertEqual(
+            [event["id"] for event in events],
+            ["standup_20240325T080000Z", "standup_20240408T070000Z", "standup_20240422T070000Z", "standup_20240429T070000Z"]
+        )
+        # the local time is kept across the DST change, the moved instance is the modified one
+        self.assertEqual(events[0]["start"]["dateTime"], "2024-03-25T09:00:00+01:00")
+        self.assertEqual(events[2]["start"]["dateTime"], "2024-04-22T09:00:00+02:00")
+        self.assertEqual(events[2]["end"]["dateTime"], "2024-04-22T09:15:00+02:00")
+        self.assertEqual(events[1]["summary"], "Standup (moved)")
+        self.assertNotIn("recurrence", events[0])
+
+    def test_all_day_and_bounded_rules(self):
+        holiday = {
+            "id": "holiday", "summary": "Holiday", "start": {"date": "2024-03-01"}, "end": {"date": "2024-03-02"},
+            "recurrence": ["RRULE:FREQ=MONTHLY;UNTIL=20240601T000000Z", "EXDATE;VALUE=DATE:20240401"],
+        }
+        events = list(expand_recurring_events([holiday], time_min=datetime(2024, 3, 1, 12, tzinfo=timezone.utc)))
+        self.assertEqual([event["start"]["date"] for event in events], ["2024-03-01", "2024-05-01", "2024-06-01"])
+
+    def test_store_expands_locally(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "events.sqlite")
+            service = FakeCalendarService({"work": make_standup() + [make_event("1", "Review", "2024-04-02T10:00:00Z", "2024-04-02T11:00:00Z")]})
+            store = EventStore(path, single_events=False)
+            sync_calendar_events(service, "work", store)
+            self.assertFalse(service.requests[-1]["singleEvents"])
+            frame = store.decode(["work"], **self.window).to_frame()
+            self.assertEqual(list(frame["summary"]).count("Standup"), 3)
+            self.assertEqual(set(frame["summary"]), {"Standup", "Standup (moved)", "Review"})
+
+            # a new cancelled instance is received incrementally and kept out of the expansion
+            service.put("work", {
+                "id": "standup_20240422T070000Z", "recurringEventId": "standup", "status": "cancelled",
+                "originalStartTime": {"dateTime": "2024-04-22T09:00:00+02:00", "timeZone": "Europe/Madrid"},
+            })
+            sync_calendar_events(service, "work", store)
+            events = store.events(["work"], **self.window)
+            self.assertEqual(
+                [event["id"] for event in events],
+                ["standup_20240429T070000Z", "standup_20240408T070000Z", "1", "standup_20240325T080000Z"]
+            )
+
+            # deleting the recurring event deletes its instances
+            service.delete("work", "standup")
+            sync_calendar_events(service, "work", store)
+            self.assertEqual([event["id"] for event in store.events(["work"])], ["1"])
+
+    def test_switching_mode_resyncs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "events.sqlite")
+            service = FakeCalendarService({"work": make_standup()})
+            sync_calendar_events(service, "work", EventStore(path))
+            sync_calendar_events(service, "work", EventStore(path, single_events=False))
+            self.assertIsNone(service.requests[-1]["syncToken"])
+            sync_calendar_events(service, "work", EventStore(path))
+            self.assertIsNone(service.requests[-1]["syncToken"])
+
+class TestCalendarCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.cache = CalendarCache(ttl=60, clock=lambda: self.now)
+        self.fake = FakeCalendarService(
+            {
+                "id-work": [make_event("1", "Review"), make_event("2", "Focus")],
+                "id-home": [make_event("3", "Gym")],
+            },
+            names={"id-work": "Work", "id-home": "Home"}
+        )
+
+    def client(self, token: str = "token") -> CalendarClient:
+        client = CalendarClient(Credentials(token=token))
+        client.service_factory = lambda: self.fake
+        return client
+
+    def event_requests(self) -> int:
+        return len([request for request in self.fake.requests if "calendarId" in request])
+
+    def test_hits_until_expired(self):
+        client = self.client()
+        frame = self.cache.event_frame(client, ["Work"], max_workers=1)
+        self.assertIs(self.cache.event_frame(client, ["Work"], max_workers=1), frame)
+        self.assertEqual(self.event_requests(), 1)
+        self.now = 61
+        self.cache.event_frame(client, ["Work"], max_workers=1)
+        self.assertEqual(self.event_requests(), 2)
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["expirations"]), (1, 2, 1))
+
+    def test_scoped_per_account(self):
+        self.cache.calendars(self.client("alice"))
+        self.cache.calendars(self.client("alice"))
+        self.cache.calendars(self.client("bob"))
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["accounts"]), (1, 2, 2))
+        self.cache.clear(self.client("bob").account)
+        self.assertEqual(self.cache.stats()["accounts"], 1)
+
+    def test_subset_selection_reuses_cached_frame(self):
+        client = self.client()
+        self.cache.event_frame(client, ["Work", "Home"], max_workers=1)
+        work = self.cache.event_frame(client, ["Work"], max_workers=1)
+        self.assertEqual(self.event_requests(), 2)
+        self.assertEqual(self.cache.stats()["subset_hits"], 1)
+        self.assertEqual(sorted(work["summary"]), ["Focus", "Review"])
+        self.assertEqual(list(work["calendar_id"].cat.categories), ["id-work"])
+        pd.testing.assert_frame_equal(work, client.fetch_event_frame(["Work"], max_workers=1))
+        # different arguments are not reused
+        self.cache.event_frame(client, ["Work"], max_workers=1, time_min=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    def test_evicts_least_recently_used_by_size(self):
+        client = self.client()
+        work = self.cache.event_frame(client, ["Work"], max_workers=1)
+        self.cache.max_bytes = int(self.cache.stats()["bytes"] * 1.5)
+        self.cache.event_frame(client, ["Home"], max_workers=1)
+        stats = self.cache.stats()
+        self.assertEqual((stats["entries"], stats["evictions"]), (1, 1))
+        self.assertLessEqual(stats["bytes"], stats["max_bytes"])
+        self.assertIsNot(self.cache.event_frame(client, ["Work"], max_workers=1), work)
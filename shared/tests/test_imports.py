@@ -0,0 +1,54 @@
+"""Import time of the shared modules, measured in fresh interpreters.
+
+Heavy dependencies are only imported on first use, so that app boot and the
+batch and sweep worker processes start fast.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# maximum import time of a module in seconds, NumPy alone takes about 0.1 s
+IMPORT_TIME_BUDGET = float(os.environ.get("IMPORT_TIME_BUDGET", 0.5))
+
+LAZY_DEPENDENCIES = ("pandas", "numpy_financial", "googleapiclient", "google_auth_oauthlib", "httplib2", "pyarrow", "dateutil")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def run_python(code: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+def measure_import(module: str) -> dict:
+    return run_python(
+        "import json, sys, time\n"
+        "started = time.perf_counter()\n"
+        f"import {module}\n"
+        "seconds = time.perf_counter() - started\n"
+        f"print(json.dumps({{'seconds': seconds, 'modules': [m for m in {LAZY_DEPENDENCIES!r} if m in sys.modules]}}))"
+    )
+
+class TestImports(unittest.TestCase):
+
+    def test_shared_modules_import_lazily(self):
+        for module in ("shared.financial", "shared.googlelib", "shared.sweep", "shared.profiling"):
+            with self.subTest(module=module):
+                result = measure_import(module)
+                self.assertEqual(result["modules"], [])
+                self.assertLess(result["seconds"], IMPORT_TIME_BUDGET)
+
+    def test_financial_core_without_pandas(self):
+        result = run_python(
+            "import json, sys\n"
+            "sys.modules['pandas'] = None\n"
+            "from shared.financial import buy_vs_rent_batch, amortization_schedule\n"
+            "from shared.benchmarks import BUY_VS_RENT_PARAMS\n"
+            "net_worth = buy_vs_rent_batch(time_period=30, **BUY_VS_RENT_PARAMS)['buyer_net_worth']\n"
+            "schedule = amortization_schedule(250000, 0.03, 30)\n"
+            "print(json.dumps({'years': net_worth.shape[1], 'months': schedule['balance'].shape[1]}))"
+        )
+        self.assertEqual(result, {"years": 30, "months": 360})
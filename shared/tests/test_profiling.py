@@ -0,0 +1,92 @@
+"""Unit tests for the profiling.py module.
+"""
+
+from shared import financial
+from shared.profiling import Profile, active_profile, stage, timed
+from shared.tests.test_financial import BUY_VS_RENT_PARAMS
+import contextvars
+import json
+import numpy as np
+import tracemalloc
+import unittest
+
+@timed
+def allocate(size: int):
+    return np.ones(size)
+
+class TestProfiling(unittest.TestCase):
+
+    def tearDown(self):
+        if active_profile() is not None:
+            active_profile().finish()
+
+    def test_no_active_profile(self):
+        with stage("ignored"):
+            self.assertEqual(len(allocate(3)), 3)
+        self.assertIsNone(active_profile())
+
+    def test_nested_stages(self):
+        profile = Profile("test").activate()
+        with stage("outer"):
+            with stage("inner"):
+                pass
+            allocate(10)
+        profile.finish()
+
+        self.assertIsNone(active_profile())
+        self.assertEqual(
+            [record["stage"] for record in profile.records],
+            ["outer/inner", "outer/test_profiling.allocate", "outer"]
+        )
+        self.assertGreaterEqual(profile.records[-1]["seconds"], profile.records[0]["seconds"])
+        exported = json.loads(profile.to_json())
+        self.assertEqual(exported["name"], "test")
+        self.assertEqual(len(exported["stages"]), 3)
+
+    def test_allocations(self):
+        profile = Profile("test", track_allocations=True).activate()
+        with stage("outer"):
+            kept = allocate(1_000_000)
+            allocate(2_000_000)
+        profile.finish()
+
+        allocated = {record["stage"]: record for record in profile.records}
+        self.assertGreaterEqual(allocated["outer"]["allocated_bytes"], kept.nbytes)
+        self.assertGreaterEqual(allocated["outer"]["peak_bytes"], 3 * kept.nbytes)
+        # the second array is freed by the end of the stage
+        self.assertLess(allocated["outer"]["allocated_bytes"], 2 * kept.nbytes)
+
+    def test_tracing_stops_when_the_run_raises(self):
+        with self.assertRaises(RuntimeError):
+            with Profile("test", track_allocations=True):
+                self.assertTrue(tracemalloc.is_tracing())
+                raise RuntimeError("rerun failed")
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertIsNone(active_profile())
+
+    def test_one_tracer_at_a_time(self):
+        first = Profile("first", track_allocations=True).activate()
+        # another session, e.g. in another thread of the Streamlit server
+        second = contextvars.copy_context().run(Profile("second", track_allocations=True).activate)
+        self.assertFalse(second.track_allocations)
+        second.finish()
+        self.assertTrue(tracemalloc.is_tracing())
+        first.finish()
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_financial_stages(self):
+        profile = Profile("test").activate()
+        financial.sensitivity_analysis(**BUY_VS_RENT_PARAMS)
+        financial.buy_vs_rent_analysis(**BUY_VS_RENT_PARAMS)
+        summary = profile.finish().summary()
+        self.assertEqual(
+            list(summary.index.sort_values()),
+            [
+                "financial.buy_vs_rent_analysis",
+                "financial.buy_vs_rent_analysis/financial.buy_forecasts",
+                "financial.buy_vs_rent_analysis/financial.rent_forecasts",
+                "financial.sensitivity_analysis",
+            ]
+        )
+        self.assertEqual(summary.loc["financial.buy_vs_rent_analysis/financial.rent_forecasts", "calls"], 2)
+        self.assertEqual(list(summary.columns), ["calls", "seconds", "max_seconds"])
@@ -0,0 +1,47 @@
+"""Unit tests for the sweep.py module.
+"""
+
+from shared import financial
+from shared.sweep import parallel_sweep, parameter_grid
+from shared.tests.test_financial import BUY_VS_RENT_PARAMS, RENTAL_PARAMS
+import numpy as np
+import unittest
+
+class TestParallelSweep(unittest.TestCase):
+
+    def test_parameter_grid(self):
+        grid = parameter_grid(budget=[1, 2, 3], time_period=[10, 20])
+        self.assertEqual(list(grid["budget"]), [1, 1, 2, 2, 3, 3])
+        self.assertEqual(list(grid["time_period"]), [10, 20, 10, 20, 10, 20])
+
+    def test_matches_single_batch(self):
+        grid = parameter_grid(
+            down_payment_rate=np.linspace(0.1, 0.5, 5),
+            mortgage_interest_rate=np.linspace(0.01, 0.06, 6),
+            time_period=np.arange(5, 31, 5),
+        )
+        fixed = {name: value for name, value in BUY_VS_RENT_PARAMS.items() if name not in grid}
+        outputs = ("renter_net_worth", "buyer_net_worth")
+        expected = financial.buy_vs_rent_batch(**grid, **fixed)
+        for processes in (1, 2):
+            results = parallel_sweep(
+                financial.buy_vs_rent_batch, grid, outputs, processes=processes, chunk_size=40, **fixed
+            )
+            for output in outputs:
+                self.assertEqual(results[output].shape, (180, 30))
+                np.testing.assert_array_equal(results[output], expected[output])
+
+    def test_rental_roi_as_float32(self):
+        grid = parameter_grid(total_time_period_in_years=[10, 25], market_return=[0.03, 0.05, 0.07])
+        fixed = {name: value for name, value in RENTAL_PARAMS.items() if name not in grid}
+        results = parallel_sweep(
+            financial.rental_roi_batch, grid, ["Long term renter net worth"], processes=2, chunk_size=2,
+            dtype=np.float32, **fixed
+        )
+        expected = financial.rental_roi_batch(**grid, **fixed)["Long term renter net worth"]
+        self.assertEqual(results["Long term renter net worth"].dtype, np.float32)
+        np.testing.assert_allclose(results["Long term renter net worth"], expected, rtol=1e-6)
+
+    def test_horizon_is_required(self):
+        with self.assertRaises(ValueError):
+            parallel_sweep(financial.rent_forecasts_batch, {"budget": [1.0]}, ["savings"], time_period=0)